@@ -0,0 +1,304 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from sqlmodel import col, select
+
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0")
+CACHE_TTL = float(os.getenv("CACHE_TTL", "60"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+# Several worker processes serve the app: uvicorn and gunicorn start
+# WEB_CONCURRENCY workers, and multiprocess metrics imply more than one.
+MULTIPLE_WORKERS = int(os.getenv("WEB_CONCURRENCY", "1")) > 1 or bool(
+    os.getenv("PROMETHEUS_MULTIPROC_DIR")
+)
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryBackend:
+    """Bounded LRU with a per-entry TTL, local to this process."""
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, ttl: float = CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def get_many(self, keys: list[str]) -> dict[str, str]:
+        now = time.monotonic()
+        found = {}
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                expires_at, value = entry
+                if expires_at <= now:
+                    del self._entries[key]
+                    continue
+                self._entries.move_to_end(key)
+                found[key] = value
+        return found
+
+    async def set_many(self, values: dict[str, str]):
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            for key, value in values.items():
+                self._entries[key] = (expires_at, value)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    async def delete(self, keys: list[str]):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    async def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class RedisBackend:
+    """Shared cache for multi-worker deployments, on any redis.asyncio client."""
+
+    def __init__(self, client, ttl: float = CACHE_TTL, prefix: str = "catalog:"):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    async def get_many(self, keys: list[str]) -> dict[str, str]:
+        if not keys:
+            return {}
+        values = await self.client.mget([self.prefix + key for key in keys])
+        return {key: value for key, value in zip(keys, values) if value is not None}
+
+    async def set_many(self, values: dict[str, str]):
+        async with self.client.pipeline(transaction=False) as pipe:
+            for key, value in values.items():
+                pipe.set(self.prefix + key, value, px=int(self.ttl * 1000))
+            await pipe.execute()
+
+    async def delete(self, keys: list[str]):
+        if keys:
+            await self.client.delete(*(self.prefix + key for key in keys))
+
+    async def clear(self):
+        keys = [key async for key in self.client.scan_iter(match=self.prefix + "*")]
+        if keys:
+            await self.client.delete(*keys)
+
+
+class NullBackend:
+    """Caches nothing, for when a per-process cache would go stale."""
+
+    async def get_many(self, keys: list[str]) -> dict[str, str]:
+        return {}
+
+    async def set_many(self, values: dict[str, str]):
+        pass
+
+    async def delete(self, keys: list[str]):
+        pass
+
+    async def clear(self):
+        pass
+
+
+class MemoryVersions:
+    """Version counters by name, local to this process.
+
+    Caches tag what they store with the versions it was read at and bump
+    them on writes; a changed version means the stored copy is stale.
+    """
+
+    def __init__(self):
+        # Changes on every start so versions from before a restart never
+        # match counters that started over from zero.
+        self.epoch = uuid.uuid4().hex
+        self._versions: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, names) -> tuple[str, dict[str, int]]:
+        """The epoch and the current version of each of `names`."""
+        with self._lock:
+            return self.epoch, {name: self._versions.get(name, 0) for name in names}
+
+    async def get_async(self, names) -> tuple[str, dict[str, int]]:
+        return self.get(names)
+
+    def bump(self, names):
+        with self._lock:
+            for name in names:
+                self._versions[name] = self._versions.get(name, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._versions.clear()
+
+
+class RedisVersions:
+    """Version counters shared by all workers, in one Redis hash.
+
+    `client` is a redis.Redis for session events and other sync callers,
+    whose calls block for a round trip; async code uses `get_async` on the
+    redis.asyncio `async_client`. The epoch is a field of the hash, so
+    counters lost with the hash start over under a new epoch.
+    """
+
+    EPOCH = "_epoch"
+
+    def __init__(self, client, async_client, key: str = "catalog:versions"):
+        self.client = client
+        self.async_client = async_client
+        self.key = key
+
+    @staticmethod
+    def _versions(names, epoch, values) -> tuple[str, dict[str, int]]:
+        return epoch.decode(), {
+            name: int(value or 0) for name, value in zip(names, values)
+        }
+
+    def get(self, names) -> tuple[str, dict[str, int]]:
+        names = list(names)
+        fields = [self.EPOCH, *names]
+        epoch, *values = self.client.hmget(self.key, fields)
+        if epoch is None:
+            self.client.hsetnx(self.key, self.EPOCH, uuid.uuid4().hex)
+            epoch, *values = self.client.hmget(self.key, fields)
+        return self._versions(names, epoch, values)
+
+    async def get_async(self, names) -> tuple[str, dict[str, int]]:
+        names = list(names)
+        fields = [self.EPOCH, *names]
+        epoch, *values = await self.async_client.hmget(self.key, fields)
+        if epoch is None:
+            await self.async_client.hsetnx(self.key, self.EPOCH, uuid.uuid4().hex)
+            epoch, *values = await self.async_client.hmget(self.key, fields)
+        return self._versions(names, epoch, values)
+
+    def bump(self, names):
+        with self.client.pipeline(transaction=False) as pipe:
+            for name in names:
+                pipe.hincrby(self.key, name, 1)
+            pipe.execute()
+
+    def clear(self):
+        self.client.delete(self.key)
+
+
+def table_version_name(table: str) -> str:
+    """Name of the version that commits writing to `table` bump."""
+    return f"table:{table}"
+
+
+class EntityCache:
+    """Read-through cache of small catalog rows keyed by model and id.
+
+    Entries are detached copies, stored with the version of their table
+    (see `table_version_name`) taken before the row was read. Commits bump
+    that version, so an entry read before a write, even one stored after
+    it, is never served again. Handlers that change a cached model still
+    call `invalidate` after committing, which frees the entry at once.
+    """
+
+    def __init__(self, backend, versions):
+        self.backend = backend
+        self.versions = versions
+
+    @staticmethod
+    def _key(model, ident) -> str:
+        return f"{model.__tablename__}:{ident}"
+
+    async def _version(self, model) -> list | None:
+        if self.versions is None:
+            return None
+        name = table_version_name(model.__tablename__)
+        epoch, versions = await self.versions.get_async([name])
+        return [epoch, versions[name]]
+
+    async def get_many(self, session, model, ids) -> dict:
+        ids = list(dict.fromkeys(ids))
+        if not ids:
+            return {}
+
+        # Taken before reading, so a write racing the read makes the stored
+        # entries stale rather than wrongly current.
+        version = await self._version(model)
+        cached = await self.backend.get_many([self._key(model, i) for i in ids])
+        found = {}
+        for ident in ids:
+            value = cached.get(self._key(model, ident))
+            if value is None:
+                continue
+            entry = json.loads(value)
+            if entry["version"] == version:
+                found[ident] = model.model_validate(entry["row"])
+
+        missing = [ident for ident in ids if ident not in found]
+        if missing:
+            rows = (
+                await session.exec(select(model).where(col(model.id).in_(missing)))
+            ).all()
+            await self.backend.set_many(
+                {
+                    self._key(model, row.id): json.dumps(
+                        {"version": version, "row": row.model_dump(mode="json")}
+                    )
+                    for row in rows
+                }
+            )
+            found |= {row.id: model.model_validate(row.model_dump()) for row in rows}
+        return found
+
+    async def get(self, session, model, ident):
+        if ident is None:
+            return None
+        return (await self.get_many(session, model, [ident])).get(ident)
+
+    async def invalidate(self, model, *ids):
+        await self.backend.delete([self._key(model, ident) for ident in ids])
+
+
+def _create_backend():
+    if CACHE_BACKEND == "redis":
+        from redis.asyncio import Redis
+
+        return RedisBackend(Redis.from_url(CACHE_REDIS_URL))
+    if MULTIPLE_WORKERS:
+        logger.warning(
+            "Entity cache disabled: several workers run with CACHE_BACKEND=memory"
+        )
+        return NullBackend()
+    return MemoryBackend()
+
+
+def _create_versions():
+    if CACHE_BACKEND == "redis":
+        from redis import Redis
+        from redis.asyncio import Redis as AsyncRedis
+
+        return RedisVersions(
+            Redis.from_url(CACHE_REDIS_URL), AsyncRedis.from_url(CACHE_REDIS_URL)
+        )
+    if MULTIPLE_WORKERS:
+        # Each worker would only see its own writes.
+        logger.warning(
+            "ETags and in-memory catalog caches disabled: "
+            "several workers run with CACHE_BACKEND=memory"
+        )
+        return None
+    return MemoryVersions()
+
+
+# Versions of cached things: tables for ETags, the entity cache and the
+# category tree, and variant indexes. None when no versions can be kept
+# that all workers see, which turns those caches off.
+cache_versions = _create_versions()
+entity_cache = EntityCache(_create_backend(), cache_versions)
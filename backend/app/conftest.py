@@ -1,3 +1,5 @@
+import asyncio
+from functools import partial
 from unittest.mock import patch
 
 import pytest
@@ -5,8 +7,12 @@ from fastapi.testclient import TestClient
 from sqlalchemy.pool import StaticPool
 from sqlmodel import Session, SQLModel, create_engine
 
-from .db import get_session
+from .cache import entity_cache
+from .db import SyncSessionAdapter, get_session
 from .main import app
+from .products.category_tree import invalidate_category_tree
+from .products.variants import variant_indexes
+from .sql_metrics import assert_max_queries, instrument_engine
 
 # --- SQLite Setup for Tests ---
 sqlite_url = "sqlite:///:memory:"
@@ -16,6 +22,7 @@ engine_test = create_engine(
     connect_args={"check_same_thread": False},
     poolclass=StaticPool,
 )
+instrument_engine(engine_test)
 
 
 @pytest.fixture(name="session")
@@ -29,9 +36,13 @@ def session_fixture():
 @pytest.fixture(name="client")
 def client_fixture(session: Session):
     def get_session_override():
-        return session
+        return SyncSessionAdapter(session)
 
     app.dependency_overrides[get_session] = get_session_override
+    # In-process caches outlive the per-test database.
+    invalidate_category_tree()
+    variant_indexes.clear()
+    asyncio.run(entity_cache.backend.clear())
 
     # Make sure this patch path matches where 'create_db_and_tables' is IMPORTED in main.py
     # If main.py does "from .db import create_db_and_tables", patch "app.main.create_db_and_tables"
@@ -40,3 +51,9 @@ def client_fixture(session: Session):
         yield client
 
     app.dependency_overrides.clear()
+
+
+@pytest.fixture(name="max_queries")
+def max_queries_fixture():
+    """`with max_queries(2): client.get(...)` fails if the block runs more."""
+    return partial(assert_max_queries, engine_test)
@@ -0,0 +1,140 @@
+"""Conditional GETs for the catalog routers.
+
+Every table has a version counter that is bumped after each commit that
+wrote to it. A GET's ETag is derived from the URL and the versions of the
+tables its router reads, so a matching If-None-Match can be answered with
+304 before any catalog query runs.
+
+The counters are kept in cache.cache_versions: in process memory, or in
+Redis with CACHE_BACKEND=redis so that every worker sees every write. With
+several workers and only process memory, no ETags are sent at all.
+"""
+
+import hashlib
+import os
+
+from fastapi import HTTPException, Request, Response, status
+from sqlalchemy import event
+from sqlmodel import Session
+
+from .cache import cache_versions, table_version_name
+
+HTTP_CACHE_MAX_AGE = int(os.getenv("HTTP_CACHE_MAX_AGE", "0"))
+HTTP_CACHE_STALE_WHILE_REVALIDATE = int(
+    os.getenv("HTTP_CACHE_STALE_WHILE_REVALIDATE", "0")
+)
+
+_PENDING_KEY = "http_cache_changed_tables"
+
+
+table_versions = cache_versions
+
+
+def _version_names(tables) -> list[str]:
+    return [table_version_name(table) for table in tables]
+
+
+def mark_changed(session, *tables: str):
+    """Record writes that the session events below cannot see."""
+    session.info.setdefault(_PENDING_KEY, set()).update(tables)
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_flushed_tables(session, flush_context):
+    mark_changed(
+        session,
+        *(
+            obj.__table__.name
+            for obj in (*session.new, *session.dirty, *session.deleted)
+        ),
+    )
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _collect_executed_tables(orm_execute_state):
+    if (
+        orm_execute_state.is_insert
+        or orm_execute_state.is_update
+        or orm_execute_state.is_delete
+    ):
+        mark_changed(orm_execute_state.session, orm_execute_state.statement.table.name)
+
+
+@event.listens_for(Session, "after_commit")
+def _bump_committed_tables(session):
+    tables = session.info.pop(_PENDING_KEY, None)
+    if tables and table_versions is not None:
+        table_versions.bump(_version_names(tables))
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_rolled_back_tables(session):
+    session.info.pop(_PENDING_KEY, None)
+
+
+def accepts_gzip(accept_encoding: str) -> bool:
+    for coding in accept_encoding.split(","):
+        name, _, params = coding.strip().partition(";")
+        if name.strip() in ("gzip", "*"):
+            return params.replace(" ", "") not in ("q=0", "q=0.0")
+    return False
+
+
+def gzip_etag(etag: str) -> str:
+    """The ETag of the gzipped representation; strong ETags differ per coding."""
+    return etag[:-1] + '-gzip"'
+
+
+def _cache_control(max_age: int, stale_while_revalidate: int) -> str:
+    value = f"public, max-age={max_age}"
+    if stale_while_revalidate:
+        value += f", stale-while-revalidate={stale_while_revalidate}"
+    return value
+
+
+def conditional_get(
+    *models,
+    max_age: int = HTTP_CACHE_MAX_AGE,
+    stale_while_revalidate: int = HTTP_CACHE_STALE_WHILE_REVALIDATE,
+):
+    """Router dependency adding ETag/Cache-Control and answering 304s.
+
+    `models` are the tables the router's GET handlers read from.
+    """
+    names = _version_names(sorted(model.__tablename__ for model in models))
+    cache_control = _cache_control(max_age, stale_while_revalidate)
+
+    def dependency(request: Request, response: Response):
+        if request.method not in ("GET", "HEAD") or table_versions is None:
+            return
+
+        epoch, versions = table_versions.get(names)
+        key = "|".join(
+            [
+                epoch,
+                request.url.path,
+                str(sorted(request.query_params.multi_items())),
+                *(f"{t}={v}" for t, v in versions.items()),
+            ]
+        )
+        etag = '"' + hashlib.sha256(key.encode()).hexdigest()[:32] + '"'
+        headers = {"ETag": etag, "Cache-Control": cache_control}
+
+        if_none_match = request.headers.get("if-none-match", "")
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        if (
+            etag not in tags
+            and gzip_etag(etag) in tags
+            and accepts_gzip(request.headers.get("accept-encoding", ""))
+        ):
+            # Only handlers that gzip their body hand out this ETag.
+            etag = gzip_etag(etag)
+            headers |= {"ETag": etag, "Vary": "Accept-Encoding"}
+        if etag in tags or "*" in tags:
+            raise HTTPException(
+                status_code=status.HTTP_304_NOT_MODIFIED, headers=headers
+            )
+
+        response.headers.update(headers)
+
+    return dependency
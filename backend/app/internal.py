@@ -0,0 +1,10 @@
+from fastapi import APIRouter
+
+from .db import get_pool_statuses
+
+router = APIRouter(prefix="/internal", tags=["internal"])
+
+
+@router.get("/pool")
+def get_pool():
+    return get_pool_statuses()
@@ -1,22 +1,45 @@
-from contextlib import asynccontextmanager
+import asyncio
+from contextlib import asynccontextmanager, suppress
 
 import uvicorn
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
-from .db import create_db_and_tables
+from .db import DATABASE_URL, create_db_and_tables, get_session
+from .internal import router as internal_router
+from .metrics import MetricsMiddleware, mark_process_dead
+from .metrics import router as metrics_router
+from .pagination import NEXT_CURSOR_HEADER
+from .products.api.catalog import router as catalog_router
 from .products.api.category import router as category_router
+from .products.api.changes import router as changes_router
 from .products.api.product import router as products_router
+from .products.api.product import stream_router as products_stream_router
 from .products.api.product_group import router as product_group_router
+from .products.api.product_image import render_router as product_image_render_router
 from .products.api.product_image import router as product_image_router
+from .products.api.stock import router as stock_router
 from .products.api.variation import router as variation_router
 from .products.api.variation_option import router as variation_options_router
+from .products.events import EVENTS_BRIDGE, PostgresBridge
+from .products.images import shutdown_pool
+from .products.stock import sweep_expired_reservations
+from .sql_metrics import QueryStatsMiddleware
 
 
 @asynccontextmanager
 async def lifespan(_: FastAPI):
     create_db_and_tables()
+    tasks = [asyncio.create_task(sweep_expired_reservations(get_session))]
+    if EVENTS_BRIDGE == "postgres":
+        tasks.append(asyncio.create_task(PostgresBridge(DATABASE_URL).run()))
     yield
+    for task in tasks:
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
+    shutdown_pool()
+    mark_process_dead()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -33,14 +56,24 @@ app.add_middleware(
     allow_credentials=True,  # Allow cookies/auth headers
     allow_methods=["*"],  # Allow all methods (GET, POST, PUT, DELETE, etc.)
     allow_headers=["*"],  # Allow all headers
+    expose_headers=[NEXT_CURSOR_HEADER, "ETag"],  # Headers the browser may read
 )
+app.add_middleware(QueryStatsMiddleware)
+app.add_middleware(MetricsMiddleware)
 
+app.include_router(products_stream_router)
 app.include_router(products_router)
 app.include_router(category_router)
 app.include_router(product_group_router)
 app.include_router(variation_router)
 app.include_router(variation_options_router)
 app.include_router(product_image_router)
+app.include_router(product_image_render_router)
+app.include_router(stock_router)
+app.include_router(catalog_router)
+app.include_router(changes_router)
+app.include_router(internal_router)
+app.include_router(metrics_router)
 
 
 @app.get("/")
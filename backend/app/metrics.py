@@ -0,0 +1,145 @@
+"""Prometheus metrics for the HTTP layer, the connection pools and the process.
+
+With several uvicorn workers, set PROMETHEUS_MULTIPROC_DIR to an empty
+directory shared by the workers (wipe it before each start). Every worker
+then writes its samples there and /metrics aggregates all of them, whichever
+worker answers the scrape. Pool and process stats are not shared: they
+describe the answering worker and carry its pid.
+"""
+
+import os
+import time
+
+from fastapi import APIRouter, Response
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Gauge,
+    Histogram,
+    ProcessCollector,
+    generate_latest,
+    multiprocess,
+)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+from .db import get_pool_statuses
+from .sql_metrics import LabelCache, route_template
+
+MULTIPROCESS = bool(os.getenv("PROMETHEUS_MULTIPROC_DIR"))
+
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds",
+    "Time from receiving a request to sending the last byte of its response.",
+    ["method", "route", "status"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+RESPONSE_BYTES = Histogram(
+    "http_response_size_bytes",
+    "Size of response bodies.",
+    ["method", "route"],
+    buckets=(100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000),
+)
+IN_PROGRESS = Gauge(
+    "http_requests_in_progress",
+    "Requests being served.",
+    ["method"],
+    multiprocess_mode="livesum",
+)
+request_seconds = LabelCache(REQUEST_SECONDS)
+response_bytes = LabelCache(RESPONSE_BYTES)
+in_progress_requests = LabelCache(IN_PROGRESS)
+
+
+class MetricsMiddleware:
+    """Time every HTTP request, labelled by route template and status."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status_code = 500
+        size = 0
+
+        async def send_and_measure(message):
+            nonlocal status_code, size
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        in_progress = in_progress_requests(method)
+        in_progress.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_and_measure)
+        finally:
+            elapsed = time.perf_counter() - start
+            in_progress.dec()
+            route = route_template(scope)
+            request_seconds(method, route, str(status_code)).observe(elapsed)
+            response_bytes(method, route).observe(size)
+
+
+class PoolCollector:
+    """Expose get_pool_statuses() at scrape time."""
+
+    GAUGES = ("size", "checked_out", "overflow", "wait_seconds_max")
+    COUNTERS = ("checkouts", "timeouts", "wait_seconds_total")
+
+    def collect(self):
+        labels = ["engine", "pid"]
+        pid = str(os.getpid())
+        gauges = {
+            name: GaugeMetricFamily(
+                f"db_pool_{name}", f"Connection pool {name}.", labels=labels
+            )
+            for name in self.GAUGES
+        }
+        counters = {
+            name: CounterMetricFamily(
+                f"db_pool_{name}", f"Connection pool {name}.", labels=labels
+            )
+            for name in self.COUNTERS
+        }
+        for engine, status in get_pool_statuses().items():
+            for name, family in (gauges | counters).items():
+                if name in status:
+                    family.add_metric([engine, pid], status[name])
+        yield from gauges.values()
+        yield from counters.values()
+
+
+def _registry():
+    if not MULTIPROCESS:
+        return REGISTRY
+    # Samples of all workers, plus this worker's own process and pool stats.
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    ProcessCollector(registry=registry)
+    registry.register(PoolCollector())
+    return registry
+
+
+if not MULTIPROCESS:
+    REGISTRY.register(PoolCollector())
+
+
+def mark_process_dead():
+    """Drop this worker's live gauges from the shared directory on shutdown."""
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(os.getpid())
+
+
+router = APIRouter(tags=["metrics"])
+
+
+@router.get("/metrics", include_in_schema=False)
+def get_metrics():
+    return Response(generate_latest(_registry()), media_type=CONTENT_TYPE_LATEST)
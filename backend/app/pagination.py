@@ -0,0 +1,63 @@
+import base64
+import binascii
+import json
+
+from fastapi import HTTPException, Response, status
+from sqlalchemy import tuple_
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(columns, row) -> str:
+    payload = {
+        "k": [column.key for column in columns],
+        "v": [getattr(row, column.key) for column in columns],
+    }
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def decode_cursor(columns, cursor: str) -> list:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        payload = json.loads(raw)
+        keys, values = payload["k"], payload["v"]
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor"
+        )
+
+    if keys != [column.key for column in columns] or len(values) != len(keys):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Cursor does not match the requested sort order",
+        )
+    return values
+
+
+def paginate(statement, columns, *, limit: int, offset: int = 0, cursor=None):
+    """Order by `columns` and page either by keyset (cursor) or by offset.
+
+    The last column must be unique (normally the primary key) so the order is
+    total and a cursor always points at exactly one row.
+    """
+    statement = statement.order_by(*columns)
+    if cursor is not None:
+        if offset:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Use either offset or cursor, not both",
+            )
+        values = decode_cursor(columns, cursor)
+        if len(columns) == 1:
+            statement = statement.where(columns[0] > values[0])
+        else:
+            statement = statement.where(tuple_(*columns) > tuple_(*values))
+    elif offset:
+        statement = statement.offset(offset)
+    return statement.limit(limit)
+
+
+def set_next_cursor(response: Response, rows, columns, limit: int):
+    if rows and len(rows) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(columns, rows[-1])
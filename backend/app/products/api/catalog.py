@@ -0,0 +1,69 @@
+from typing import Literal
+
+from fastapi import APIRouter, Depends, Query, Response
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from ...db import get_session
+from ...http_cache import conditional_get
+from ...pagination import paginate, set_next_cursor
+from ...responses import orjson_response
+from ...single_flight import single_flight
+from ..models import ProductListing
+from ..schemas import ProductListingPublic
+
+router = APIRouter(
+    prefix="/catalog",
+    tags=["catalog"],
+    dependencies=[Depends(conditional_get(ProductListing))],
+)
+
+SORT_COLUMNS = {
+    "id": (ProductListing.product_id,),
+    "price": (ProductListing.price, ProductListing.product_id),
+    "name": (ProductListing.name, ProductListing.product_id),
+}
+
+
+def _listing_row_to_dict(row) -> dict:
+    data = row.model_dump()
+    data["options"] = sorted(data["options"] or [], key=lambda o: o["variation_id"])
+    return data
+
+
+@router.get("/listing", response_model=list[ProductListingPublic])
+@single_flight
+async def get_listing(
+    *,
+    session: AsyncSession = Depends(get_session),
+    response: Response,
+    category_id: int | None = None,
+    product_group_id: int | None = None,
+    min_price: int | None = None,
+    max_price: int | None = None,
+    in_stock: bool | None = None,
+    offset: int = 0,
+    limit: int = Query(default=100, le=100),
+    cursor: str | None = None,
+    sort: Literal["id", "price", "name"] = "id",
+):
+    """Products as category pages show them, read from product_listing alone."""
+    statement = select(ProductListing)
+    if category_id is not None:
+        statement = statement.where(ProductListing.category_id == category_id)
+    if product_group_id is not None:
+        statement = statement.where(ProductListing.product_group_id == product_group_id)
+    if min_price is not None:
+        statement = statement.where(ProductListing.price >= min_price)
+    if max_price is not None:
+        statement = statement.where(ProductListing.price <= max_price)
+    if in_stock is not None:
+        statement = statement.where(
+            ProductListing.stock_qty > 0 if in_stock else ProductListing.stock_qty <= 0
+        )
+
+    columns = SORT_COLUMNS[sort]
+    statement = paginate(statement, columns, limit=limit, offset=offset, cursor=cursor)
+    rows = (await session.exec(statement)).all()
+    set_next_cursor(response, rows, columns, limit)
+    return orjson_response([_listing_row_to_dict(row) for row in rows], response)
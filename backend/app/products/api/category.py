@@ -1,62 +1,121 @@
-from fastapi import APIRouter, Depends, HTTPException, Query, status
-from sqlmodel import Session, select
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
+from ...cache import entity_cache
 from ...db import get_session
+from ...http_cache import conditional_get
+from ...pagination import paginate, set_next_cursor
+from ...single_flight import single_flight
+from ..category_tree import invalidate_category_tree, load_category_tree
 from ..models import Category
-from ..schemas import CategoryCreate, CategoryPublic, CategoryUpdate
+from ..search import category_subtree
+from ..schemas import CategoryCreate, CategoryPublic, CategoryTreeNode, CategoryUpdate
 
-router = APIRouter(prefix="/categories", tags=["categories"])
+router = APIRouter(
+    prefix="/categories",
+    tags=["categories"],
+    dependencies=[Depends(conditional_get(Category))],
+)
 
 
 @router.post("/", response_model=CategoryPublic, status_code=status.HTTP_201_CREATED)
-def create_category(
-    *, session: Session = Depends(get_session), category_data: CategoryCreate
+async def create_category(
+    *, session: AsyncSession = Depends(get_session), category_data: CategoryCreate
 ):
     if category_data.category_parent_id:
-        if not session.get(Category, category_data.category_parent_id):
+        parent_id = category_data.category_parent_id
+        if not await entity_cache.get(session, Category, parent_id):
             raise HTTPException(status_code=400, detail="Parent category not found")
 
     db_category = Category.model_validate(category_data)
     session.add(db_category)
-    session.commit()
-    session.refresh(db_category)
+    await session.commit()
+    invalidate_category_tree()
+    await session.refresh(db_category)
     return db_category
 
 
 @router.get("/", response_model=list[CategoryPublic])
-def get_categories(
+@single_flight
+async def get_categories(
     *,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
+    response: Response,
+    limit: int | None = Query(default=None, le=100),
+    cursor: str | None = None,
 ):
-    categories = session.exec(select(Category)).all()
+    # Without a limit the full list is returned, which the frontend relies on
+    # to build the category tree.
+    if limit is None:
+        if cursor is not None:
+            raise HTTPException(status_code=400, detail="Cursor requires a limit")
+        return (await session.exec(select(Category).order_by(Category.id))).all()
+
+    columns = (Category.id,)
+    categories = (
+        await session.exec(
+            paginate(select(Category), columns, limit=limit, cursor=cursor)
+        )
+    ).all()
+    set_next_cursor(response, categories, columns, limit)
     return categories
 
 
+@router.get("/tree", response_model=list[CategoryTreeNode])
+@single_flight
+async def get_category_tree(
+    *,
+    session: AsyncSession = Depends(get_session),
+    root_id: int | None = None,
+    depth: int | None = Query(default=None, ge=0),
+):
+    tree = await load_category_tree(session, root_id, depth)
+    if root_id is not None and not tree:
+        raise HTTPException(status_code=404, detail="Category not found")
+    return tree
+
+
 @router.get("/{category_id}", response_model=CategoryPublic)
-def get_category(*, category_id: int, session: Session = Depends(get_session)):
-    category = session.get(Category, category_id)
+@single_flight
+async def get_category(
+    *, category_id: int, session: AsyncSession = Depends(get_session)
+):
+    category = await entity_cache.get(session, Category, category_id)
     if not category:
         raise HTTPException(status_code=404, detail="Category not found")
     return category
 
 
 @router.get("/{category_id}/subcategories", response_model=list[CategoryPublic])
-def get_subcategories(*, category_id: int, session: Session = Depends(get_session)):
-    category = session.get(Category, category_id)
+@single_flight
+async def get_subcategories(
+    *, category_id: int, session: AsyncSession = Depends(get_session)
+):
+    category = await session.get(Category, category_id)
     if not category:
         raise HTTPException(status_code=404, detail="Category not found")
 
-    return category.subcategories
+    # Query explicitly: lazy-loading the relationship is not possible on an
+    # AsyncSession.
+    subcategories = (
+        await session.exec(
+            select(Category)
+            .where(Category.category_parent_id == category_id)
+            .order_by(Category.id)
+        )
+    ).all()
+    return subcategories
 
 
 @router.patch("/{category_id}", response_model=CategoryPublic)
-def update_category(
+async def update_category(
     *,
     category_id: int,
     category_data: CategoryUpdate,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
 ):
-    db_category = session.get(Category, category_id)
+    db_category = await session.get(Category, category_id)
     if not db_category:
         raise HTTPException(status_code=404, detail="Category not found")
 
@@ -64,16 +123,24 @@ def update_category(
     db_category.sqlmodel_update(update_dict)
 
     session.add(db_category)
-    session.commit()
-    session.refresh(db_category)
+    await session.commit()
+    invalidate_category_tree()
+    await entity_cache.invalidate(Category, category_id)
+    await session.refresh(db_category)
     return db_category
 
 
 @router.delete("/{category_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_category(*, category_id: int, session: Session = Depends(get_session)):
-    category = session.get(Category, category_id)
+async def delete_category(
+    *, category_id: int, session: AsyncSession = Depends(get_session)
+):
+    category = await session.get(Category, category_id)
     if not category:
         raise HTTPException(status_code=404, detail="Category not found")
-    session.delete(category)
-    session.commit()
+    # Subcategories go with it through the cascade.
+    deleted_ids = (await session.exec(category_subtree(category_id))).all()
+    await session.delete(category)
+    await session.commit()
+    invalidate_category_tree()
+    await entity_cache.invalidate(Category, *deleted_ids)
     return None
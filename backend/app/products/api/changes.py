@@ -0,0 +1,112 @@
+from fastapi import APIRouter, Depends, Query, Response
+from sqlalchemy import func, tuple_
+from sqlmodel import col, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from ...db import get_session
+from ...http_cache import conditional_get
+from ...pagination import decode_cursor, encode_cursor
+from ...responses import orjson_response
+from ..changes import TRACKED_BY_ENTITY
+from ..models import ChangeLog, Product
+from ..rows import product_row_to_dict, product_rows_statement
+from ..schemas import (
+    CategoryPublic,
+    ChangeFeed,
+    ProductGroupPublic,
+    ProductImagePublic,
+    VariationOptionPublic,
+    VariationPublic,
+)
+
+router = APIRouter(
+    prefix="/changes",
+    tags=["changes"],
+    dependencies=[Depends(conditional_get(ChangeLog))],
+)
+
+PUBLIC_SCHEMAS = {
+    "productgroup": ProductGroupPublic,
+    "category": CategoryPublic,
+    "variation": VariationPublic,
+    "variationoption": VariationOptionPublic,
+    "productimage": ProductImagePublic,
+}
+
+# The order entries are read in, see products/changes.py.
+LOG_ORDER = (ChangeLog.txid, ChangeLog.seq)
+
+
+async def _current_rows(session, entity: str, ids: list[int]) -> dict[int, dict]:
+    """The rows as their own endpoints return them, by id."""
+    if entity == Product.__tablename__:
+        statement = product_rows_statement(session.bind.dialect.name)
+        rows = await session.exec(statement.where(col(Product.id).in_(ids)))
+        return {row.id: product_row_to_dict(row) for row in rows}
+    model = TRACKED_BY_ENTITY[entity]
+    schema = PUBLIC_SCHEMAS[entity]
+    rows = await session.exec(select(model).where(col(model.id).in_(ids)))
+    return {row.id: schema.model_validate(row).model_dump() for row in rows}
+
+
+@router.get("/", response_model=ChangeFeed)
+async def get_changes(
+    *,
+    session: AsyncSession = Depends(get_session),
+    response: Response,
+    since: str | None = None,
+    limit: int = Query(default=500, ge=1, le=1000),
+):
+    """Rows changed after the position `since`, oldest change first.
+
+    Each row appears once, with its current data, or as a tombstone if it
+    was deleted. Leave out `since` for the whole catalog, then pass
+    `next_since`.
+    """
+    statement = select(ChangeLog).order_by(*LOG_ORDER).limit(limit + 1)
+    if since is not None:
+        statement = statement.where(
+            tuple_(*LOG_ORDER) > tuple_(*decode_cursor(LOG_ORDER, since))
+        )
+    held_back = None
+    if session.bind.dialect.name == "postgresql":
+        # Entries of transactions still in progress, or committed after an
+        # older one that is, are read once every older transaction ended.
+        xmin = (
+            await session.exec(
+                select(func.txid_snapshot_xmin(func.txid_current_snapshot()))
+            )
+        ).one()
+        held_back = statement.where(ChangeLog.txid >= xmin).limit(1)
+        statement = statement.where(ChangeLog.txid < xmin)
+    entries = (await session.exec(statement)).all()
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+    if held_back is not None and not has_more:
+        if (await session.exec(held_back)).first() is not None:
+            # May be released by a rollback, which bumps no table version.
+            del response.headers["ETag"]
+            response.headers["Cache-Control"] = "no-store"
+
+    live = {}
+    for entry in entries:
+        if not entry.deleted:
+            live.setdefault(entry.entity, []).append(entry.entity_id)
+    data = {
+        entity: await _current_rows(session, entity, ids)
+        for entity, ids in live.items()
+    }
+
+    changes = []
+    for entry in entries:
+        change = entry.model_dump(exclude={"txid"})
+        change["data"] = data.get(entry.entity, {}).get(entry.entity_id)
+        changes.append(change)
+    return orjson_response(
+        {
+            "changes": changes,
+            "next_since": encode_cursor(LOG_ORDER, entries[-1]) if entries else since,
+            "has_more": has_more,
+        },
+        response,
+    )
@@ -1,17 +1,92 @@
-from fastapi import APIRouter, Depends, HTTPException, Query, status
-from sqlalchemy.orm import selectinload
-from sqlmodel import Session, col, select
+from datetime import datetime, timezone
+from typing import Literal
 
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload, selectinload
+from sqlmodel import col, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from ...cache import entity_cache
 from ...db import get_session
-from ..models import Product, ProductGroup, VariationOption
-from ..schemas import ProductCreate, ProductPublic, ProductUpdate
+from ...http_cache import conditional_get, gzip_etag
+from ...pagination import paginate, set_next_cursor
+from ...responses import orjson_response
+from ...single_flight import single_flight
+from ..bulk import (
+    batched,
+    import_products,
+    iter_records,
+    request_format,
+    update_products,
+)
+from ..events import EVENTS_MAX_IDS, product_events, sse_stream
+from ..export import MEDIA_TYPES, accepts_gzip, export_chunks, export_statement, gzipped
+from ..models import (
+    Category,
+    Product,
+    ProductConfig,
+    ProductGroup,
+    ProductImage,
+    Variation,
+    VariationOption,
+)
+from ..rows import product_row_to_dict, product_rows_statement
+from ..search import (
+    facet_counts,
+    has_any_option,
+    options_by_variation,
+    product_filters,
+    text_search,
+)
+from ..schemas import (
+    BatchItemResult,
+    BatchUpdateResult,
+    BulkImportResult,
+    BulkRowError,
+    ProductCreate,
+    ProductDetail,
+    ProductImagePublic,
+    ProductOptionPublic,
+    ProductBatchUpdate,
+    ProductPublic,
+    ProductSearchResult,
+    ProductUpdate,
+)
+
+router = APIRouter(
+    prefix="/products",
+    tags=["products"],
+    dependencies=[
+        Depends(
+            conditional_get(
+                Category,
+                Product,
+                ProductConfig,
+                ProductGroup,
+                ProductImage,
+                Variation,
+                VariationOption,
+            )
+        )
+    ],
+)
+
+# Outside the conditional GET dependency, and included before `router` so
+# /products/stream is not taken for a product id.
+stream_router = APIRouter(prefix="/products", tags=["products"])
 
-router = APIRouter(prefix="/products", tags=["products"])
+SORT_COLUMNS = {
+    "id": (Product.id,),
+    "price": (Product.price, Product.id),
+    "name": (Product.name, Product.id),
+}
 
 
 @router.post("/", response_model=ProductPublic, status_code=status.HTTP_201_CREATED)
-def create_product(
-    *, session: Session = Depends(get_session), product_data: ProductCreate
+async def create_product(
+    *, session: AsyncSession = Depends(get_session), product_data: ProductCreate
 ):
     if not product_data.product_group_id:
         raise HTTPException(
@@ -19,14 +94,16 @@ def create_product(
             detail="Product group ID is required",
         )
 
-    product_group_exists = session.get(ProductGroup, product_data.product_group_id)
+    product_group_exists = await session.get(
+        ProductGroup, product_data.product_group_id
+    )
     if not product_group_exists:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid product group ID"
         )
 
-    check_sku_unique = session.exec(
-        select(Product).where(Product.sku == product_data.sku)
+    check_sku_unique = (
+        await session.exec(select(Product).where(Product.sku == product_data.sku))
     ).first()
     if check_sku_unique:
         raise HTTPException(
@@ -36,72 +113,330 @@ def create_product(
     db_product = Product(**product_data.model_dump(exclude={"options"}))
 
     option_ids = list(dict.fromkeys(product_data.options or []))
-    if option_ids:
-        result = session.exec(
-            select(VariationOption).where(VariationOption.id.in_(option_ids))
-        ).all()
-
-        get_all_options_ids = [option.id for option in result]
-        check_if_all_options_exist = all(
-            option_id in get_all_options_ids for option_id in option_ids
+    options = await entity_cache.get_many(session, VariationOption, option_ids)
+    if len(options) != len(option_ids):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid option IDs"
         )
-        if not check_if_all_options_exist:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid option IDs"
-            )
-
-        db_product.variation_options = result
 
     session.add(db_product)
-    session.commit()
-
-    db_product = session.exec(
-        select(Product)
-        .where(Product.id == db_product.id)
-        .options(selectinload(Product.variation_options))
-    ).one()
+    await session.flush()
+    product_id = db_product.id
+    session.add_all(
+        ProductConfig(product_id=product_id, variation_option_id=option_id)
+        for option_id in option_ids
+    )
+    await session.commit()
 
     return ProductPublic(
-        **db_product.model_dump(),
-        options=[option.id for option in db_product.variation_options],
+        **product_data.model_dump(exclude={"options"}),
+        id=product_id,
+        options=option_ids,
     )
 
 
+@router.post("/bulk", response_model=BulkImportResult)
+async def bulk_create_products(
+    *,
+    request: Request,
+    session: AsyncSession = Depends(get_session),
+    batch_size: int = Query(default=1000, ge=1, le=10000),
+):
+    """Import products from an NDJSON body, or CSV with `Content-Type: text/csv`.
+
+    Rows are validated and inserted batch by batch as the body streams in;
+    invalid rows are reported by line number and do not stop the import.
+    """
+    result = BulkImportResult()
+    seen_skus = set()
+    records = iter_records(request, request_format(request))
+    async for batch in batched(records, batch_size):
+        rows = []
+        for line, product, error in batch:
+            if error:
+                result.errors.append(BulkRowError(line=line, detail=error))
+            else:
+                rows.append((line, product))
+        if rows:
+            ids, errors = await import_products(session, rows, seen_skus)
+            result.created += len(ids)
+            result.errors += errors
+    result.errors.sort(key=lambda e: e.line)
+    return result
+
+
+@router.patch("/batch", response_model=BatchUpdateResult)
+async def batch_update_products(
+    *,
+    request: Request,
+    session: AsyncSession = Depends(get_session),
+    batch_size: int = Query(default=1000, ge=1, le=10000),
+):
+    """Apply partial updates from an NDJSON body, or CSV with `Content-Type: text/csv`.
+
+    Each record holds the ProductUpdate fields to change plus the product's
+    `id`, or only its `sku` to match by SKU. Batches are written and
+    committed as the body streams in, and every record gets a result.
+    """
+    result = BatchUpdateResult()
+    records = iter_records(request, request_format(request), ProductBatchUpdate)
+    async for batch in batched(records, batch_size):
+        rows = []
+        for line, item, error in batch:
+            if error:
+                result.results.append(
+                    BatchItemResult(line=line, status="invalid", detail=error)
+                )
+            else:
+                rows.append((line, item))
+        if rows:
+            result.results += await update_products(session, rows)
+    result.results.sort(key=lambda r: r.line)
+    result.updated = sum(r.status == "updated" for r in result.results)
+    return result
+
+
 @router.get("/", response_model=list[ProductPublic])
-def get_products(
+@single_flight
+async def get_products(
     *,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
+    response: Response,
     offset: int = 0,
     limit: int = Query(default=100, le=100),
+    cursor: str | None = None,
+    sort: Literal["id", "price", "name"] = "id",
 ):
-    products = session.exec(
-        select(Product)
-        .offset(offset)
-        .limit(limit)
-        .options(selectinload(Product.variation_options))
+    # Plain rows with options aggregated in SQL, encoded straight to JSON:
+    # no ORM objects and no second pass through response_model.
+    columns = SORT_COLUMNS[sort]
+    statement = paginate(
+        product_rows_statement(session.bind.dialect.name),
+        columns,
+        limit=limit,
+        offset=offset,
+        cursor=cursor,
+    )
+    rows = (await session.exec(statement)).all()
+    set_next_cursor(response, rows, columns, limit)
+    return orjson_response([product_row_to_dict(row) for row in rows], response)
+
+
+@router.get("/search", response_model=ProductSearchResult)
+@single_flight
+async def search_products(
+    *,
+    session: AsyncSession = Depends(get_session),
+    response: Response,
+    category_id: int | None = None,
+    product_group_id: int | None = None,
+    min_price: int | None = None,
+    max_price: int | None = None,
+    in_stock: bool | None = None,
+    options: list[int] = Query(default=[]),
+    q: str | None = Query(default=None, min_length=1),
+    prefix: bool = False,
+    offset: int = 0,
+    limit: int = Query(default=100, le=100),
+    cursor: str | None = None,
+    sort: Literal["relevance", "id", "price", "name"] | None = None,
+):
+    """Filter products and count them per variation option.
+
+    Options of the same variation are OR:ed and different variations are
+    AND:ed, so `options=1&options=2&options=7` can mean (S or M) and red.
+    With `q` the results are matched by text and, unless another sort is
+    asked for, ordered by relevance; relevance pages by offset only.
+    `prefix=true` matches the start of product names for type-ahead.
+    """
+    selected = await options_by_variation(session, options)
+    if selected is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid option IDs"
+        )
+
+    conditions = product_filters(
+        category_id=category_id,
+        product_group_id=product_group_id,
+        min_price=min_price,
+        max_price=max_price,
+        in_stock=in_stock,
+    )
+    if sort is None:
+        sort = "relevance" if q else "id"
+    if sort == "relevance" and not q:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Sorting by relevance requires a search query",
+        )
+    if q:
+        match, rank = text_search(session.bind.dialect.name, q, prefix)
+        conditions.append(match)
+    matching = conditions + [has_any_option(ids) for ids in selected.values()]
+
+    if sort == "relevance":
+        if cursor is not None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Results sorted by relevance page by offset",
+            )
+        statement = (
+            select(Product)
+            .where(*matching)
+            .order_by(rank, Product.id)
+            .offset(offset)
+            .limit(limit)
+        )
+    else:
+        columns = SORT_COLUMNS[sort]
+        statement = paginate(
+            select(Product).where(*matching),
+            columns,
+            limit=limit,
+            offset=offset,
+            cursor=cursor,
+        )
+    products = (
+        await session.exec(statement.options(selectinload(Product.variation_options)))
     ).all()
-    return [
-        ProductPublic(**p.model_dump(), options=[o.id for o in p.variation_options])
-        for p in products
-    ]
+    if sort != "relevance":
+        set_next_cursor(response, products, columns, limit)
+
+    total = (
+        await session.exec(select(func.count()).select_from(Product).where(*matching))
+    ).one()
+    facets = await facet_counts(session, conditions, selected)
+
+    return ProductSearchResult(
+        items=[
+            ProductPublic(**p.model_dump(), options=[o.id for o in p.variation_options])
+            for p in products
+        ],
+        total=total,
+        facets=facets,
+    )
+
+
+@router.get(
+    "/export",
+    response_class=StreamingResponse,
+    responses={200: {"content": {"application/x-ndjson": {}, "text/csv": {}}}},
+)
+async def export_products(
+    *,
+    request: Request,
+    session: AsyncSession = Depends(get_session),
+    response: Response,
+    fmt: Literal["ndjson", "csv"] = Query(default="ndjson", alias="format"),
+    updated_since: datetime | None = None,
+):
+    """Stream every product with its group, category, options and image URLs.
+
+    `updated_since` limits the export to products whose exported row
+    changed since then, through their own fields, options or images or the
+    names of their group, category and options, for incremental feeds;
+    times without a zone are taken as UTC. The body is gzipped when the
+    client accepts it.
+    """
+    if updated_since is not None and updated_since.tzinfo is None:
+        updated_since = updated_since.replace(tzinfo=timezone.utc)
+    result = await session.stream(
+        export_statement(session.bind.dialect.name, updated_since)
+    )
+    body = export_chunks(result, fmt)
+    headers = dict(response.headers) | {
+        "Content-Disposition": f'attachment; filename="products.{fmt}"',
+        "Vary": "Accept-Encoding",
+    }
+    if accepts_gzip(request.headers.get("accept-encoding", "")):
+        body = gzipped(body)
+        headers["Content-Encoding"] = "gzip"
+        if "etag" in headers:
+            headers["etag"] = gzip_etag(headers["etag"])
+    return StreamingResponse(body, media_type=MEDIA_TYPES[fmt], headers=headers)
 
 
-@router.get("/{product_id}", response_model=ProductPublic)
-def get_product(*, product_id: int, session: Session = Depends(get_session)):
-    product = session.get(Product, product_id)
+@stream_router.get("/stream", response_class=StreamingResponse)
+async def stream_products(
+    *,
+    product_ids: list[int] = Query(default=[]),
+    product_group_ids: list[int] = Query(default=[]),
+):
+    """Server-sent events with the new price and stock of changed products.
+
+    Each `product` event carries product_id, product_group_id, price and
+    stock_qty. A client too slow to keep up gets an `overflow` event and is
+    disconnected; it should refetch what it shows after reconnecting.
+    """
+    if not product_ids and not product_group_ids:
+        raise HTTPException(
+            status_code=400, detail="Subscribe to at least one product or group"
+        )
+    if len(product_ids) + len(product_group_ids) > EVENTS_MAX_IDS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Subscribe to at most {EVENTS_MAX_IDS} products and groups",
+        )
+    subscription = product_events.subscribe(product_ids, product_group_ids)
+    return StreamingResponse(
+        sse_stream(subscription),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/{product_id}", response_model=ProductDetail)
+@single_flight
+async def get_product(*, product_id: int, session: AsyncSession = Depends(get_session)):
+    # Two statements whatever the product holds: the product joined with its
+    # images, then its options joined with their variations.
+    product = (
+        (
+            await session.exec(
+                select(Product)
+                .where(Product.id == product_id)
+                .options(
+                    joinedload(Product.product_images),
+                    selectinload(Product.variation_options).joinedload(
+                        VariationOption.variation
+                    ),
+                )
+            )
+        )
+        .unique()
+        .first()
+    )
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
-    return product
+
+    options = sorted(product.variation_options, key=lambda o: o.id)
+    return ProductDetail(
+        **product.model_dump(),
+        options=[option.id for option in options],
+        variation_options=[
+            ProductOptionPublic(
+                id=option.id,
+                value=option.value,
+                variation_id=option.variation_id,
+                variation_name=option.variation.name,
+            )
+            for option in options
+        ],
+        images=[
+            ProductImagePublic.model_validate(image)
+            for image in sorted(product.product_images, key=lambda i: i.id)
+        ],
+    )
 
 
 @router.patch("/{product_id}", response_model=ProductUpdate)
-def update_product(
+async def update_product(
     *,
     product_id: int,
     product_data: ProductUpdate,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
 ):
-    db_product = session.get(Product, product_id)
+    db_product = await session.get(Product, product_id)
     if not db_product:
         raise HTTPException(status_code=404, detail="Category not found")
 
@@ -109,16 +444,18 @@ def update_product(
     _ = db_product.sqlmodel_update(update_dict)
 
     session.add(db_product)
-    session.commit()
-    session.refresh(db_product)
+    await session.commit()
+    await session.refresh(db_product)
     return db_product
 
 
 @router.delete("/{product_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_product(*, product_id: int, session: Session = Depends(get_session)):
-    product = session.get(Product, product_id)
+async def delete_product(
+    *, product_id: int, session: AsyncSession = Depends(get_session)
+):
+    product = await session.get(Product, product_id)
     if not product:
         raise HTTPException(status_code=404, detail="product not found")
-    session.delete(product)
-    session.commit()
+    await session.delete(product)
+    await session.commit()
     return None
@@ -1,69 +1,157 @@
-from fastapi import APIRouter, Depends, HTTPException, Query, status
-from sqlmodel import Session, select
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
+from ...cache import entity_cache
 from ...db import get_session
-from ..models import Category, Product, ProductGroup
+from ...http_cache import conditional_get
+from ...pagination import paginate, set_next_cursor
+from ...responses import orjson_response
+from ...single_flight import single_flight
+from ..models import Category, Product, ProductConfig, ProductGroup
 from ..schemas import (
     ProductGroupBase,
     ProductGroupCreate,
     ProductGroupPublic,
     ProductGroupUpdate,
+    VariantEntry,
+    VariantIndex,
+    VariantMatrixCreate,
+    VariantMatrixResult,
 )
+from ..variants import generate_variants, variant_indexes, variant_key
 
-router = APIRouter(prefix="/product-groups", tags=["product-groups"])
+router = APIRouter(
+    prefix="/product-groups",
+    tags=["product-groups"],
+    dependencies=[Depends(conditional_get(Product, ProductConfig, ProductGroup))],
+)
 
 
 @router.post(
     "/", response_model=ProductGroupPublic, status_code=status.HTTP_201_CREATED
 )
-def create_product_group(
-    *, session: Session = Depends(get_session), product_data: ProductGroupCreate
+async def create_product_group(
+    *, session: AsyncSession = Depends(get_session), product_data: ProductGroupCreate
 ):
     if not product_data.category_id:
         raise HTTPException(status_code=400, detail="Category is required")
 
-    category_exists = session.get(Category, product_data.category_id)
+    category_exists = await entity_cache.get(
+        session, Category, product_data.category_id
+    )
     if not category_exists:
         raise HTTPException(status_code=400, detail="Category not found")
 
     db_product_group = ProductGroup.model_validate(product_data)
     session.add(db_product_group)
-    session.commit()
-    session.refresh(db_product_group)
+    await session.commit()
+    await session.refresh(db_product_group)
     return db_product_group
 
 
 @router.get("/", response_model=list[ProductGroupPublic])
-def get_product_groups(
+@single_flight
+async def get_product_groups(
     *,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
+    response: Response,
     offset: int = 0,
     limit: int = Query(default=100, le=100),
+    cursor: str | None = None,
 ):
-    product_groups = session.exec(
-        select(ProductGroup).offset(offset).limit(limit)
+    columns = (ProductGroup.id,)
+    product_groups = (
+        await session.exec(
+            paginate(
+                select(ProductGroup), columns, limit=limit, offset=offset, cursor=cursor
+            )
+        )
     ).all()
+    set_next_cursor(response, product_groups, columns, limit)
     return product_groups
 
 
+@router.post(
+    "/{product_group_id}/generate-variants",
+    response_model=VariantMatrixResult,
+    status_code=status.HTTP_201_CREATED,
+)
+async def generate_product_group_variants(
+    *,
+    product_group_id: int,
+    matrix: VariantMatrixCreate,
+    session: AsyncSession = Depends(get_session),
+):
+    """Create one product per combination of the selected options.
+
+    Combinations the group already has a product for are skipped, so the
+    same request can be repeated after adding a size or colour.
+    """
+    product_group = await session.get(ProductGroup, product_group_id)
+    if not product_group:
+        raise HTTPException(status_code=404, detail="Product group not found")
+    return await generate_variants(session, product_group, matrix)
+
+
+async def _variant_index(session, product_group_id: int) -> dict:
+    variants = await variant_indexes.get(session, product_group_id)
+    if variants is None:
+        raise HTTPException(status_code=404, detail="Product group not found")
+    return variants
+
+
+@router.get("/{product_group_id}/variants", response_model=VariantIndex)
+async def get_product_group_variants(
+    *,
+    product_group_id: int,
+    session: AsyncSession = Depends(get_session),
+    response: Response,
+):
+    """Every product of the group keyed by its sorted option ids, e.g. "1,5"."""
+    variants = await _variant_index(session, product_group_id)
+    return orjson_response(
+        {"product_group_id": product_group_id, "variants": variants}, response
+    )
+
+
+@router.get("/{product_group_id}/resolve", response_model=VariantEntry)
+async def resolve_product_group_variant(
+    *,
+    product_group_id: int,
+    options: str = Query(pattern=r"^\d+(,\d+)*$", examples=["1,5"]),
+    session: AsyncSession = Depends(get_session),
+    response: Response,
+):
+    """The product of the group with exactly these options, in any order."""
+    variants = await _variant_index(session, product_group_id)
+    variant = variants.get(variant_key(int(o) for o in options.split(",")))
+    if variant is None:
+        raise HTTPException(
+            status_code=404, detail="No product with these options in the group"
+        )
+    return orjson_response(variant, response)
+
+
 @router.get("/{product_group_id}", response_model=ProductGroupPublic)
-def get_product_group(
-    *, product_group_id: int, session: Session = Depends(get_session)
+@single_flight
+async def get_product_group(
+    *, product_group_id: int, session: AsyncSession = Depends(get_session)
 ):
-    product_group = session.get(ProductGroup, product_group_id)
+    product_group = await session.get(ProductGroup, product_group_id)
     if not product_group:
         raise HTTPException(status_code=404, detail="Product group not found")
     return product_group
 
 
 @router.patch("/{product_group_id}", response_model=ProductGroupUpdate)
-def update_product_group(
+async def update_product_group(
     *,
     product_group_id: int,
     product_group_data: ProductGroupUpdate,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
 ):
-    db_product_group = session.get(ProductGroup, product_group_id)
+    db_product_group = await session.get(ProductGroup, product_group_id)
     if not db_product_group:
         raise HTTPException(status_code=404, detail="Product group not found")
 
@@ -71,16 +159,18 @@ def update_product_group(
     db_product_group.sqlmodel_update(update_dict)
 
     session.add(db_product_group)
-    session.commit()
-    session.refresh(db_product_group)
+    await session.commit()
+    await session.refresh(db_product_group)
     return db_product_group
 
 
 @router.delete("/{product_group_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_product(*, product_group_id: int, session: Session = Depends(get_session)):
-    product_group = session.get(ProductGroup, product_group_id)
+async def delete_product(
+    *, product_group_id: int, session: AsyncSession = Depends(get_session)
+):
+    product_group = await session.get(ProductGroup, product_group_id)
     if not product_group:
         raise HTTPException(status_code=404, detail="Product group not found")
-    session.delete(product_group)
-    session.commit()
+    await session.delete(product_group)
+    await session.commit()
     return None
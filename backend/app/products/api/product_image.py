@@ -1,70 +1,229 @@
-from fastapi import APIRouter, Depends, HTTPException, Query, status
-from sqlmodel import Session, select
+import uuid
+from typing import Literal
+
+from fastapi import (
+    APIRouter,
+    BackgroundTasks,
+    Depends,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    status,
+)
+from fastapi.responses import FileResponse
+from sqlalchemy import insert
+from sqlmodel import col, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from ...db import get_session
+from ...http_cache import conditional_get
+from ...pagination import paginate, set_next_cursor
+from ...storage import get_storage
+from ...uploads import MultipartFile
+from ..images import (
+    FORMATS,
+    IMAGE_CACHE_MAX_AGE,
+    IMAGE_MAX_UPLOAD_BYTES,
+    checked_image_chunks,
+    delete_variants,
+    pregenerate_variants,
+    render_variant,
+    snap_width,
+    variant_etag,
+)
+from ..changes import record_changes
+from ..listing import mark_listing_stale
 from ..models import Product, ProductImage
+from ..url_check import UrlChecker, get_url_checker
 from ..schemas import (
     ProductImageBase,
+    ProductImageBatchCreate,
     ProductImageCreate,
     ProductImagePublic,
     ProductImageUpdate,
 )
 
-router = APIRouter(prefix="/product-images", tags=["product-images"])
+router = APIRouter(
+    prefix="/product-images",
+    tags=["product-images"],
+    dependencies=[Depends(conditional_get(ProductImage))],
+)
+# Rendered variants carry their own validators, so they bypass the
+# table-version ETags of the router above.
+render_router = APIRouter(prefix="/product-images", tags=["product-images"])
+
+UPLOAD_BODY = {
+    "required": True,
+    "content": {
+        "multipart/form-data": {
+            "schema": {
+                "type": "object",
+                "properties": {"file": {"type": "string", "format": "binary"}},
+                "required": ["file"],
+            }
+        }
+    },
+}
 
 
 @router.post(
     "/", response_model=ProductImagePublic, status_code=status.HTTP_201_CREATED
 )
-def create_product_image(
-    *, session: Session = Depends(get_session), product_image_data: ProductImageCreate
+async def create_product_image(
+    *,
+    session: AsyncSession = Depends(get_session),
+    product_image_data: ProductImageCreate,
 ):
     if not product_image_data.product_id:
         raise HTTPException(status_code=400, detail="Product id is required")
 
-    product_exists = session.get(Product, product_image_data.product_id)
+    product_exists = await session.get(Product, product_image_data.product_id)
     if not product_exists:
         raise HTTPException(status_code=400, detail="Product id not found")
 
-
     db_product_image = ProductImage.model_validate(product_image_data)
     session.add(db_product_image)
-    session.commit()
-    session.refresh(db_product_image)
+    await session.commit()
+    await session.refresh(db_product_image)
+    return db_product_image
+
+
+@router.post(
+    "/batch",
+    response_model=list[ProductImagePublic],
+    status_code=status.HTTP_201_CREATED,
+)
+async def create_product_images(
+    *,
+    session: AsyncSession = Depends(get_session),
+    url_checker: UrlChecker = Depends(get_url_checker),
+    batch: ProductImageBatchCreate,
+):
+    """Create many images at once, all or none.
+
+    Costs one query for the product ids and one INSERT, however many items,
+    plus the product_listing refresh of the products involved.
+    """
+    product_ids = {item.product_id for item in batch.items}
+    found = (
+        await session.exec(select(Product.id).where(col(Product.id).in_(product_ids)))
+    ).all()
+    missing = sorted(product_ids - set(found))
+    if missing:
+        raise HTTPException(
+            status_code=400,
+            detail={"message": "Product id not found", "product_ids": missing},
+        )
+
+    if batch.check_urls:
+        failed = await url_checker.check([item.url for item in batch.items])
+        if failed:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_CONTENT,
+                detail={"message": "Image URLs failed the check", "urls": failed},
+            )
+
+    # Without sort_by_parameter_order SQLAlchemy can send every row in one
+    # INSERT; the rows come back in no guaranteed order, so sort them by id.
+    inserted = await session.exec(
+        insert(ProductImage).returning(
+            ProductImage.id, ProductImage.url, ProductImage.product_id
+        ),
+        params=[item.model_dump() for item in batch.items],
+    )
+    images = sorted(inserted.all(), key=lambda row: row.id)
+    mark_listing_stale(session, products=product_ids)
+    record_changes(session, ProductImage, [row.id for row in images])
+    record_changes(session, Product, product_ids)
+    await session.commit()
+    return [ProductImagePublic.model_validate(row._mapping) for row in images]
+
+
+@router.post(
+    "/upload",
+    response_model=ProductImagePublic,
+    status_code=status.HTTP_201_CREATED,
+    openapi_extra={"requestBody": UPLOAD_BODY},
+)
+async def upload_product_image(
+    *,
+    session: AsyncSession = Depends(get_session),
+    storage=Depends(get_storage),
+    request: Request,
+    background_tasks: BackgroundTasks,
+    product_id: int,
+):
+    """Store the multipart `file` field as a new image of the product."""
+    if not await session.get(Product, product_id):
+        raise HTTPException(status_code=400, detail="Product id not found")
+    # Ends the transaction, so no pooled connection is held while the
+    # upload streams in, however slow the client.
+    await session.rollback()
+
+    upload = MultipartFile(request, "file", max_bytes=IMAGE_MAX_UPLOAD_BYTES)
+    key = f"products/{product_id}/{uuid.uuid4().hex}"
+    await storage.save(key, checked_image_chunks(upload.chunks()))
+
+    try:
+        db_product_image = ProductImage(url="", product_id=product_id, storage_key=key)
+        session.add(db_product_image)
+        await session.flush()
+        db_product_image.url = str(
+            request.url_for(
+                "render_product_image", product_image_id=db_product_image.id
+            )
+        )
+        await session.commit()
+    except Exception:
+        # Nothing refers to the stored file without the row.
+        await session.rollback()
+        await storage.delete(key)
+        raise
+
+    background_tasks.add_task(pregenerate_variants, storage, key)
     return db_product_image
 
 
 @router.get("/", response_model=list[ProductImagePublic])
-def get_product_images(
+async def get_product_images(
     *,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
+    response: Response,
     offset: int = 0,
     limit: int = Query(default=100, le=100),
+    cursor: str | None = None,
 ):
-    product_images = session.exec(
-        select(ProductImage).offset(offset).limit(limit)
+    columns = (ProductImage.id,)
+    product_images = (
+        await session.exec(
+            paginate(
+                select(ProductImage), columns, limit=limit, offset=offset, cursor=cursor
+            )
+        )
     ).all()
+    set_next_cursor(response, product_images, columns, limit)
     return product_images
 
 
 @router.get("/{product_image_id}", response_model=ProductImagePublic)
-def get_product_image(
-    *, product_id: int, session: Session = Depends(get_session)
+async def get_product_image(
+    *, product_id: int, session: AsyncSession = Depends(get_session)
 ):
-    product_image = session.get(ProductImage, product_id)
+    product_image = await session.get(ProductImage, product_id)
     if not product_image:
         raise HTTPException(status_code=404, detail="Product image not found")
     return product_image
 
 
 @router.patch("/{product_image_id}", response_model=ProductImageUpdate)
-def update_product_image(
+async def update_product_image(
     *,
     product_image_id: int,
     product_image_data: ProductImageUpdate,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
 ):
-    db_product_image = session.get(ProductImage, product_image_id)
+    db_product_image = await session.get(ProductImage, product_image_id)
     if not db_product_image:
         raise HTTPException(status_code=404, detail="Product image not found")
 
@@ -72,18 +231,60 @@ def update_product_image(
     db_product_image.sqlmodel_update(update_dict)
 
     session.add(db_product_image)
-    session.commit()
-    session.refresh(db_product_image)
+    await session.commit()
+    await session.refresh(db_product_image)
     return db_product_image
 
 
 @router.delete("/{product_image_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_product_image(
-    *, product_image_id: int, session: Session = Depends(get_session)
+async def delete_product_image(
+    *,
+    product_image_id: int,
+    session: AsyncSession = Depends(get_session),
+    storage=Depends(get_storage),
 ):
-    product_image = session.get(ProductImage, product_image_id)
+    product_image = await session.get(ProductImage, product_image_id)
     if not product_image:
         raise HTTPException(status_code=404, detail="Product image not found")
-    session.delete(product_image)
-    session.commit()
+    await session.delete(product_image)
+    await session.commit()
+
+    if product_image.storage_key:
+        await storage.delete(product_image.storage_key)
+        await delete_variants(product_image.storage_key)
     return None
+
+
+@render_router.get("/{product_image_id}/render")
+async def render_product_image(
+    *,
+    product_image_id: int,
+    request: Request,
+    session: AsyncSession = Depends(get_session),
+    storage=Depends(get_storage),
+    w: int | None = Query(default=None, gt=0),
+    fmt: Literal["webp", "avif", "jpeg"] = "webp",
+):
+    """Serve the image at width `w` (rounded up to a configured size)."""
+    product_image = await session.get(ProductImage, product_image_id)
+    if not product_image or not product_image.storage_key:
+        raise HTTPException(status_code=404, detail="Product image not found")
+
+    key, width = product_image.storage_key, snap_width(w)
+    headers = {
+        "ETag": variant_etag(key, width, fmt),
+        "Cache-Control": f"public, max-age={IMAGE_CACHE_MAX_AGE}",
+    }
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    try:
+        path = await render_variant(storage, key, width, fmt)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Product image file not found")
+    except OSError:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_CONTENT,
+            detail="Product image cannot be decoded",
+        )
+    return FileResponse(path, media_type=FORMATS[fmt][1], headers=headers)
@@ -0,0 +1,108 @@
+from fastapi import APIRouter, Depends, HTTPException, status
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from ...db import get_session
+from ..models import StockReservation, StockReservationLine
+from ..schemas import (
+    StockItem,
+    StockReservationPublic,
+    StockReserveRequest,
+    StockTokenRequest,
+)
+from ..stock import (
+    InsufficientStock,
+    StockBusy,
+    StockError,
+    UnknownProducts,
+    commit_reservation,
+    get_reservation,
+    release_reservations,
+    reserve_stock,
+    utcnow,
+)
+
+router = APIRouter(prefix="/stock", tags=["stock"])
+
+ERROR_STATUS = {
+    UnknownProducts: status.HTTP_400_BAD_REQUEST,
+    InsufficientStock: status.HTTP_409_CONFLICT,
+    StockBusy: status.HTTP_503_SERVICE_UNAVAILABLE,
+}
+
+
+def _reservation_public(reservation, lines) -> StockReservationPublic:
+    return StockReservationPublic(
+        token=reservation.token,
+        status=reservation.status,
+        expires_at=reservation.expires_at,
+        items=[
+            StockItem(product_id=line.product_id, quantity=line.quantity)
+            for line in sorted(lines, key=lambda line: line.product_id)
+        ],
+    )
+
+
+async def _load_reservation_public(session, reservation) -> StockReservationPublic:
+    lines = (
+        await session.exec(
+            select(StockReservationLine).where(
+                StockReservationLine.reservation_id == reservation.id
+            )
+        )
+    ).all()
+    return _reservation_public(reservation, lines)
+
+
+@router.post(
+    "/reserve",
+    response_model=StockReservationPublic,
+    status_code=status.HTTP_201_CREATED,
+)
+async def reserve(
+    *, session: AsyncSession = Depends(get_session), request: StockReserveRequest
+):
+    try:
+        reservation = await reserve_stock(session, request.items, request.ttl_seconds)
+    except StockError as e:
+        raise HTTPException(
+            status_code=ERROR_STATUS[type(e)],
+            detail={"message": e.detail, "product_ids": e.product_ids},
+        )
+    return _reservation_public(reservation, reservation.lines)
+
+
+@router.post("/release", response_model=StockReservationPublic)
+async def release(
+    *, session: AsyncSession = Depends(get_session), request: StockTokenRequest
+):
+    released = await release_reservations(
+        session, StockReservation.token == request.token
+    )
+    reservation = await get_reservation(session, request.token)
+    if not reservation:
+        raise HTTPException(status_code=404, detail="Reservation not found")
+    if not released:
+        raise HTTPException(
+            status_code=409, detail=f"Reservation is {reservation.status}"
+        )
+    return await _load_reservation_public(session, reservation)
+
+
+@router.post("/commit", response_model=StockReservationPublic)
+async def commit(
+    *, session: AsyncSession = Depends(get_session), request: StockTokenRequest
+):
+    committed = await commit_reservation(session, request.token)
+    reservation = await get_reservation(session, request.token)
+    if not reservation:
+        raise HTTPException(status_code=404, detail="Reservation not found")
+    if not committed:
+        if reservation.status == "reserved" and reservation.expires_at <= utcnow():
+            # Give the stock back now rather than waiting for the sweep.
+            await release_reservations(session, StockReservation.id == reservation.id)
+            raise HTTPException(status_code=409, detail="Reservation expired")
+        raise HTTPException(
+            status_code=409, detail=f"Reservation is {reservation.status}"
+        )
+    return await _load_reservation_public(session, reservation)
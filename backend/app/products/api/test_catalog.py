@@ -0,0 +1,125 @@
+from fastapi.testclient import TestClient
+from sqlmodel import Session
+
+from app.products.models import (
+    Category,
+    Product,
+    ProductConfig,
+    ProductGroup,
+    ProductImage,
+    Variation,
+    VariationOption,
+)
+
+
+def seed_catalog(session: Session) -> dict:
+    category = Category(name="Shirts")
+    session.add(category)
+    session.commit()
+    group = ProductGroup(name="Oxford", category_id=category.id)
+    size = Variation(name="Size", category_id=category.id)
+    colour = Variation(name="Colour", category_id=category.id)
+    session.add_all([group, size, colour])
+    session.commit()
+    small = VariationOption(value="S", variation_id=size.id)
+    blue = VariationOption(value="Blue", variation_id=colour.id)
+    session.add_all([small, blue])
+    session.commit()
+
+    shirt = Product(
+        name="Oxford S blue",
+        product_group_id=group.id,
+        price=400,
+        stock_qty=2,
+        description="A shirt.",
+    )
+    plain = Product(
+        name="Oxford plain",
+        product_group_id=group.id,
+        price=300,
+        stock_qty=0,
+        description="A shirt.",
+    )
+    session.add_all([shirt, plain])
+    session.commit()
+    session.add_all(
+        [
+            ProductConfig(product_id=shirt.id, variation_option_id=blue.id),
+            ProductConfig(product_id=shirt.id, variation_option_id=small.id),
+            ProductImage(url="https://img.example/2.jpg", product_id=shirt.id),
+            ProductImage(url="https://img.example/3.jpg", product_id=shirt.id),
+        ]
+    )
+    session.commit()
+    return {
+        "category": category.id,
+        "group": group.id,
+        "size": size.id,
+        "small": small.id,
+        "blue": blue.id,
+        "shirt": shirt.id,
+        "plain": plain.id,
+    }
+
+
+def listing(client: TestClient, **params) -> list[dict]:
+    response = client.get("/catalog/listing", params=params)
+    assert response.status_code == 200
+    return response.json()
+
+
+def test_listing_joins_group_category_options_and_image(
+    session: Session, client: TestClient, max_queries
+):
+    ids = seed_catalog(session)
+
+    with max_queries(1):
+        rows = listing(client, category_id=ids["category"])
+
+    assert [row["product_id"] for row in rows] == [ids["shirt"], ids["plain"]]
+    shirt, plain = rows
+    assert shirt["product_group_name"] == "Oxford"
+    assert shirt["category_name"] == "Shirts"
+    assert shirt["image_url"] == "https://img.example/2.jpg"
+    assert [o["value"] for o in shirt["options"]] == ["S", "Blue"]
+    assert plain["options"] == [] and plain["image_url"] is None
+
+    cheap = listing(client, sort="price", in_stock=False)
+    assert [row["product_id"] for row in cheap] == [ids["plain"]]
+
+
+def test_listing_follows_writes(session: Session, client: TestClient):
+    ids = seed_catalog(session)
+    etag = client.get("/catalog/listing").headers["etag"]
+
+    client.patch(f"/products/{ids['plain']}", json={"price": 250})
+    client.patch(f"/product-groups/{ids['group']}", json={"name": "Oxford Slim"})
+    client.patch(f"/variation-options/{ids['small']}", json={"value": "Small"})
+    client.post(
+        "/stock/reserve", json={"items": [{"product_id": ids["shirt"], "quantity": 2}]}
+    )
+
+    response = client.get("/catalog/listing", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    shirt, plain = response.json()
+    assert plain["price"] == 250
+    assert {shirt["product_group_name"], plain["product_group_name"]} == {"Oxford Slim"}
+    assert shirt["options"][0]["value"] == "Small"
+    assert shirt["stock_qty"] == 0
+
+    session.delete(session.get(ProductImage, 1))
+    session.commit()
+    client.delete(f"/products/{ids['plain']}")
+    (shirt,) = listing(client)
+    assert shirt["image_url"] == "https://img.example/3.jpg"
+
+
+def test_listing_drops_deleted_options(session: Session, client: TestClient):
+    ids = seed_catalog(session)
+    assert len(listing(client, product_group_id=ids["group"])[0]["options"]) == 2
+
+    assert client.delete(f"/variation-options/{ids['small']}").status_code == 204
+
+    shirt = listing(client, product_group_id=ids["group"])[0]
+    assert [o["value"] for o in shirt["options"]] == ["Blue"]
+    assert client.get(f"/products/{ids['shirt']}").json()["options"] == [ids["blue"]]
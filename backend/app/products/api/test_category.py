@@ -1,4 +1,11 @@
+from fakeredis import FakeAsyncRedis, FakeServer
 from fastapi.testclient import TestClient
+from sqlalchemy import text
+from sqlmodel import Session
+
+from app.cache import RedisVersions
+from app.products import category_tree
+from app.test_cache import redis_versions
 
 
 def test_create_category(client: TestClient):
@@ -15,3 +22,85 @@ def test_create_category(client: TestClient):
 
     assert "id" in data
     assert payload.items() <= data.items()
+
+
+def create_category(client: TestClient, name: str, parent_id: int | None = None):
+    payload = {"name": name, "category_parent_id": parent_id}
+    return client.post("/categories/", json=payload).json()["id"]
+
+
+def test_get_category_tree(client: TestClient):
+    clothes = create_category(client, "Clothes")
+    tops = create_category(client, "Tops", clothes)
+    create_category(client, "T-shirts", tops)
+    create_category(client, "Phones")
+
+    tree = client.get("/categories/tree").json()
+
+    assert [node["name"] for node in tree] == ["Clothes", "Phones"]
+    assert tree[0]["children"][0]["name"] == "Tops"
+    assert tree[0]["children"][0]["children"][0]["name"] == "T-shirts"
+
+    shallow = client.get("/categories/tree", params={"root_id": tops, "depth": 0})
+    assert shallow.json()[0]["name"] == "Tops"
+    assert shallow.json()[0]["children"] == []
+
+
+def test_get_category_tree_invalidated_by_writes(client: TestClient):
+    clothes = create_category(client, "Clothes")
+    assert client.get("/categories/tree").json()[0]["children"] == []
+
+    tops = create_category(client, "Tops", clothes)
+    assert client.get("/categories/tree").json()[0]["children"][0]["id"] == tops
+
+    client.patch(
+        f"/categories/{tops}",
+        json={
+            "name": "Tops",
+            "description": None,
+            "category_parent_id": None,
+            "is_container": False,
+        },
+    )
+    assert len(client.get("/categories/tree").json()) == 2
+
+    client.delete(f"/categories/{tops}")
+    assert [node["id"] for node in client.get("/categories/tree").json()] == [clothes]
+
+
+def test_get_category_tree_cache_is_bounded(client: TestClient, monkeypatch):
+    monkeypatch.setattr(category_tree, "CATEGORY_TREE_CACHE_MAX", 2)
+    category_tree.invalidate_category_tree()
+    create_category(client, "Clothes")
+
+    for params in ({"depth": 1000000}, {"depth": 1000001}, {}):
+        assert client.get("/categories/tree", params=params).status_code == 200
+    assert list(category_tree._cache) == [(None, category_tree.MAX_TREE_DEPTH)]
+
+    for depth in range(4):
+        client.get("/categories/tree", params={"depth": depth})
+    assert list(category_tree._cache) == [(None, 2), (None, 3)]
+
+
+def test_get_category_tree_unknown_root(client: TestClient):
+    response = client.get("/categories/tree", params={"root_id": 404})
+    assert response.status_code == 404
+
+
+def test_get_category_tree_follows_writes_of_other_workers(
+    session: Session, client: TestClient, monkeypatch
+):
+    server = FakeServer()
+    # Without a sync client: request handlers only read versions async.
+    versions = RedisVersions(None, FakeAsyncRedis(server=server))
+    monkeypatch.setattr(category_tree, "cache_versions", versions)
+    other_worker = redis_versions(server)
+    create_category(client, "Clothes")
+    assert client.get("/categories/tree").json()[0]["name"] == "Clothes"
+
+    session.exec(text("UPDATE category SET name = 'Apparel'"))
+    session.commit()
+    assert client.get("/categories/tree").json()[0]["name"] == "Clothes"
+    other_worker.bump(["table:category"])
+
+    assert client.get("/categories/tree").json()[0]["name"] == "Apparel"
@@ -0,0 +1,109 @@
+from fastapi.testclient import TestClient
+from sqlmodel import Session, delete, select
+
+from app.products.api.test_catalog import seed_catalog
+from app.products.changes import backfill_change_log
+from app.products.models import ChangeLog, Product, ProductImage
+
+
+def feed(client: TestClient, since: str | None = None, **params) -> dict:
+    if since is not None:
+        params["since"] = since
+    return client.get("/changes/", params=params).json()
+
+
+def test_changes_follow_writes_and_deletes(session: Session, client: TestClient):
+    ids = seed_catalog(session)
+    start = feed(client, limit=1000)
+    assert not start["has_more"]
+    logged = {(c["entity"], c["entity_id"]) for c in start["changes"]}
+    assert ("product", ids["shirt"]) in logged
+    assert ("variationoption", ids["blue"]) in logged
+    since = start["next_since"]
+    image_id = session.exec(select(ProductImage.id)).first()
+
+    client.post(
+        "/stock/reserve", json={"items": [{"product_id": ids["shirt"], "quantity": 1}]}
+    )
+    client.patch(f"/products/{ids['shirt']}", json={"price": 450})
+    client.delete(f"/product-images/{image_id}")
+    client.patch(
+        f"/categories/{ids['category']}",
+        json={
+            "name": "Tops",
+            "description": None,
+            "category_parent_id": None,
+            "is_container": False,
+        },
+    )
+
+    changes = feed(client, since)["changes"]
+    assert [(c["entity"], c["entity_id"], c["deleted"]) for c in changes] == [
+        ("product", ids["shirt"], False),
+        ("productimage", image_id, True),
+        ("category", ids["category"], False),
+    ]
+    shirt, image, category = changes
+    assert (shirt["data"]["price"], shirt["data"]["stock_qty"]) == (450, 1)
+    assert shirt["data"]["options"] == sorted([ids["small"], ids["blue"]])
+    assert image["data"] is None
+    assert category["data"]["name"] == "Tops"
+    session.expire_all()
+    assert session.get(Product, ids["shirt"]).version == shirt["seq"]
+
+    # A row changed again moves to the end under a new sequence number.
+    client.patch(f"/products/{ids['shirt']}", json={"stock_qty": 9})
+    page = feed(client, since)
+    changes = page["changes"]
+    assert [c["entity"] for c in changes] == ["productimage", "category", "product"]
+    assert changes[-1]["seq"] > shirt["seq"]
+    assert feed(client, page["next_since"]) == {
+        "changes": [],
+        "next_since": page["next_since"],
+        "has_more": False,
+    }
+    assert client.get("/changes/", params={"since": "x"}).status_code == 400
+
+
+def test_changes_pages_by_sequence(session: Session, client: TestClient):
+    seed_catalog(session)
+    everything = feed(client, limit=1000)["changes"]
+
+    seen, since = [], None
+    while True:
+        page = feed(client, since, limit=3)
+        seen += page["changes"]
+        since = page["next_since"]
+        if not page["has_more"]:
+            break
+    assert seen == everything
+
+
+def test_backfill_logs_untracked_rows(session: Session, client: TestClient):
+    ids = seed_catalog(session)
+    session.exec(delete(ChangeLog))
+    session.commit()
+    assert feed(client)["changes"] == []
+
+    backfill_change_log(session)
+
+    changes = feed(client, limit=1000)["changes"]
+    assert ("product", ids["plain"]) in {(c["entity"], c["entity_id"]) for c in changes}
+    session.expire_all()
+    assert session.get(Product, ids["plain"]).version > 0
+
+
+def test_option_deletes_log_the_products_using_them(
+    session: Session, client: TestClient
+):
+    ids = seed_catalog(session)
+    since = feed(client, limit=1000)["next_since"]
+
+    assert client.delete(f"/variation-options/{ids['blue']}").status_code == 204
+
+    changes = feed(client, since)["changes"]
+    assert [(c["entity"], c["entity_id"], c["deleted"]) for c in changes] == [
+        ("product", ids["shirt"], False),
+        ("variationoption", ids["blue"], True),
+    ]
+    assert changes[0]["data"]["options"] == [ids["small"]]
@@ -0,0 +1,654 @@
+import asyncio
+import json
+from datetime import datetime
+
+from fastapi.testclient import TestClient
+from sqlmodel import Session, select
+
+from app.products.events import Broker, product_events, sse_stream
+from app.products.models import (
+    Category,
+    Product,
+    ProductConfig,
+    ProductGroup,
+    ProductImage,
+    Variation,
+    VariationOption,
+    utcnow,
+)
+
+
+def seed_products(session: Session, count: int) -> list[Product]:
+    category = Category(name="Phones")
+    session.add(category)
+    session.commit()
+    group = ProductGroup(name="Pixel", category_id=category.id)
+    session.add(group)
+    session.commit()
+
+    products = [
+        Product(
+            name=f"Pixel {i}",
+            product_group_id=group.id,
+            price=(i * 37) % 11,
+            stock_qty=i,
+            description="A phone.",
+            sku=f"PX-{i}",
+        )
+        for i in range(count)
+    ]
+    session.add_all(products)
+    session.commit()
+    return products
+
+
+def test_get_products_cursor_pagination(session: Session, client: TestClient):
+    seed_products(session, 7)
+
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 3} | ({"cursor": cursor} if cursor else {})
+        response = client.get("/products/", params=params)
+        assert response.status_code == 200
+        seen += [p["id"] for p in response.json()]
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+
+    assert seen == sorted(seen)
+    assert len(seen) == 7
+
+
+def test_get_products_cursor_sorted_by_price(session: Session, client: TestClient):
+    products = seed_products(session, 9)
+    expected = [p.id for p in sorted(products, key=lambda p: (p.price, p.id))]
+
+    first = client.get("/products/", params={"limit": 5, "sort": "price"})
+    cursor = first.headers["X-Next-Cursor"]
+    second = client.get(
+        "/products/", params={"limit": 5, "sort": "price", "cursor": cursor}
+    )
+
+    ids = [p["id"] for p in first.json() + second.json()]
+    assert ids == expected
+    assert "X-Next-Cursor" not in second.headers
+
+
+def test_get_products_offset_still_supported(session: Session, client: TestClient):
+    seed_products(session, 4)
+
+    response = client.get("/products/", params={"offset": 2, "limit": 2})
+
+    assert response.status_code == 200
+    assert len(response.json()) == 2
+
+
+def test_get_products_rejects_bad_cursor(client: TestClient):
+    response = client.get("/products/", params={"cursor": "not-a-cursor"})
+    assert response.status_code == 400
+
+    id_cursor = "eyJrIjpbImlkIl0sInYiOlsxXX0"
+    response = client.get("/products/", params={"cursor": id_cursor, "sort": "price"})
+    assert response.status_code == 400
+
+
+def test_create_product_returns_the_created_product(
+    session: Session, client: TestClient
+):
+    category = Category(name="Phones")
+    session.add(category)
+    session.commit()
+    group = ProductGroup(name="Pixel", category_id=category.id)
+    size = Variation(name="Size", category_id=category.id)
+    session.add_all([group, size])
+    session.commit()
+    small = VariationOption(value="S", variation_id=size.id)
+    session.add(small)
+    session.commit()
+    body = {
+        "name": "Pixel S",
+        "product_group_id": group.id,
+        "price": 500,
+        "stock_qty": 4,
+        "description": "A phone.",
+        "sku": "PX-S",
+        "options": [small.id, small.id],
+    }
+
+    response = client.post("/products/", json=body)
+
+    assert response.status_code == 201
+    data = response.json()
+    assert data == body | {"id": data["id"], "options": [small.id]}
+    product = session.get(Product, data["id"])
+    assert (product.sku, product.stock_qty) == ("PX-S", 4)
+    assert client.post("/products/", json=body).status_code == 400
+
+
+def test_bulk_create_products_ndjson(session: Session, client: TestClient):
+    existing = seed_products(session, 1)[0]
+    group_id = existing.product_group_id
+    base = {"product_group_id": group_id, "price": 1, "stock_qty": 1}
+    base |= {"description": "", "options": []}
+    lines = [
+        base | {"name": "A", "sku": "A-1"},
+        base | {"name": "B", "sku": "B-1", "product_group_id": 999},
+        base | {"name": "C", "sku": existing.sku},
+        base | {"name": "D", "sku": "A-1"},
+        base | {"name": "E", "sku": "E-1", "options": [42]},
+    ]
+    body = "\n".join(json.dumps(line) for line in lines) + "\nnot json\n"
+
+    response = client.post(
+        "/products/bulk",
+        params={"batch_size": 2},
+        content=body,
+        headers={"Content-Type": "application/x-ndjson"},
+    )
+
+    assert response.status_code == 200
+    data = response.json()
+    assert data["created"] == 1
+    assert [(e["line"], e["detail"]) for e in data["errors"][:4]] == [
+        (2, "Invalid product group ID"),
+        (3, "SKU already exists"),
+        (4, "SKU already exists"),
+        (5, "Invalid option IDs"),
+    ]
+    assert data["errors"][4]["line"] == 6
+
+
+def test_batch_update_products_by_id_and_sku(
+    session: Session, client: TestClient, max_queries
+):
+    products = seed_products(session, 4)
+    lines = [
+        {"id": products[0].id, "price": 500},
+        {"sku": "PX-1", "stock_qty": 70},
+        {"id": products[2].id, "price": 300, "stock_qty": 30},
+        {"id": 999, "price": 1},
+        {"id": products[3].id, "product_group_id": 999},
+        {"id": products[3].id, "price": None},
+        {"price": 1},
+        {"sku": "PX-1", "stock_qty": 71},
+    ]
+    body = "\n".join(json.dumps(line) for line in lines) + "\nnot json\n"
+
+    # One product group check, one UPDATE per distinct set of fields, then the
+    # change log and product_listing writes on commit.
+    with max_queries(9):
+        response = client.patch(
+            "/products/batch",
+            content=body,
+            headers={"Content-Type": "application/x-ndjson"},
+        )
+
+    assert response.status_code == 200
+    data = response.json()
+    assert data["updated"] == 4
+    assert [(r["line"], r["status"]) for r in data["results"]] == [
+        (1, "updated"),
+        (2, "updated"),
+        (3, "updated"),
+        (4, "not_found"),
+        (5, "invalid"),
+        (6, "invalid"),
+        (7, "invalid"),
+        (8, "updated"),
+        (9, "invalid"),
+    ]
+    session.expire_all()
+    assert [(p.price, p.stock_qty) for p in session.exec(select(Product))] == [
+        (500, 0),
+        (products[1].price, 71),
+        (300, 30),
+        (products[3].price, 3),
+    ]
+
+
+def test_batch_update_products_csv(session: Session, client: TestClient):
+    products = seed_products(session, 3)
+    body = "sku,price,stock_qty\nPX-0,10,\nPX-2,,5\nPX-9,1,1\n"
+
+    response = client.patch(
+        "/products/batch",
+        params={"batch_size": 2},
+        content=body,
+        headers={"Content-Type": "text/csv"},
+    )
+
+    statuses = [r["status"] for r in response.json()["results"]]
+    assert statuses == ["updated", "updated", "not_found"]
+    session.expire_all()
+    assert session.get(Product, products[0].id).price == 10
+    assert session.get(Product, products[2].id).stock_qty == 5
+
+
+def test_bulk_create_products_csv_with_options(session: Session, client: TestClient):
+    category = Category(name="Clothes")
+    session.add(category)
+    session.commit()
+    group = ProductGroup(name="Tee", category_id=category.id)
+    variation = Variation(name="Size", category_id=category.id)
+    session.add_all([group, variation])
+    session.commit()
+    small = VariationOption(value="S", variation_id=variation.id)
+    large = VariationOption(value="L", variation_id=variation.id)
+    session.add_all([small, large])
+    session.commit()
+
+    body = (
+        "name,product_group_id,price,stock_qty,description,sku,options\n"
+        f"Tee S,{group.id},100,3,Cotton,TEE-S,{small.id}\n"
+        f'"Tee, L",{group.id},100,3,Cotton,TEE-L,{small.id}|{large.id}\n'
+    )
+    response = client.post(
+        "/products/bulk", content=body, headers={"Content-Type": "text/csv"}
+    )
+
+    assert response.json() == {"created": 2, "errors": []}
+    configs = session.exec(select(ProductConfig)).all()
+    assert len(configs) == 3
+
+
+def test_get_product_detail_uses_fixed_number_of_queries(
+    session: Session, client: TestClient, max_queries
+):
+    product = seed_products(session, 1)[0]
+    size = Variation(name="Size", category_id=1)
+    colour = Variation(name="Colour", category_id=1)
+    session.add_all([size, colour])
+    session.commit()
+    options = [
+        VariationOption(value="M", variation_id=size.id),
+        VariationOption(value="Red", variation_id=colour.id),
+        VariationOption(value="Blue", variation_id=colour.id),
+    ]
+    product.variation_options = options
+    session.add_all(
+        [
+            ProductImage(url=f"https://img/{i}.jpg", product_id=product.id)
+            for i in range(2)
+        ]
+    )
+    session.commit()
+    product_id, option_ids = product.id, [o.id for o in options]
+    session.expunge_all()
+
+    with max_queries(2) as queries:
+        response = client.get(f"/products/{product_id}")
+
+    assert response.status_code == 200
+    data = response.json()
+    assert data["options"] == option_ids
+    assert [o["variation_name"] for o in data["variation_options"]] == [
+        "Size",
+        "Colour",
+        "Colour",
+    ]
+    assert len(data["images"]) == 2
+    assert queries.count == 2
+
+
+def test_search_products_filters_and_facets(session: Session, client: TestClient):
+    products = seed_products(session, 4)
+    size = Variation(name="Size", category_id=1)
+    colour = Variation(name="Colour", category_id=1)
+    session.add_all([size, colour])
+    session.commit()
+    m, l = (VariationOption(value=v, variation_id=size.id) for v in "ML")
+    red, blue = (
+        VariationOption(value=v, variation_id=colour.id) for v in ("Red", "Blue")
+    )
+    products[0].variation_options = [m, red]
+    products[1].variation_options = [m, blue]
+    products[2].variation_options = [l, red]
+    products[3].variation_options = [l, blue]
+    products[3].stock_qty = 0
+    session.commit()
+
+    response = client.get(
+        "/products/search", params={"options": [m.id, red.id], "category_id": 1}
+    )
+
+    assert response.status_code == 200
+    data = response.json()
+    assert [p["id"] for p in data["items"]] == [products[0].id]
+    assert data["total"] == 1
+    counts = {
+        (f["name"], o["value"]): o["count"]
+        for f in data["facets"]
+        for o in f["options"]
+    }
+    # Each variation is counted without its own filter applied.
+    assert counts == {
+        ("Size", "M"): 1,
+        ("Size", "L"): 1,
+        ("Colour", "Red"): 1,
+        ("Colour", "Blue"): 1,
+    }
+
+    in_stock = client.get(
+        "/products/search", params={"options": [l.id], "in_stock": True}
+    ).json()
+    assert [p["id"] for p in in_stock["items"]] == [products[2].id]
+
+
+def test_search_products_rejects_unknown_options(client: TestClient):
+    response = client.get("/products/search", params={"options": [404]})
+    assert response.status_code == 400
+
+
+def test_search_products_full_text(session: Session, client: TestClient):
+    products = seed_products(session, 3)
+    products[0].name, products[0].description = "Rain jacket", "Waterproof shell"
+    products[1].name, products[1].description = "Jacket liner", "Warm fleece"
+    products[2].name, products[2].description = "Raincoat", "Long coat"
+    session.commit()
+
+    response = client.get("/products/search", params={"q": "jacket"})
+    assert response.status_code == 200
+    assert {p["id"] for p in response.json()["items"]} == {
+        products[0].id,
+        products[1].id,
+    }
+    assert response.json()["total"] == 2
+
+    prefix = client.get("/products/search", params={"q": "rain", "prefix": True})
+    assert {p["id"] for p in prefix.json()["items"]} == {
+        products[0].id,
+        products[2].id,
+    }
+
+    # Edits reach the index.
+    products[2].description = "A jacket for rain"
+    session.commit()
+    response = client.get("/products/search", params={"q": "jacket"})
+    assert response.json()["total"] == 3
+
+    cursor = client.get("/products/search", params={"q": "jacket", "cursor": "x"})
+    assert cursor.status_code == 400
+
+
+def test_search_products_prefix_matches_name_start(
+    session: Session, client: TestClient
+):
+    products = seed_products(session, 5)
+    products[0].name = "Rain jacket"
+    products[1].name, products[1].description = "Jacket for rain", "Rainproof"
+    products[2].name = "Raincoat"
+    products[3].name = "Ra%n boots"
+    products[4].name = "Rainbow_scarf"
+    session.commit()
+
+    def search(q):
+        params = {"q": q, "prefix": True}
+        items = client.get("/products/search", params=params).json()["items"]
+        return [p["id"] for p in items]
+
+    # Shortest name first; descriptions and later words do not match.
+    assert search("RAIN") == [products[2].id, products[0].id, products[4].id]
+    assert search("rain j") == [products[0].id]
+    assert search("ra%") == [products[3].id]
+    assert search("rainbow_") == [products[4].id]
+    assert search("jacket") == [products[1].id]
+
+
+def test_get_products_includes_options_and_headers(
+    session: Session, client: TestClient
+):
+    products = seed_products(session, 2)
+    size = Variation(name="Size", category_id=1)
+    session.add(size)
+    session.commit()
+    small, large = (VariationOption(value=v, variation_id=size.id) for v in "SL")
+    products[0].variation_options = [large, small]
+    session.commit()
+
+    response = client.get("/products/", params={"limit": 1})
+
+    assert response.headers["content-type"] == "application/json"
+    assert "ETag" in response.headers
+    assert "X-Next-Cursor" in response.headers
+    assert response.json() == [
+        {
+            "name": "Pixel 0",
+            "product_group_id": products[0].product_group_id,
+            "price": 0,
+            "stock_qty": 0,
+            "description": "A phone.",
+            "sku": "PX-0",
+            "id": products[0].id,
+            "options": sorted([small.id, large.id]),
+        }
+    ]
+
+
+def test_export_products_streams_ndjson_and_csv(session: Session, client: TestClient):
+    products = seed_products(session, 3)
+    size = Variation(name="Size", category_id=products[0].product_group_id)
+    session.add(size)
+    session.commit()
+    medium = VariationOption(value="M", variation_id=size.id)
+    session.add(medium)
+    session.commit()
+    session.add_all(
+        [
+            ProductConfig(product_id=products[0].id, variation_option_id=medium.id),
+            ProductImage(
+                url="https://img.example.com/a.jpg", product_id=products[0].id
+            ),
+            ProductImage(
+                url="https://img.example.com/b.jpg", product_id=products[0].id
+            ),
+        ]
+    )
+    session.commit()
+
+    response = client.get("/products/export", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["content-type"] == "application/x-ndjson"
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["id"] for row in rows] == [p.id for p in products]
+    assert rows[0]["category_name"] == "Phones"
+    assert rows[0]["options"] == [
+        {
+            "variation_id": size.id,
+            "variation": "Size",
+            "option_id": medium.id,
+            "value": "M",
+        }
+    ]
+    assert rows[0]["image_urls"] == [
+        "https://img.example.com/a.jpg",
+        "https://img.example.com/b.jpg",
+    ]
+    assert rows[1]["options"] == [] and rows[1]["image_urls"] == []
+
+    response = client.get(
+        "/products/export",
+        params={"format": "csv"},
+        headers={"Accept-Encoding": "identity"},
+    )
+    assert "content-encoding" not in response.headers
+    lines = response.text.splitlines()
+    assert lines[0].startswith("id,name,sku,price")
+    assert lines[1].split(",")[10:13] == [
+        str(medium.id),
+        "Size: M",
+        "https://img.example.com/a.jpg|https://img.example.com/b.jpg",
+    ]
+    assert len(lines) == 4
+
+
+def test_export_products_etag_differs_per_encoding(
+    session: Session, client: TestClient
+):
+    seed_products(session, 2)
+    gzip = {"Accept-Encoding": "gzip"}
+    identity = {"Accept-Encoding": "identity"}
+
+    zipped = client.get("/products/export", headers=gzip)
+    plain = client.get("/products/export", headers=identity)
+    assert zipped.headers["etag"].endswith('-gzip"')
+    assert zipped.headers["etag"] != plain.headers["etag"]
+    assert "Accept-Encoding" in zipped.headers["vary"]
+    assert "Accept-Encoding" in plain.headers["vary"]
+
+    etag = zipped.headers["etag"]
+    cached = client.get("/products/export", headers=gzip | {"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.headers["etag"] == etag
+    assert "Accept-Encoding" in cached.headers["vary"]
+    response = client.get(
+        "/products/export", headers=identity | {"If-None-Match": etag}
+    )
+    assert response.status_code == 200
+    assert response.headers["etag"] == plain.headers["etag"]
+    cached = client.get(
+        "/products/export",
+        headers=identity | {"If-None-Match": plain.headers["etag"]},
+    )
+    assert cached.status_code == 304
+
+
+def test_export_products_updated_since(session: Session, client: TestClient):
+    products = seed_products(session, 3)
+    since = utcnow().isoformat()
+
+    client.patch(f"/products/{products[1].id}", json={"price": 99})
+    client.post(
+        "/stock/reserve",
+        json={"items": [{"product_id": products[2].id, "quantity": 1}]},
+    )
+
+    response = client.get("/products/export", params={"updated_since": since})
+    changed = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["id"] for row in changed] == [products[1].id, products[2].id]
+    assert changed[0]["price"] == 99
+    # Core UPDATEs such as the stock reservation's bump updated_at too.
+    assert datetime.fromisoformat(changed[1]["updated_at"]) > datetime.fromisoformat(
+        since
+    )
+
+
+def test_export_products_updated_since_follows_images_and_names(
+    session: Session, client: TestClient
+):
+    products = seed_products(session, 3)
+    group_id = products[0].product_group_id
+    other = ProductGroup(
+        name="Galaxy", category_id=session.get(ProductGroup, group_id).category_id
+    )
+    session.add(other)
+    session.commit()
+    session.add(
+        Product(
+            name="Galaxy",
+            product_group_id=other.id,
+            price=1,
+            stock_qty=1,
+            description="A phone.",
+        )
+    )
+    session.commit()
+    since = utcnow().isoformat()
+
+    def exported(updated_since: str) -> dict[int, dict]:
+        response = client.get(
+            "/products/export", params={"updated_since": updated_since}
+        )
+        return {row["id"]: row for row in map(json.loads, response.text.splitlines())}
+
+    client.post(
+        "/product-images/batch",
+        json={
+            "items": [
+                {"url": "https://img.example/1.jpg", "product_id": products[0].id}
+            ]
+        },
+    )
+    changed = exported(since)
+    assert list(changed) == [products[0].id]
+    assert changed[products[0].id]["image_urls"] == ["https://img.example/1.jpg"]
+
+    since = utcnow().isoformat()
+    client.patch(f"/product-groups/{group_id}", json={"name": "Pixel Pro"})
+    changed = exported(since)
+    assert list(changed) == [p.id for p in products]
+    assert {row["product_group_name"] for row in changed.values()} == {"Pixel Pro"}
+
+    since = utcnow().isoformat()
+    image_id = client.get("/product-images/").json()[0]["id"]
+    client.delete(f"/product-images/{image_id}")
+    changed = exported(since)
+    assert list(changed) == [products[0].id]
+    assert changed[products[0].id]["image_urls"] == []
+
+
+def test_stream_requires_a_subscription(client: TestClient):
+    assert client.get("/products/stream").status_code == 400
+    ids = [("product_ids", i) for i in range(501)]
+    assert client.get("/products/stream", params=ids).status_code == 400
+
+
+def test_price_and_stock_changes_reach_subscribers(
+    session: Session, client: TestClient
+):
+    first, second, third = seed_products(session, 3)
+    reserve = {"items": [{"product_id": third.id, "quantity": 1}]}
+
+    async def watch():
+        by_id = product_events.subscribe(product_ids=[first.id])
+        by_group = product_events.subscribe(product_group_ids=[third.product_group_id])
+        try:
+            await asyncio.to_thread(
+                client.patch, f"/products/{first.id}", json={"name": "Renamed"}
+            )
+            await asyncio.to_thread(
+                client.patch, f"/products/{first.id}", json={"price": 99}
+            )
+            await asyncio.to_thread(client.post, "/stock/reserve", json=reserve)
+            received = [await asyncio.wait_for(by_id.queue.get(), 1)]
+            for _ in range(2):
+                received.append(await asyncio.wait_for(by_group.queue.get(), 1))
+            return received, by_id.queue.empty()
+        finally:
+            product_events.unsubscribe(by_id)
+            product_events.unsubscribe(by_group)
+
+    received, drained = asyncio.run(watch())
+
+    assert received[0] == {
+        "product_id": first.id,
+        "product_group_id": first.product_group_id,
+        "price": 99,
+        "stock_qty": 0,
+    }
+    assert drained
+    # The group's stream gets both products' changes.
+    assert received[1] == received[0]
+    assert received[2]["product_id"] == third.id
+    assert received[2]["stock_qty"] == 1
+    assert not product_events.has_subscribers
+
+
+def test_stream_closes_on_overflow():
+    async def stream() -> list[bytes]:
+        broker = Broker(queue_size=2)
+        subscription = broker.subscribe(product_ids=[1])
+        broker.publish(
+            [
+                {"product_id": 1, "product_group_id": 1, "price": p, "stock_qty": 0}
+                for p in range(5)
+            ]
+        )
+        chunks = [chunk async for chunk in sse_stream(subscription, broker)]
+        return chunks, broker.has_subscribers
+
+    chunks, subscribed = asyncio.run(stream())
+
+    assert chunks[0] == b": connected\n\n"
+    assert [json.loads(c.split(b"data: ")[1])["price"] for c in chunks[1:3]] == [0, 1]
+    assert chunks[3] == b"event: overflow\ndata: {}\n\n"
+    assert not subscribed
@@ -0,0 +1,195 @@
+from fakeredis import FakeServer
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+from sqlmodel import Session, select
+
+from app.test_cache import redis_versions
+from app.products.models import (
+    Category,
+    Product,
+    ProductConfig,
+    ProductGroup,
+    Variation,
+    VariationOption,
+)
+from app.products.variants import VariantIndexCache, variant_indexes
+
+
+def seed_matrix(session: Session, sizes: list[str], colours: list[str]) -> dict:
+    category = Category(name="Shirts")
+    session.add(category)
+    session.commit()
+    group = ProductGroup(name="Oxford", category_id=category.id)
+    size = Variation(name="Size", category_id=category.id)
+    colour = Variation(name="Colour", category_id=category.id)
+    session.add_all([group, size, colour])
+    session.commit()
+    size_options = [VariationOption(value=v, variation_id=size.id) for v in sizes]
+    colour_options = [VariationOption(value=v, variation_id=colour.id) for v in colours]
+    session.add_all(size_options + colour_options)
+    session.commit()
+    return {
+        "group": group.id,
+        "size": size.id,
+        "colour": colour.id,
+        "sizes": [o.id for o in size_options],
+        "colours": [o.id for o in colour_options],
+    }
+
+
+def generate(client: TestClient, group_id: int, **body):
+    return client.post(
+        f"/product-groups/{group_id}/generate-variants", json={"price": 100} | body
+    )
+
+
+def test_generate_variants_skips_existing_combinations(
+    session: Session, client: TestClient
+):
+    ids = seed_matrix(session, ["S", "M", "L"], ["Red", "Blue"])
+    s, m, _ = ids["sizes"]
+    red, blue = ids["colours"]
+    existing = Product(
+        name="Oxford S Red",
+        product_group_id=ids["group"],
+        price=90,
+        stock_qty=1,
+        description="",
+    )
+    session.add(existing)
+    session.commit()
+    session.add_all(
+        ProductConfig(product_id=existing.id, variation_option_id=option_id)
+        for option_id in (s, red)
+    )
+    session.commit()
+
+    options = {ids["size"]: ids["sizes"], ids["colour"]: ids["colours"]}
+    response = generate(
+        client, ids["group"], options=options, sku_template="OXF-{Size}-{Colour}"
+    )
+
+    assert response.status_code == 201
+    data = response.json()
+    assert data["skipped"] == 1
+    assert len(data["created"]) == 5
+    medium_blue = next(p for p in data["created"] if p["sku"] == "OXF-M-Blue")
+    assert medium_blue["name"] == "Oxford M / Blue"
+    assert medium_blue["options"] == sorted([m, blue])
+    configs = session.exec(
+        select(ProductConfig).where(ProductConfig.product_id == medium_blue["id"])
+    ).all()
+    assert {c.variation_option_id for c in configs} == {m, blue}
+
+    again = generate(client, ids["group"], options=options)
+    assert again.json() == {"created": [], "skipped": 6}
+
+
+def test_generate_variants_rejects_bad_selections(session: Session, client: TestClient):
+    ids = seed_matrix(session, ["S", "M"], ["Red"])
+    options = {ids["size"]: ids["sizes"], ids["colour"]: ids["colours"]}
+
+    wrong_variation = {ids["size"]: ids["colours"]}
+    response = generate(client, ids["group"], options=wrong_variation)
+    assert response.status_code == 400
+    assert response.json()["detail"]["option_ids"] == ids["colours"]
+
+    response = generate(client, ids["group"], options=options, sku_template="X")
+    assert response.status_code == 400
+
+    response = generate(client, ids["group"], options=options, name_template="{Fit}")
+    assert response.status_code == 400
+
+    assert generate(client, 999, options=options).status_code == 404
+    assert session.exec(select(Product)).all() == []
+
+
+def test_variant_index_resolves_and_follows_writes(
+    session: Session, client: TestClient, max_queries
+):
+    ids = seed_matrix(session, ["S", "M"], ["Red", "Blue"])
+    options = {ids["size"]: ids["sizes"], ids["colour"]: ids["colours"]}
+    created = generate(client, ids["group"], options=options, stock_qty=3).json()
+    s, m = ids["sizes"]
+    red, blue = ids["colours"]
+    medium_red = next(p for p in created["created"] if p["options"] == sorted([m, red]))
+
+    index = client.get(f"/product-groups/{ids['group']}/variants").json()
+    assert index["product_group_id"] == ids["group"]
+    assert len(index["variants"]) == 4
+    assert index["variants"][f"{min(s, blue)},{max(s, blue)}"]["stock_qty"] == 3
+
+    resolve = f"/product-groups/{ids['group']}/resolve"
+    with max_queries(0):
+        response = client.get(resolve, params={"options": f"{red},{m}"})
+    assert response.json() == {
+        "product_id": medium_red["id"],
+        "price": 100,
+        "stock_qty": 3,
+        "options": sorted([m, red]),
+    }
+
+    client.post(
+        "/stock/reserve",
+        json={"items": [{"product_id": medium_red["id"], "quantity": 2}]},
+    )
+    response = client.get(resolve, params={"options": f"{m},{red}"})
+    assert response.json()["stock_qty"] == 1
+
+    assert client.get(resolve, params={"options": str(m)}).status_code == 404
+    assert client.get(resolve, params={"options": "1;2"}).status_code == 422
+    assert client.get("/product-groups/999/variants").status_code == 404
+
+
+def test_variant_index_invalidates_only_the_written_group(
+    session: Session, client: TestClient, max_queries
+):
+    ids = seed_matrix(session, ["S", "M"], ["Red"])
+    other = ProductGroup(
+        name="Poplin", category_id=session.get(ProductGroup, ids["group"]).category_id
+    )
+    session.add(other)
+    session.commit()
+    s, m = ids["sizes"]
+    (red,) = ids["colours"]
+    options = {ids["size"]: ids["sizes"], ids["colour"]: ids["colours"]}
+    generate(client, ids["group"], options=options)
+    poplin = generate(client, other.id, options=options).json()["created"]
+
+    resolve = f"/product-groups/{ids['group']}/resolve"
+    assert client.get(resolve, params={"options": f"{s},{red}"}).status_code == 200
+    client.post(
+        "/stock/reserve",
+        json={"items": [{"product_id": poplin[0]["id"], "quantity": 1}]},
+    )
+    with max_queries(0):
+        response = client.get(resolve, params={"options": f"{s},{red}"})
+    assert response.status_code == 200
+
+    assert client.delete(f"/variation-options/{s}").status_code == 204
+    variants = client.get(f"/product-groups/{ids['group']}/variants").json()
+    assert set(variants["variants"]) == {str(red), f"{min(m, red)},{max(m, red)}"}
+    response = client.get(resolve, params={"options": f"{s},{red}"})
+    assert response.status_code == 404
+
+
+def test_variant_index_follows_invalidations_of_other_workers(
+    session: Session, client: TestClient, monkeypatch
+):
+    server = FakeServer()
+    monkeypatch.setattr(variant_indexes, "versions", redis_versions(server))
+    other_worker = VariantIndexCache(redis_versions(server))
+    ids = seed_matrix(session, ["S"], ["Red"])
+    options = {ids["size"]: ids["sizes"], ids["colour"]: ids["colours"]}
+    generate(client, ids["group"], options=options, stock_qty=3)
+    resolve = f"/product-groups/{ids['group']}/resolve"
+    selection = {"options": f"{ids['sizes'][0]},{ids['colours'][0]}"}
+    assert client.get(resolve, params=selection).json()["stock_qty"] == 3
+
+    # Written by another worker, which then invalidates the group.
+    session.exec(text("UPDATE product SET stock_qty = 7"))
+    session.commit()
+    assert client.get(resolve, params=selection).json()["stock_qty"] == 3
+    other_worker.invalidate([ids["group"]])
+
+    assert client.get(resolve, params=selection).json()["stock_qty"] == 7
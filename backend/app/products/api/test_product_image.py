@@ -0,0 +1,241 @@
+import asyncio
+import io
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+from sqlalchemy.exc import OperationalError
+from sqlmodel import Session
+
+from app.main import app
+from app.products import images
+from app.products.api.test_product import seed_products
+from app.products.url_check import UrlChecker, get_url_checker
+from app.storage import LocalStorage, get_storage
+
+
+@pytest.fixture(name="storage")
+def storage_fixture(tmp_path, monkeypatch):
+    storage = LocalStorage(tmp_path / "uploads")
+    monkeypatch.setattr(images, "IMAGE_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(images, "IMAGE_PREGENERATE", [(320, "webp")])
+    app.dependency_overrides[get_storage] = lambda: storage
+    yield storage
+    images.shutdown_pool()
+
+
+def png(width: int, height: int) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), "red").save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def upload(client: TestClient, product_id: int, content: bytes):
+    return client.post(
+        "/product-images/upload",
+        params={"product_id": product_id},
+        files={"file": ("photo.png", content, "image/png")},
+    )
+
+
+def test_upload_stores_file_and_renders_variants(
+    session: Session, client: TestClient, storage, tmp_path
+):
+    product = seed_products(session, 1)[0]
+    content = png(800, 400)
+
+    response = upload(client, product.id, content)
+
+    assert response.status_code == 201
+    data = response.json()
+    assert data["url"].endswith(f"/product-images/{data['id']}/render")
+    [stored] = (tmp_path / "uploads" / "products" / str(product.id)).iterdir()
+    assert stored.read_bytes() == content
+    # Pre-rendered by the background task after the upload.
+    assert list((tmp_path / "cache").rglob("320.webp"))
+
+    rendered = client.get(data["url"], params={"w": 300, "fmt": "avif"})
+    assert rendered.status_code == 200
+    assert rendered.headers["content-type"] == "image/avif"
+    assert rendered.headers["cache-control"].startswith("public, max-age=")
+    assert Image.open(io.BytesIO(rendered.content)).size == (320, 160)
+
+    cached = client.get(
+        data["url"],
+        params={"w": 300, "fmt": "avif"},
+        headers={"If-None-Match": rendered.headers["etag"]},
+    )
+    assert cached.status_code == 304
+
+    assert client.delete(f"/product-images/{data['id']}").status_code == 204
+    assert not stored.exists()
+    assert not list((tmp_path / "cache").rglob("*.*"))
+
+
+def test_upload_holds_no_transaction_and_cleans_up_failed_commits(
+    session: Session, client: TestClient, storage, tmp_path, monkeypatch
+):
+    product = seed_products(session, 1)[0]
+    save = storage.save
+    in_transaction = []
+
+    async def checked_save(key, chunks):
+        in_transaction.append(session.in_transaction())
+        return await save(key, chunks)
+
+    def commit():
+        raise OperationalError("COMMIT", {}, Exception("connection lost"))
+
+    monkeypatch.setattr(storage, "save", checked_save)
+    monkeypatch.setattr(session, "commit", commit)
+    with pytest.raises(OperationalError):
+        upload(client, product.id, png(40, 20))
+
+    assert in_transaction == [False]
+    assert not [p for p in (tmp_path / "uploads").rglob("*") if p.is_file()]
+
+
+def test_upload_rejects_non_images_and_large_files(
+    session: Session, client: TestClient, storage, tmp_path, monkeypatch
+):
+    product = seed_products(session, 1)[0]
+
+    response = upload(client, product.id, b"<html>not an image</html>")
+    assert response.status_code == 415
+
+    monkeypatch.setattr("app.products.api.product_image.IMAGE_MAX_UPLOAD_BYTES", 1000)
+    response = upload(client, product.id, png(800, 800) + b"\0" * 1000)
+    assert response.status_code == 413
+
+    assert upload(client, 999, png(10, 10)).status_code == 400
+    assert not [p for p in (tmp_path / "uploads").rglob("*") if p.is_file()]
+
+
+def test_render_requires_uploaded_file(session: Session, client: TestClient, storage):
+    product = seed_products(session, 1)[0]
+    image_id = client.post(
+        "/product-images/",
+        json={"url": "https://img.example.com/a.jpg", "product_id": product.id},
+    ).json()["id"]
+
+    assert client.get(f"/product-images/{image_id}/render").status_code == 404
+
+
+def test_batch_create_checks_products_in_one_query(
+    session: Session, client: TestClient, max_queries
+):
+    first, second = seed_products(session, 2)
+    items = [
+        {"url": f"https://img.example.com/{i}.jpg", "product_id": product.id}
+        for i, product in enumerate([first, second] * 10)
+    ]
+
+    # Product check and INSERT, plus the change log (images and products)
+    # and product_listing writes on commit.
+    with max_queries(9):
+        response = client.post("/product-images/batch", json={"items": items})
+
+    assert response.status_code == 201
+    assert sorted((i["url"], i["product_id"]) for i in response.json()) == sorted(
+        (i["url"], i["product_id"]) for i in items
+    )
+    assert len(client.get("/product-images/").json()) == 20
+
+    items.append({"url": "https://img.example.com/x.jpg", "product_id": 999})
+    response = client.post("/product-images/batch", json={"items": items})
+    assert response.status_code == 400
+    assert response.json()["detail"]["product_ids"] == [999]
+    assert len(client.get("/product-images/").json()) == 20
+
+
+async def resolve_public(host: str) -> list[str]:
+    return ["93.184.216.34"]
+
+
+def test_batch_create_checks_urls_concurrently(session: Session, client: TestClient):
+    product = seed_products(session, 1)[0]
+    in_flight = peak = 0
+
+    async def handler(request: httpx.Request):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        if request.url.path == "/missing.jpg":
+            return httpx.Response(404)
+        if request.url.path == "/page.jpg":
+            return httpx.Response(200, headers={"content-type": "text/html"})
+        return httpx.Response(200, headers={"content-type": "image/jpeg"})
+
+    checker = UrlChecker(
+        httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+        concurrency=3,
+        resolve=resolve_public,
+    )
+    app.dependency_overrides[get_url_checker] = lambda: checker
+    urls = [f"https://img.example.com/{i}.jpg" for i in range(10)]
+
+    def create(urls):
+        items = [{"url": url, "product_id": product.id} for url in urls]
+        return client.post(
+            "/product-images/batch", json={"items": items, "check_urls": True}
+        )
+
+    assert create(urls).status_code == 201
+    assert peak == 3
+
+    response = create(
+        urls
+        + ["https://img.example.com/missing.jpg", "https://img.example.com/page.jpg"]
+    )
+    assert response.status_code == 422
+    assert response.json()["detail"]["urls"] == {
+        "https://img.example.com/missing.jpg": "HTTP 404",
+        "https://img.example.com/page.jpg": "Not an image: text/html",
+    }
+
+
+def test_url_check_refuses_bad_and_internal_urls():
+    requested = []
+
+    async def handler(request: httpx.Request):
+        requested.append((str(request.url), request.headers["host"]))
+        if request.url.path == "/moved.jpg":
+            return httpx.Response(302, headers={"location": "http://intranet/x.jpg"})
+        return httpx.Response(200, headers={"content-type": "image/png"})
+
+    async def resolve(host: str) -> list[str]:
+        return {"intranet": ["10.0.0.7"], "both": ["93.184.216.34", "::1"]}.get(
+            host, ["93.184.216.34"]
+        )
+
+    checker = UrlChecker(
+        httpx.AsyncClient(transport=httpx.MockTransport(handler)), resolve=resolve
+    )
+    urls = [
+        "https://img.example.com/ok.jpg",
+        "http://[::1",
+        "http://a:b:c/",
+        "file:///etc/passwd",
+        "http://127.0.0.1/admin",
+        "http://both/x.jpg",
+        "https://img.example.com/moved.jpg",
+    ]
+
+    failed = asyncio.run(checker.check(urls))
+
+    assert failed == {
+        "http://[::1": "Request failed: InvalidURL",
+        "http://a:b:c/": "Request failed: InvalidURL",
+        "file:///etc/passwd": "Unsupported scheme: file",
+        "http://127.0.0.1/admin": "Not a public address",
+        "http://both/x.jpg": "Not a public address",
+        "https://img.example.com/moved.jpg": "Not a public address",
+    }
+    # Sent to the checked address, under the original host.
+    assert sorted(requested) == [
+        ("https://93.184.216.34/moved.jpg", "img.example.com"),
+        ("https://93.184.216.34/ok.jpg", "img.example.com"),
+    ]
@@ -0,0 +1,143 @@
+import asyncio
+from datetime import timedelta
+
+from fastapi.testclient import TestClient
+from sqlalchemy.exc import OperationalError
+from sqlmodel import Session, select
+
+from app.db import SyncSessionAdapter
+from app.products.models import Category, Product, ProductGroup, StockReservation
+from app.products.stock import (
+    LOCK_NOT_AVAILABLE,
+    release_expired_reservations,
+    utcnow,
+)
+
+
+def seed_stock(session: Session, *quantities: int) -> list[int]:
+    category = Category(name="Phones")
+    session.add(category)
+    session.commit()
+    group = ProductGroup(name="Pixel", category_id=category.id)
+    session.add(group)
+    session.commit()
+
+    products = [
+        Product(
+            name=f"Pixel {i}",
+            product_group_id=group.id,
+            price=1,
+            stock_qty=qty,
+            description="A phone.",
+        )
+        for i, qty in enumerate(quantities)
+    ]
+    session.add_all(products)
+    session.commit()
+    return [product.id for product in products]
+
+
+def stock_levels(session: Session, ids: list[int]) -> list[int]:
+    session.expire_all()
+    return [session.get(Product, product_id).stock_qty for product_id in ids]
+
+
+def expire(session: Session, token: str) -> StockReservation:
+    reservation = session.exec(
+        select(StockReservation).where(StockReservation.token == token)
+    ).one()
+    reservation.expires_at = utcnow() - timedelta(seconds=1)
+    session.commit()
+    return reservation
+
+
+def reserve(client: TestClient, *items: tuple[int, int], **extra):
+    return client.post(
+        "/stock/reserve",
+        json={"items": [{"product_id": p, "quantity": q} for p, q in items]} | extra,
+    )
+
+
+def test_reserve_decrements_stock(session: Session, client: TestClient):
+    a, b = seed_stock(session, 5, 3)
+
+    response = reserve(client, (b, 1), (a, 2), (b, 2))
+    assert response.status_code == 201
+    data = response.json()
+    assert data["status"] == "reserved"
+    assert data["items"] == [
+        {"product_id": a, "quantity": 2},
+        {"product_id": b, "quantity": 3},
+    ]
+    assert stock_levels(session, [a, b]) == [3, 0]
+
+
+def test_reserve_is_all_or_nothing(session: Session, client: TestClient):
+    a, b = seed_stock(session, 5, 1)
+
+    response = reserve(client, (a, 2), (b, 2))
+    assert response.status_code == 409
+    assert response.json()["detail"]["product_ids"] == [b]
+    assert stock_levels(session, [a, b]) == [5, 1]
+
+    response = reserve(client, (a, 1), (999, 1))
+    assert response.status_code == 400
+    assert response.json()["detail"]["product_ids"] == [999]
+    assert stock_levels(session, [a, b]) == [5, 1]
+
+
+def test_reserve_reports_lock_timeouts_at_commit_as_busy(
+    session: Session, client: TestClient, monkeypatch
+):
+    (a,) = seed_stock(session, 5)
+
+    class LockNotAvailable(Exception):
+        pgcode = LOCK_NOT_AVAILABLE
+
+    def commit():
+        raise OperationalError("COMMIT", {}, LockNotAvailable())
+
+    monkeypatch.setattr(session, "commit", commit)
+    response = reserve(client, (a, 2))
+    monkeypatch.undo()
+
+    assert response.status_code == 503
+    assert response.json()["detail"]["product_ids"] == [a]
+    assert stock_levels(session, [a]) == [5]
+
+
+def test_release_and_commit(session: Session, client: TestClient):
+    a, b = seed_stock(session, 5, 5)
+    released = reserve(client, (a, 2)).json()["token"]
+    committed = reserve(client, (b, 3)).json()["token"]
+
+    response = client.post("/stock/release", json={"token": released})
+    assert response.status_code == 200
+    assert response.json()["status"] == "released"
+    assert client.post("/stock/release", json={"token": released}).status_code == 409
+
+    response = client.post("/stock/commit", json={"token": committed})
+    assert response.status_code == 200
+    assert response.json()["status"] == "committed"
+    assert client.post("/stock/release", json={"token": committed}).status_code == 409
+    assert client.post("/stock/commit", json={"token": "nope"}).status_code == 404
+
+    assert stock_levels(session, [a, b]) == [5, 2]
+
+
+def test_expired_reservations_are_released(session: Session, client: TestClient):
+    (a,) = seed_stock(session, 5)
+    token = reserve(client, (a, 4)).json()["token"]
+    expire(session, token)
+
+    response = client.post("/stock/commit", json={"token": token})
+    assert response.status_code == 409
+    assert response.json()["detail"] == "Reservation expired"
+    assert stock_levels(session, [a]) == [5]
+
+    token = reserve(client, (a, 3)).json()["token"]
+    reservation = expire(session, token)
+
+    released = asyncio.run(release_expired_reservations(SyncSessionAdapter(session)))
+    assert released == [reservation.id]
+    assert stock_levels(session, [a]) == [5]
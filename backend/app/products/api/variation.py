@@ -1,7 +1,11 @@
-from fastapi import APIRouter, Depends, HTTPException, Query, status
-from sqlmodel import Session, select
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
+from ...cache import entity_cache
 from ...db import get_session
+from ...http_cache import conditional_get
+from ...pagination import paginate, set_next_cursor
 from ..models import Category, Variation
 from ..schemas import (
     VariationBase,
@@ -10,54 +14,72 @@ from ..schemas import (
     VariationUpdate,
 )
 
-router = APIRouter(prefix="/variations", tags=["variations"])
+router = APIRouter(
+    prefix="/variations",
+    tags=["variations"],
+    dependencies=[Depends(conditional_get(Variation))],
+)
 
 
 @router.post("/", response_model=VariationPublic, status_code=status.HTTP_201_CREATED)
-def create_variation(
-    *, session: Session = Depends(get_session), variation_data: VariationCreate
+async def create_variation(
+    *, session: AsyncSession = Depends(get_session), variation_data: VariationCreate
 ):
     if not variation_data.category_id:
         raise HTTPException(status_code=400, detail="Category is required")
 
-    category_exists = session.get(Category, variation_data.category_id)
+    category_exists = await entity_cache.get(
+        session, Category, variation_data.category_id
+    )
     if not category_exists:
         raise HTTPException(status_code=400, detail="Category not found")
 
     db_variation = Variation.model_validate(variation_data)
     session.add(db_variation)
-    session.commit()
-    session.refresh(db_variation)
+    await session.commit()
+    await session.refresh(db_variation)
     return db_variation
 
 
 @router.get("/", response_model=list[VariationPublic])
-def get_variations(
+async def get_variations(
     *,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
+    response: Response,
     offset: int = 0,
     limit: int = Query(default=100, le=100),
+    cursor: str | None = None,
 ):
-    variation = session.exec(select(Variation).offset(offset).limit(limit)).all()
+    columns = (Variation.id,)
+    variation = (
+        await session.exec(
+            paginate(
+                select(Variation), columns, limit=limit, offset=offset, cursor=cursor
+            )
+        )
+    ).all()
+    set_next_cursor(response, variation, columns, limit)
     return variation
 
 
 @router.get("/{variation_id}", response_model=VariationPublic)
-def get_variation(*, variation_id: int, session: Session = Depends(get_session)):
-    variation = session.get(Variation, variation_id)
+async def get_variation(
+    *, variation_id: int, session: AsyncSession = Depends(get_session)
+):
+    variation = await entity_cache.get(session, Variation, variation_id)
     if not variation:
         raise HTTPException(status_code=404, detail="Variation group not found")
     return variation
 
 
 @router.patch("/{variation_id}", response_model=VariationUpdate)
-def update_variation(
+async def update_variation(
     *,
     variation_id: int,
     variation_data: VariationUpdate,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
 ):
-    db_variation = session.get(Variation, variation_id)
+    db_variation = await session.get(Variation, variation_id)
     if not db_variation:
         raise HTTPException(status_code=404, detail="Product group not found")
 
@@ -65,16 +87,20 @@ def update_variation(
     db_variation.sqlmodel_update(update_dict)
 
     session.add(db_variation)
-    session.commit()
-    session.refresh(db_variation)
+    await session.commit()
+    await entity_cache.invalidate(Variation, variation_id)
+    await session.refresh(db_variation)
     return db_variation
 
 
 @router.delete("/{variation_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_variation(*, variation_id: int, session: Session = Depends(get_session)):
-    variation = session.get(Variation, variation_id)
+async def delete_variation(
+    *, variation_id: int, session: AsyncSession = Depends(get_session)
+):
+    variation = await session.get(Variation, variation_id)
     if not variation:
         raise HTTPException(status_code=404, detail="Product group not found")
-    session.delete(variation)
-    session.commit()
+    await session.delete(variation)
+    await session.commit()
+    await entity_cache.invalidate(Variation, variation_id)
     return None
@@ -1,7 +1,11 @@
-from fastapi import APIRouter, Depends, HTTPException, Query, status
-from sqlmodel import Session, select
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
+from ...cache import entity_cache
 from ...db import get_session
+from ...http_cache import conditional_get
+from ...pagination import paginate, set_next_cursor
 from ..models import Variation, VariationOption
 from ..schemas import (
     VariationOptionCreate,
@@ -9,60 +13,72 @@ from ..schemas import (
     VariationOptionUpdate,
 )
 
-router = APIRouter(prefix="/variation-options", tags=["variation-options"])
+router = APIRouter(
+    prefix="/variation-options",
+    tags=["variation-options"],
+    dependencies=[Depends(conditional_get(VariationOption))],
+)
 
 
 @router.post(
     "/", response_model=VariationOptionPublic, status_code=status.HTTP_201_CREATED
 )
-def create_variation_option(
-    *, session: Session = Depends(get_session), v_opt_data: VariationOptionCreate
+async def create_variation_option(
+    *, session: AsyncSession = Depends(get_session), v_opt_data: VariationOptionCreate
 ):
-    if not session.get(Variation, v_opt_data.variation_id):
-        raise HTTPException(status_code=400, detail="Variation not found")
-
-    check_variation_exists = session.exec(
-        select(Variation).where(Variation.id == v_opt_data.variation_id)
-    ).first()
-    if not check_variation_exists:
+    if not await entity_cache.get(session, Variation, v_opt_data.variation_id):
         raise HTTPException(status_code=400, detail="Variation not found")
 
     db_variation = VariationOption.model_validate(v_opt_data)
     session.add(db_variation)
-    session.commit()
-    session.refresh(db_variation)
+    await session.commit()
+    await session.refresh(db_variation)
     return db_variation
 
 
 @router.get("/", response_model=list[VariationOptionPublic])
-def get_varition_options(
+async def get_varition_options(
     *,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
+    response: Response,
     offset: int = 0,
     limit: int = Query(default=100, le=100),
+    cursor: str | None = None,
 ):
-    v_opts = session.exec(select(VariationOption).offset(offset).limit(limit)).all()
+    columns = (VariationOption.id,)
+    v_opts = (
+        await session.exec(
+            paginate(
+                select(VariationOption),
+                columns,
+                limit=limit,
+                offset=offset,
+                cursor=cursor,
+            )
+        )
+    ).all()
+    set_next_cursor(response, v_opts, columns, limit)
     return v_opts
 
 
 @router.get("/{variation_option_id}", response_model=VariationOptionPublic)
-def get_variation_option(
-    *, variation_option_id: int, session: Session = Depends(get_session)
+async def get_variation_option(
+    *, variation_option_id: int, session: AsyncSession = Depends(get_session)
 ):
-    v_opt = session.get(VariationOption, variation_option_id)
+    v_opt = await entity_cache.get(session, VariationOption, variation_option_id)
     if not v_opt:
         raise HTTPException(status_code=404, detail="Variation option not found")
     return v_opt
 
 
 @router.patch("/{variation_option_id}", response_model=VariationOptionUpdate)
-def update_variation_option(
+async def update_variation_option(
     *,
     variation_option_id: int,
     v_opt_data: VariationOptionUpdate,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
 ):
-    v_opt = session.get(VariationOption, variation_option_id)
+    v_opt = await session.get(VariationOption, variation_option_id)
     if not v_opt:
         raise HTTPException(status_code=404, detail="Variation option not found")
 
@@ -70,18 +86,20 @@ def update_variation_option(
     _ = v_opt.sqlmodel_update(update_dict)
 
     session.add(v_opt)
-    session.commit()
-    session.refresh(v_opt)
+    await session.commit()
+    await entity_cache.invalidate(VariationOption, variation_option_id)
+    await session.refresh(v_opt)
     return v_opt
 
 
 @router.delete("/{variation_option_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_variation_option(
-    *, variation_option_id: int, session: Session = Depends(get_session)
+async def delete_variation_option(
+    *, variation_option_id: int, session: AsyncSession = Depends(get_session)
 ):
-    v_opt = session.get(VariationOption, variation_option_id)
+    v_opt = await session.get(VariationOption, variation_option_id)
     if not v_opt:
         raise HTTPException(status_code=404, detail="Variation option not found")
-    session.delete(v_opt)
-    session.commit()
+    await session.delete(v_opt)
+    await session.commit()
+    await entity_cache.invalidate(VariationOption, variation_option_id)
     return None
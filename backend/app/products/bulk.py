@@ -0,0 +1,301 @@
+import csv
+import json
+from collections import defaultdict
+
+from fastapi import Request
+from pydantic import ValidationError
+from sqlalchemy import ARRAY, bindparam, func, insert, update
+from sqlalchemy.exc import DBAPIError
+from sqlmodel import col, select
+
+from ..cache import entity_cache
+from .changes import record_changes
+from .events import EVENT_FIELDS, publish_product_changes
+from .listing import mark_listing_stale
+from .models import Product, ProductConfig, ProductGroup, VariationOption
+from .schemas import BatchItemResult, BulkRowError, ProductBatchUpdate, ProductCreate
+
+# CSV imports carry option ids in a single column, separated by "|".
+CSV_OPTION_SEPARATOR = "|"
+
+_NOT_NULL_FIELDS = ("name", "product_group_id", "price", "stock_qty", "description")
+
+
+def request_format(request: Request) -> str:
+    content_type = request.headers.get("content-type", "")
+    return "csv" if content_type.startswith("text/csv") else "ndjson"
+
+
+def format_validation_error(error: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(part) for part in e['loc'])}: {e['msg']}"
+        for e in error.errors()
+    )
+
+
+async def iter_lines(request: Request):
+    """Yield (line number, raw bytes) for each line of the body as it streams in."""
+    buffer = b""
+    line_no = 0
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            line_no += 1
+            yield line_no, line
+    if buffer:
+        yield line_no + 1, buffer
+
+
+def _parse_csv_line(header: list[str], text: str) -> dict:
+    values = next(csv.reader([text]))
+    if len(values) != len(header):
+        raise ValueError(f"expected {len(header)} columns, got {len(values)}")
+    record = {k: v for k, v in zip(header, values) if v != ""}
+    options = record.pop("options", "")
+    record["options"] = [o for o in options.split(CSV_OPTION_SEPARATOR) if o]
+    return record
+
+
+async def iter_records(request: Request, fmt: str, model=ProductCreate):
+    """Yield (line number, model instance or None, error detail or None).
+
+    Blank lines are skipped. CSV bodies must start with a header row and keep
+    each record on a single line.
+    """
+    header = None
+    async for line_no, raw in iter_lines(request):
+        try:
+            text = raw.decode().strip()
+        except UnicodeDecodeError:
+            yield line_no, None, "Line is not valid UTF-8"
+            continue
+        if not text:
+            continue
+
+        try:
+            if fmt == "csv":
+                if header is None:
+                    header = next(csv.reader([text]))
+                    continue
+                record = _parse_csv_line(header, text)
+            else:
+                record = json.loads(text)
+            yield line_no, model.model_validate(record), None
+        except ValidationError as e:
+            yield line_no, None, format_validation_error(e)
+        except ValueError as e:
+            yield line_no, None, f"Could not parse line: {e}"
+
+
+async def batched(records, size: int):
+    batch = []
+    async for record in records:
+        batch.append(record)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def _existing(session, column, values) -> set:
+    if not values:
+        return set()
+    return set(
+        (await session.exec(select(column).where(col(column).in_(values)))).all()
+    )
+
+
+async def import_products(session, rows: list[tuple[int, ProductCreate]], seen_skus):
+    """Validate and insert one batch, returning (created ids, row errors).
+
+    Validation costs one query each for groups, SKUs and options, however
+    many rows the batch holds. `seen_skus` carries SKUs accepted by earlier
+    batches of the same import.
+    """
+    group_ids = {p.product_group_id for _, p in rows}
+    skus = {p.sku for _, p in rows if p.sku}
+    option_ids = {o for _, p in rows for o in p.options}
+
+    existing_groups = await _existing(session, ProductGroup.id, group_ids)
+    taken_skus = await _existing(session, Product.sku, skus)
+    existing_options = set(
+        await entity_cache.get_many(session, VariationOption, option_ids)
+    )
+
+    errors, valid = [], []
+    for line, product in rows:
+        if product.product_group_id not in existing_groups:
+            detail = "Invalid product group ID"
+        elif product.sku and (product.sku in taken_skus or product.sku in seen_skus):
+            detail = "SKU already exists"
+        elif not set(product.options) <= existing_options:
+            detail = "Invalid option IDs"
+        else:
+            if product.sku:
+                seen_skus.add(product.sku)
+            valid.append((line, product))
+            continue
+        errors.append(BulkRowError(line=line, detail=detail))
+
+    if not valid:
+        return [], errors
+
+    try:
+        inserted = await session.exec(
+            insert(Product).returning(Product.id, sort_by_parameter_order=True),
+            params=[p.model_dump(exclude={"options"}) for _, p in valid],
+        )
+        ids = inserted.scalars().all()
+        mark_listing_stale(session, products=ids)
+        record_changes(session, Product, ids)
+        configs = [
+            {"product_id": product_id, "variation_option_id": option_id}
+            for product_id, (_, p) in zip(ids, valid)
+            for option_id in dict.fromkeys(p.options)
+        ]
+        if configs:
+            await session.exec(insert(ProductConfig), params=configs)
+        await session.commit()
+    except DBAPIError as e:
+        await session.rollback()
+        seen_skus.difference_update(p.sku for _, p in valid)
+        detail = f"Batch insert failed: {e.orig}"
+        return [], errors + [
+            BulkRowError(line=line, detail=detail) for line, _ in valid
+        ]
+
+    return ids, errors
+
+
+def _batch_rows(dialect: str, key: str, fields: tuple[str, ...], changes):
+    """The batch's rows as a table named "batch", plus its parameters.
+
+    The rows travel as arrays (Postgres) or one JSON document (SQLite)
+    rather than a VALUES list, so the statement is the same for every batch
+    and compiled once instead of once per batch.
+    """
+    table = Product.__table__
+    names = ("key", *fields)
+    types = (table.c[key].type, *(table.c[field].type for field in fields))
+    if dialect == "postgresql":
+        arrays = [
+            bindparam(f"batch_{name}", type_=ARRAY(type_))
+            for name, type_ in zip(names, types)
+        ]
+        batch = func.unnest(*arrays).table_valued(*names).render_derived("batch")
+        params = {
+            f"batch_{name}": list(values) for name, values in zip(names, zip(*changes))
+        }
+        return batch, params
+
+    rows = func.json_each(bindparam("batch_rows")).table_valued("value")
+    batch = select(
+        *(
+            func.json_extract(rows.c.value, f"$[{i}]").label(name)
+            for i, name in enumerate(names)
+        )
+    ).subquery("batch")
+    return batch, {"batch_rows": json.dumps(changes)}
+
+
+def _update_statement(batch, key: str, fields: tuple[str, ...]):
+    table = Product.__table__
+    return (
+        update(Product)
+        .where(table.c[key] == batch.c.key)
+        .values({field: batch.c[field] for field in fields})
+        .returning(Product.id, table.c[key])
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def update_products(
+    session, rows: list[tuple[int, ProductBatchUpdate]]
+) -> list[BatchItemResult]:
+    """Apply one batch of partial updates, returning a result per row.
+
+    Rows changing the same fields are written by a single UPDATE, so a batch
+    costs one statement per distinct set of fields plus one query for
+    product groups. Later rows for the same product win.
+    """
+    results, parsed = [], []
+    for line, item in rows:
+        changes = item.model_dump(exclude_unset=True)
+        ident = changes.pop("id", None)
+        if ident is not None:
+            key = ("id", ident)
+        elif changes.get("sku") is not None:
+            key = ("sku", changes.pop("sku"))
+        else:
+            results.append(
+                BatchItemResult(line=line, status="invalid", detail="Give an id or sku")
+            )
+            continue
+        nulls = [f for f in _NOT_NULL_FIELDS if f in changes and changes[f] is None]
+        if nulls:
+            detail = f"{', '.join(nulls)} cannot be null"
+        elif not changes:
+            detail = "Nothing to update"
+        else:
+            parsed.append((line, key, changes))
+            continue
+        results.append(BatchItemResult(line=line, status="invalid", detail=detail))
+
+    existing_groups = await _existing(
+        session,
+        ProductGroup.id,
+        {c["product_group_id"] for _, _, c in parsed if "product_group_id" in c},
+    )
+    pending: dict[tuple, tuple[list[int], dict]] = {}
+    for line, key, changes in parsed:
+        if "product_group_id" in changes:
+            if changes["product_group_id"] not in existing_groups:
+                results.append(
+                    BatchItemResult(
+                        line=line, status="invalid", detail="Invalid product group ID"
+                    )
+                )
+                continue
+        lines, merged = pending.setdefault(key, ([], {}))
+        lines.append(line)
+        merged.update(changes)
+
+    groups = defaultdict(list)
+    for (key, ident), (_, changes) in pending.items():
+        fields = tuple(sorted(changes))
+        groups[key, fields].append((ident, *(changes[f] for f in fields)))
+
+    dialect = session.bind.dialect.name
+    try:
+        matched, product_ids = set(), []
+        for (key, fields), changes in groups.items():
+            batch, params = _batch_rows(dialect, key, fields, changes)
+            updated = await session.exec(
+                _update_statement(batch, key, fields), params=params
+            )
+            ids = []
+            for product_id, ident in updated:
+                matched.add((key, ident))
+                ids.append(product_id)
+            if not EVENT_FIELDS.isdisjoint(fields):
+                publish_product_changes(session, ids)
+            product_ids += ids
+        mark_listing_stale(session, products=product_ids)
+        record_changes(session, Product, product_ids)
+        await session.commit()
+    except DBAPIError as e:
+        await session.rollback()
+        detail = f"Batch update failed: {e.orig}"
+        results += [
+            BatchItemResult(line=line, status="failed", detail=detail)
+            for lines, _ in pending.values()
+            for line in lines
+        ]
+        return results
+
+    for key, (lines, _) in pending.items():
+        status = "updated" if key in matched else "not_found"
+        results += [BatchItemResult(line=line, status=status) for line in lines]
+    return results
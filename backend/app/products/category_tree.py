@@ -0,0 +1,95 @@
+import os
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import literal
+from sqlmodel import select
+
+from ..cache import cache_versions, table_version_name
+from .models import Category
+from .schemas import CategoryTreeNode
+
+# Upper bound on recursion so a parent cycle cannot make the query run forever.
+MAX_TREE_DEPTH = 32
+CATEGORY_TREE_CACHE_MAX = int(os.getenv("CATEGORY_TREE_CACHE_MAX", "256"))
+
+# LRU of trees by (root_id, clamped depth), tagged with the version of the
+# category table they were built at, which every commit writing to it bumps
+# (see http_cache).
+_cache: OrderedDict[tuple[int | None, int], tuple] = OrderedDict()
+_lock = threading.Lock()
+_VERSION = table_version_name(Category.__tablename__)
+
+
+def invalidate_category_tree():
+    """Drop this process's trees; other workers go by the table version."""
+    with _lock:
+        _cache.clear()
+
+
+def _tree_statement(root_id: int | None, depth: int):
+    columns = (
+        Category.id,
+        Category.name,
+        Category.description,
+        Category.category_parent_id,
+        Category.is_container,
+    )
+    anchor = select(*columns, literal(0).label("depth"))
+    if root_id is None:
+        anchor = anchor.where(Category.category_parent_id.is_(None))
+    else:
+        anchor = anchor.where(Category.id == root_id)
+
+    tree = anchor.cte("category_tree", recursive=True)
+    tree = tree.union_all(
+        select(*columns, (tree.c.depth + 1).label("depth"))
+        .join(tree, Category.category_parent_id == tree.c.id)
+        .where(tree.c.depth < depth)
+    )
+    return select(*tree.c).order_by(tree.c.depth, tree.c.id)
+
+
+def _build_tree(rows) -> list[CategoryTreeNode]:
+    nodes, roots = {}, []
+    for row in rows:
+        node = CategoryTreeNode.model_validate(row, from_attributes=True)
+        nodes[node.id] = node
+        if row.depth == 0:
+            roots.append(node)
+        else:
+            nodes[node.category_parent_id].children.append(node)
+    return roots
+
+
+async def load_category_tree(
+    session, root_id: int | None = None, depth: int | None = None
+) -> list[CategoryTreeNode]:
+    """Load the hierarchy below `root_id` (or all top-level categories).
+
+    The whole tree comes back from one recursive query and is cached until
+    the next category write.
+    """
+    max_depth = MAX_TREE_DEPTH if depth is None else min(depth, MAX_TREE_DEPTH)
+    key = (root_id, max_depth)
+    version = None
+    if cache_versions is not None:
+        # Taken before querying, so a write racing the query makes the
+        # stored tree stale rather than wrongly current.
+        version = await cache_versions.get_async([_VERSION])
+        with _lock:
+            cached = _cache.get(key)
+            if cached is not None and cached[0] == version:
+                _cache.move_to_end(key)
+                return cached[1]
+
+    rows = (await session.exec(_tree_statement(root_id, max_depth))).all()
+    tree = _build_tree(rows)
+
+    if version is not None:
+        with _lock:
+            _cache[key] = (version, tree)
+            _cache.move_to_end(key)
+            while len(_cache) > CATEGORY_TREE_CACHE_MAX:
+                _cache.popitem(last=False)
+    return tree
@@ -0,0 +1,186 @@
+"""Change tracking behind GET /changes.
+
+Every write to a tracked table is recorded in the change log before the
+transaction commits: flushed ORM objects are recorded by the session events
+below, `record_changes` covers core statements. Each row keeps a single log
+entry, replaced on every change under a new sequence number that is also
+stored in the row's `version` column, so reading the log from a position on
+yields every row changed since, once, and tombstones for the rows deleted
+since.
+
+Writers do not wait for each other: on Postgres, sequence numbers are taken
+in write order but become visible in commit order. Entries are therefore
+also tagged with the writing transaction's id and read in (txid, seq) order,
+and only once every older transaction has ended (see api/changes.py), so a
+reader never passes an entry that is committed later.
+"""
+
+from sqlalchemy import event, false, func, insert, inspect, literal, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlmodel import Session
+
+from .listing import products_using_options
+from .models import (
+    Category,
+    ChangeLog,
+    Product,
+    ProductConfig,
+    ProductGroup,
+    ProductImage,
+    Variation,
+    VariationOption,
+    utcnow,
+)
+
+TRACKED = (Product, ProductGroup, Category, Variation, VariationOption, ProductImage)
+TRACKED_BY_ENTITY = {model.__tablename__: model for model in TRACKED}
+
+_PENDING_KEY = "change_log_pending"
+
+
+def record_changes(session, model, ids, *, deleted: bool = False):
+    """Log changes to rows of `model` when `session` commits."""
+    pending = session.info.setdefault(_PENDING_KEY, {})
+    marks = pending.setdefault(model.__tablename__, {})
+    for ident in ids:
+        # A deletion outlives other changes to the row in the transaction.
+        marks[ident] = marks.get(ident, False) or deleted
+
+
+@event.listens_for(Session, "after_flush")
+def _record_flushed(session, flush_context):
+    for objects, deleted in (
+        (session.new, False),
+        (session.dirty, False),
+        (session.deleted, True),
+    ):
+        for obj in objects:
+            if isinstance(obj, TRACKED):
+                record_changes(session, type(obj), [obj.id], deleted=deleted)
+            if isinstance(obj, (ProductConfig, ProductImage)):
+                # Options and images are part of the product, as exported.
+                history = inspect(obj).attrs["product_id"].history
+                product_ids = {obj.product_id, *history.deleted} - {None}
+                record_changes(session, Product, product_ids)
+
+
+@event.listens_for(Session, "before_flush")
+def _record_deleted_options(session, flush_context, instances):
+    # The flush deletes an option's ProductConfig rows along with it, without
+    # loading them, so the products are looked up while the rows still exist.
+    options = [obj.id for obj in session.deleted if isinstance(obj, VariationOption)]
+    variations = [obj.id for obj in session.deleted if isinstance(obj, Variation)]
+    if options or variations:
+        product_ids = products_using_options(
+            session, options=options, variations=variations
+        )
+        record_changes(session, Product, product_ids)
+
+
+def _txid(dialect: str):
+    return func.txid_current() if dialect == "postgresql" else literal(0)
+
+
+def _upsert(dialect: str):
+    """INSERT replacing a row's entry under a new sequence number."""
+    table = ChangeLog.__table__
+    if dialect == "postgresql":
+        statement = postgresql.insert(table).values(txid=_txid(dialect))
+        return statement.on_conflict_do_update(
+            index_elements=[table.c.entity, table.c.entity_id],
+            set_={
+                "seq": func.nextval(func.pg_get_serial_sequence("changelog", "seq")),
+                "txid": statement.excluded.txid,
+                "deleted": statement.excluded.deleted,
+                "changed_at": statement.excluded.changed_at,
+            },
+        )
+    # REPLACE deletes the old entry; AUTOINCREMENT never reuses its seq.
+    return sqlite.insert(table).prefix_with("OR REPLACE")
+
+
+def _written_from_here(session):
+    """Clause matching the log entries this transaction writes from now on."""
+    if session.bind.dialect.name == "postgresql":
+        # Other transactions may commit entries in between.
+        return ChangeLog.txid == func.txid_current()
+    # SQLite runs one writing transaction at a time.
+    last_seq = select(func.coalesce(func.max(ChangeLog.seq), 0))
+    return ChangeLog.seq > session.exec(last_seq).scalar()
+
+
+def _update_versions(session, entity: str, written):
+    """Copy the entity's log entries matching `written` to the rows."""
+    table = TRACKED_BY_ENTITY[entity].__table__
+    session.exec(
+        update(table)
+        # Leave updated_at to the write that was logged.
+        .values(version=ChangeLog.seq, updated_at=table.c.updated_at).where(
+            ChangeLog.entity == entity,
+            ChangeLog.entity_id == table.c.id,
+            written,
+        )
+    )
+
+
+def write_change_log(session, pending: dict[str, dict[int, bool]]):
+    """Write the log entries and row versions of `pending` changes."""
+    dialect = session.bind.dialect.name
+    written = _written_from_here(session)
+    upsert = _upsert(dialect)
+    changed_at = utcnow()
+    for entity, marks in sorted(pending.items()):
+        if not marks:
+            continue
+        session.exec(
+            upsert,
+            params=[
+                {
+                    "entity": entity,
+                    "entity_id": ident,
+                    "deleted": deleted,
+                    "changed_at": changed_at,
+                }
+                for ident, deleted in marks.items()
+            ],
+        )
+        if not all(marks.values()):
+            _update_versions(session, entity, written)
+
+
+def backfill_change_log(session):
+    """Log every row of tracked tables that have rows but no log entries.
+
+    Run at startup, so reading the log from 0 always yields the whole
+    catalog, also for tables that were filled before they were tracked.
+    """
+    txid = _txid(session.bind.dialect.name)
+    for entity, model in TRACKED_BY_ENTITY.items():
+        logged = select(ChangeLog.seq).where(ChangeLog.entity == entity).limit(1)
+        if session.exec(logged).first() is not None:
+            continue
+        written = _written_from_here(session)
+        session.exec(
+            insert(ChangeLog).from_select(
+                ["entity", "entity_id", "txid", "deleted", "changed_at"],
+                select(
+                    literal(entity), model.id, txid, false(), model.updated_at
+                ).order_by(model.id),
+            )
+        )
+        _update_versions(session, entity, written)
+    session.commit()
+
+
+@event.listens_for(Session, "before_commit")
+def _write_pending(session):
+    # Changes still pending are only recorded by the flush.
+    session.flush()
+    pending = session.info.pop(_PENDING_KEY, None)
+    if pending:
+        write_change_log(session, pending)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_pending(session):
+    session.info.pop(_PENDING_KEY, None)
@@ -0,0 +1,271 @@
+"""Live price and stock updates behind GET /products/stream.
+
+Commits that change a product's price or stock publish the product's new
+values to the in-process `product_events` broker, which fans them out to
+the streams subscribed to the product or its group. ORM updates are picked
+up by the session events below, `publish_product_changes` covers core
+statements.
+
+With EVENTS_BRIDGE=postgres the values are sent with NOTIFY inside the
+committing transaction instead, and every worker's PostgresBridge feeds
+them into its own broker, so a stream sees writes made by any worker.
+"""
+
+import asyncio
+import logging
+import os
+
+import orjson
+from sqlalchemy import event, func, inspect
+from sqlmodel import Session, col, select
+
+from .models import Product
+
+logger = logging.getLogger(__name__)
+
+EVENTS_BRIDGE = os.getenv("EVENTS_BRIDGE", "memory")
+EVENTS_CHANNEL = os.getenv("EVENTS_CHANNEL", "product_events")
+# Events a stream may have waiting; a stream that falls further behind is
+# closed, and its client reconnects and refetches.
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "256"))
+# Seconds between keep-alive comments on idle streams and health checks of
+# the LISTEN connection.
+EVENTS_KEEPALIVE = float(os.getenv("EVENTS_KEEPALIVE", "15"))
+# Product and group ids one stream may subscribe to.
+EVENTS_MAX_IDS = int(os.getenv("EVENTS_MAX_IDS", "500"))
+EVENTS_RECONNECT_DELAY = float(os.getenv("EVENTS_RECONNECT_DELAY", "2"))
+
+# Events per NOTIFY, keeping payloads well below the 8000 byte limit.
+NOTIFY_BATCH = 50
+# Products whose values are read per SELECT on commit.
+READ_BATCH = 1000
+
+EVENT_FIELDS = frozenset({"price", "stock_qty"})
+
+_PENDING_KEY = "product_events_pending"
+_READY_KEY = "product_events_ready"
+
+
+class Subscription:
+    """One stream's filter and its bounded queue of events."""
+
+    def __init__(self, product_ids, product_group_ids, maxsize: int):
+        self.product_ids = frozenset(product_ids)
+        self.product_group_ids = frozenset(product_group_ids)
+        self.queue: asyncio.Queue[dict] = asyncio.Queue(maxsize)
+        self.overflowed = False
+
+    def put(self, product_event: dict):
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(product_event)
+        except asyncio.QueueFull:
+            # Never block the publisher on one slow client.
+            self.overflowed = True
+
+
+class Broker:
+    """Fan-out of product events to subscriptions, by product and by group.
+
+    Subscriptions are only touched on the event loop that created them;
+    `publish` may be called from any thread.
+    """
+
+    def __init__(self, queue_size: int = EVENTS_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._by_product: dict[int, set[Subscription]] = {}
+        self._by_group: dict[int, set[Subscription]] = {}
+        self._count = 0
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    @property
+    def has_subscribers(self) -> bool:
+        return self._count > 0
+
+    def subscribe(self, product_ids=(), product_group_ids=()) -> Subscription:
+        self._loop = asyncio.get_running_loop()
+        subscription = Subscription(product_ids, product_group_ids, self.queue_size)
+        for product_id in subscription.product_ids:
+            self._by_product.setdefault(product_id, set()).add(subscription)
+        for group_id in subscription.product_group_ids:
+            self._by_group.setdefault(group_id, set()).add(subscription)
+        self._count += 1
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        for index, ids in (
+            (self._by_product, subscription.product_ids),
+            (self._by_group, subscription.product_group_ids),
+        ):
+            for ident in ids:
+                subscribers = index.get(ident)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del index[ident]
+        self._count -= 1
+
+    def publish(self, events: list[dict]):
+        loop = self._loop
+        if loop is None or not self.has_subscribers:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self._deliver(events)
+            return
+        try:
+            loop.call_soon_threadsafe(self._deliver, events)
+        except RuntimeError:
+            # The loop has shut down, and its streams with it.
+            pass
+
+    def _deliver(self, events: list[dict]):
+        for product_event in events:
+            subscribers = self._by_product.get(
+                product_event["product_id"], set()
+            ).union(self._by_group.get(product_event["product_group_id"], ()))
+            for subscription in subscribers:
+                subscription.put(product_event)
+
+
+product_events = Broker()
+
+
+def publish_product_changes(session, product_ids):
+    """Publish the price and stock of these products when `session` commits."""
+    session.info.setdefault(_PENDING_KEY, set()).update(product_ids)
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_flushed(session, flush_context):
+    changed = [
+        obj.id
+        for obj in session.dirty
+        if isinstance(obj, Product)
+        and any(inspect(obj).attrs[f].history.has_changes() for f in EVENT_FIELDS)
+    ]
+    if changed:
+        publish_product_changes(session, changed)
+
+
+def _current_values(session, product_ids) -> list[dict]:
+    product_ids = sorted(product_ids)
+    events = []
+    for start in range(0, len(product_ids), READ_BATCH):
+        rows = session.exec(
+            select(
+                Product.id, Product.product_group_id, Product.price, Product.stock_qty
+            ).where(col(Product.id).in_(product_ids[start : start + READ_BATCH]))
+        )
+        events += [
+            {
+                "product_id": product_id,
+                "product_group_id": group_id,
+                "price": price,
+                "stock_qty": stock_qty,
+            }
+            for product_id, group_id, price, stock_qty in rows
+        ]
+    return events
+
+
+@event.listens_for(Session, "before_commit")
+def _read_pending(session):
+    # Changes still pending are only collected by the flush.
+    session.flush()
+    product_ids = session.info.pop(_PENDING_KEY, None)
+    if not product_ids:
+        return
+    if EVENTS_BRIDGE == "postgres":
+        # Delivered by Postgres to every listener once the commit succeeds.
+        events = _current_values(session, product_ids)
+        for start in range(0, len(events), NOTIFY_BATCH):
+            payload = orjson.dumps(events[start : start + NOTIFY_BATCH]).decode()
+            session.exec(select(func.pg_notify(EVENTS_CHANNEL, payload)))
+    elif product_events.has_subscribers:
+        session.info[_READY_KEY] = _current_values(session, product_ids)
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_ready(session):
+    events = session.info.pop(_READY_KEY, None)
+    if events:
+        product_events.publish(events)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_pending(session):
+    session.info.pop(_PENDING_KEY, None)
+    session.info.pop(_READY_KEY, None)
+
+
+def _sse(event_name: str, data) -> bytes:
+    return b"event: " + event_name.encode() + b"\ndata: " + orjson.dumps(data) + b"\n\n"
+
+
+async def sse_stream(
+    subscription: Subscription,
+    broker: Broker = product_events,
+    keepalive: float = EVENTS_KEEPALIVE,
+):
+    """Encode a subscription's events as text/event-stream until it overflows."""
+    try:
+        yield b": connected\n\n"
+        while True:
+            try:
+                product_event = await asyncio.wait_for(
+                    subscription.queue.get(), keepalive
+                )
+            except asyncio.TimeoutError:
+                yield b": keep-alive\n\n"
+                continue
+            yield _sse("product", product_event)
+            if subscription.overflowed and subscription.queue.empty():
+                break
+        yield _sse("overflow", {})
+    finally:
+        broker.unsubscribe(subscription)
+
+
+class PostgresBridge:
+    """LISTENs on EVENTS_CHANNEL and publishes what every worker NOTIFYs."""
+
+    def __init__(self, dsn: str, broker: Broker = product_events):
+        self.dsn = dsn
+        self.broker = broker
+
+    def _on_notify(self, connection, pid, channel, payload):
+        self.broker.publish(orjson.loads(payload))
+
+    async def run(self):
+        import asyncpg
+
+        connection_errors = (
+            OSError,
+            TimeoutError,
+            asyncpg.PostgresError,
+            asyncpg.InterfaceError,
+        )
+        while True:
+            try:
+                connection = await asyncpg.connect(self.dsn)
+            except connection_errors as e:
+                logger.warning("Event bridge cannot connect: %s", e)
+                await asyncio.sleep(EVENTS_RECONNECT_DELAY)
+                continue
+            try:
+                await connection.add_listener(EVENTS_CHANNEL, self._on_notify)
+                while True:
+                    await asyncio.sleep(EVENTS_KEEPALIVE)
+                    await connection.execute("SELECT 1")
+            except connection_errors as e:
+                # Events sent while reconnecting are lost; streams only
+                # carry live values, so clients catch up on the next change.
+                logger.warning("Event bridge lost its connection: %s", e)
+            finally:
+                connection.terminate()
+            await asyncio.sleep(EVENTS_RECONNECT_DELAY)
@@ -0,0 +1,168 @@
+"""Streaming export of the whole catalog for feeds.
+
+Products are read through a server-side cursor in partitions of
+EXPORT_BATCH_SIZE and encoded partition by partition, so memory use does
+not depend on the size of the catalog.
+"""
+
+import csv
+import io
+import os
+import zlib
+from datetime import datetime
+
+import orjson
+from sqlalchemy import JSON, exists, func, or_, type_coerce
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from sqlmodel import select
+
+from ..http_cache import accepts_gzip  # noqa: F401
+from .bulk import CSV_OPTION_SEPARATOR
+from .listing import options_json_column
+from .models import (
+    Category,
+    ChangeLog,
+    Product,
+    ProductConfig,
+    ProductGroup,
+    ProductImage,
+    Variation,
+    VariationOption,
+)
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+
+CSV_COLUMNS = [
+    "id",
+    "name",
+    "sku",
+    "price",
+    "stock_qty",
+    "description",
+    "product_group_id",
+    "product_group_name",
+    "category_id",
+    "category_name",
+    "options",
+    "option_values",
+    "image_urls",
+    "updated_at",
+]
+
+
+# When the product, its options or its images last changed.
+_CHANGED_AT = func.coalesce(ChangeLog.changed_at, Product.updated_at)
+
+
+def _image_urls_column(dialect: str):
+    if dialect == "postgresql":
+        aggregate = func.json_agg(aggregate_order_by(ProductImage.url, ProductImage.id))
+    else:
+        aggregate = func.json_group_array(ProductImage.url)
+    return (
+        select(aggregate).where(ProductImage.product_id == Product.id).scalar_subquery()
+    )
+
+
+def _changed_since(since: datetime):
+    """Products whose exported row may differ from what it was at `since`.
+
+    The product's change log entry covers writes to the product and to its
+    options and images, deletions included; group, category, variation and
+    option names are checked by their own updated_at.
+    """
+    renamed_options = exists().where(
+        ProductConfig.product_id == Product.id,
+        VariationOption.id == ProductConfig.variation_option_id,
+        Variation.id == VariationOption.variation_id,
+        or_(VariationOption.updated_at >= since, Variation.updated_at >= since),
+    )
+    return or_(
+        _CHANGED_AT >= since,
+        ProductGroup.updated_at >= since,
+        Category.updated_at >= since,
+        renamed_options,
+    )
+
+
+def export_statement(dialect: str, updated_since: datetime | None = None):
+    statement = (
+        select(
+            Product.id,
+            Product.name,
+            Product.sku,
+            Product.price,
+            Product.stock_qty,
+            Product.description,
+            Product.product_group_id,
+            ProductGroup.name.label("product_group_name"),
+            Category.id.label("category_id"),
+            Category.name.label("category_name"),
+            type_coerce(options_json_column(dialect), JSON).label("options"),
+            type_coerce(_image_urls_column(dialect), JSON).label("image_urls"),
+            _CHANGED_AT.label("updated_at"),
+        )
+        .join(ProductGroup, ProductGroup.id == Product.product_group_id)
+        .outerjoin(Category, Category.id == ProductGroup.category_id)
+        .outerjoin(
+            ChangeLog,
+            (ChangeLog.entity == Product.__tablename__)
+            & (ChangeLog.entity_id == Product.id),
+        )
+        .order_by(Product.id)
+    )
+    if updated_since is not None:
+        statement = statement.where(_changed_since(updated_since))
+    return statement
+
+
+def _row_to_dict(row) -> dict:
+    data = row._asdict()
+    data["options"] = sorted(data["options"] or [], key=lambda o: o["variation_id"])
+    data["image_urls"] = data["image_urls"] or []
+    return data
+
+
+def _ndjson(rows) -> bytes:
+    return b"".join(orjson.dumps(_row_to_dict(row)) + b"\n" for row in rows)
+
+
+def _csv(rows) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    for row in rows:
+        data = _row_to_dict(row)
+        options = data["options"]
+        data["options"] = CSV_OPTION_SEPARATOR.join(
+            str(o["option_id"]) for o in options
+        )
+        data["option_values"] = CSV_OPTION_SEPARATOR.join(
+            f"{o['variation']}: {o['value']}" for o in options
+        )
+        data["image_urls"] = CSV_OPTION_SEPARATOR.join(data["image_urls"])
+        data["updated_at"] = data["updated_at"].isoformat()
+        writer.writerow([data[column] for column in CSV_COLUMNS])
+    return buffer.getvalue().encode()
+
+
+async def export_chunks(result, fmt: str):
+    """Encode a streamed result, one chunk per partition."""
+    encode = _csv if fmt == "csv" else _ndjson
+    try:
+        if fmt == "csv":
+            yield (",".join(CSV_COLUMNS) + "\n").encode()
+        async for rows in result.partitions(EXPORT_BATCH_SIZE):
+            yield encode(rows)
+    finally:
+        await result.close()
+
+
+async def gzipped(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    async for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,190 @@
+"""Resized variants of uploaded product images.
+
+Variants are rendered by Pillow in a process pool, so decoding and encoding
+large images neither blocks the event loop nor holds the GIL of the worker
+serving requests. Each variant is rendered once, written to the disk cache
+and served from there afterwards.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import AsyncIterator
+
+from fastapi import HTTPException, status
+from starlette.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", "media/cache")
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+IMAGE_MAX_UPLOAD_BYTES = int(os.getenv("IMAGE_MAX_UPLOAD_BYTES", str(20 * 2**20)))
+IMAGE_CACHE_MAX_AGE = int(os.getenv("IMAGE_CACHE_MAX_AGE", "86400"))
+# Requested widths are rounded up to one of these, which bounds the number
+# of variants a client can make us render and cache.
+IMAGE_WIDTHS = tuple(
+    sorted(
+        int(w) for w in os.getenv("IMAGE_WIDTHS", "160,320,640,1024,1600").split(",")
+    )
+)
+# Variants rendered right after an upload, as width:format pairs.
+IMAGE_PREGENERATE = [
+    (int(width), fmt)
+    for width, fmt in (
+        item.split(":")
+        for item in os.getenv("IMAGE_PREGENERATE", "320:webp,640:webp").split(",")
+        if item
+    )
+]
+
+FORMATS = {
+    "webp": ("WEBP", "image/webp", {"quality": 80, "method": 4}),
+    "avif": ("AVIF", "image/avif", {"quality": 60}),
+    "jpeg": ("JPEG", "image/jpeg", {"quality": 85, "optimize": True}),
+}
+
+_SIGNATURES = (
+    b"\xff\xd8\xff",  # JPEG
+    b"\x89PNG\r\n\x1a\n",
+    b"GIF87a",
+    b"GIF89a",
+)
+
+
+def is_image(head: bytes) -> bool:
+    """Recognise the formats we accept from the first bytes of a file."""
+    if head.startswith(_SIGNATURES):
+        return True
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return True
+    return head[4:8] == b"ftyp" and head[8:12] in (b"avif", b"avis")
+
+
+async def checked_image_chunks(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Pass chunks through, rejecting the upload unless it starts like an image."""
+    head = b""
+    checked = False
+    async for chunk in chunks:
+        if not checked:
+            head += chunk
+            if len(head) < 12:
+                continue
+            if not is_image(head):
+                raise HTTPException(
+                    status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                    detail="Upload a JPEG, PNG, GIF, WebP or AVIF image",
+                )
+            checked, chunk = True, head
+        yield chunk
+    if not checked:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail="Upload a JPEG, PNG, GIF, WebP or AVIF image",
+        )
+
+
+def snap_width(width: int | None) -> int:
+    """The smallest allowed width >= `width`, or the largest one."""
+    if width is not None:
+        for allowed in IMAGE_WIDTHS:
+            if allowed >= width:
+                return allowed
+    return IMAGE_WIDTHS[-1]
+
+
+def variant_path(key: str, width: int, fmt: str) -> Path:
+    return Path(IMAGE_CACHE_DIR) / key / f"{width}.{fmt}"
+
+
+def variant_etag(key: str, width: int, fmt: str) -> str:
+    # Storage keys are never reused, so the key identifies the content.
+    return f'"{key.replace("/", "-")}-{width}.{fmt}"'
+
+
+def _render(source: str, dest: str, width: int, fmt: str):
+    """Runs in a pool process."""
+    from PIL import Image, ImageOps
+
+    pil_format, _, options = FORMATS[fmt]
+    with Image.open(source) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.width > width:
+            height = max(round(image.height * width / image.width), 1)
+            image = image.resize((width, height), Image.Resampling.LANCZOS)
+        if pil_format == "JPEG" and image.mode != "RGB":
+            image = image.convert("RGB")
+        elif image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA")
+
+        temp = f"{dest}.{os.getpid()}.tmp"
+        try:
+            image.save(temp, pil_format, **options)
+            os.replace(temp, dest)
+        finally:
+            if os.path.exists(temp):
+                os.remove(temp)
+
+
+_pool: ProcessPoolExecutor | None = None
+_pending: dict[Path, asyncio.Future] = {}
+
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # Forking a process that runs threads can deadlock the child.
+        _pool = ProcessPoolExecutor(
+            IMAGE_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+    return _pool
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
+
+
+async def _render_to_cache(storage, key: str, width: int, fmt: str, dest: Path):
+    source = await storage.local_path(key)
+    await run_in_threadpool(dest.parent.mkdir, parents=True, exist_ok=True)
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(get_pool(), _render, str(source), str(dest), width, fmt)
+
+
+async def render_variant(storage, key: str, width: int, fmt: str) -> Path:
+    """Return the cached variant, rendering it first if needed.
+
+    Concurrent requests for the same missing variant share one render.
+    """
+    dest = variant_path(key, width, fmt)
+    if dest.exists():
+        return dest
+
+    task = _pending.get(dest)
+    if task is None:
+        task = asyncio.ensure_future(_render_to_cache(storage, key, width, fmt, dest))
+        _pending[dest] = task
+        task.add_done_callback(lambda _: _pending.pop(dest, None))
+    # A client going away must not cancel the render others are waiting on.
+    await asyncio.shield(task)
+    return dest
+
+
+async def pregenerate_variants(storage, key: str):
+    for width, fmt in IMAGE_PREGENERATE:
+        try:
+            await render_variant(storage, key, snap_width(width), fmt)
+        except Exception:
+            logger.exception("Rendering %s at %d as %s failed", key, width, fmt)
+
+
+async def delete_variants(key: str):
+    await run_in_threadpool(
+        shutil.rmtree, Path(IMAGE_CACHE_DIR) / key, ignore_errors=True
+    )
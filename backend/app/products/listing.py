@@ -0,0 +1,277 @@
+"""The product_listing read model behind GET /catalog/listing.
+
+One row per product with its group, category, first image and option values
+already joined, so category pages read a single table. Rows are refreshed
+inside the transaction that changes their sources: flushed ORM objects mark
+the products they affect, `mark_listing_stale` covers core statements, and
+just before the commit the marked products' rows are deleted and selected
+again from the source tables.
+"""
+
+from sqlalchemy import delete, event, func, insert, inspect, or_
+from sqlmodel import Session, select
+
+from .models import (
+    Category,
+    Product,
+    ProductConfig,
+    ProductGroup,
+    ProductImage,
+    ProductListing,
+    Variation,
+    VariationOption,
+)
+
+# Products refreshed per DELETE/INSERT pair.
+LISTING_REFRESH_BATCH = 1000
+
+_STALE_KEY = "product_listing_stale"
+_GROUPS_KEY = "product_listing_refreshed_groups"
+_KINDS = ("products", "groups", "categories", "variations", "options")
+
+
+def mark_listing_stale(
+    session,
+    *,
+    products=(),
+    groups=(),
+    categories=(),
+    variations=(),
+    options=(),
+):
+    """Refresh the listing rows these rows feed into when `session` commits."""
+    stale = session.info.setdefault(_STALE_KEY, {kind: set() for kind in _KINDS})
+    stale["products"].update(products)
+    stale["groups"].update(groups)
+    stale["categories"].update(categories)
+    stale["variations"].update(variations)
+    stale["options"].update(options)
+
+
+def _with_previous(obj, attribute: str) -> set:
+    # A row moved to another product affects the one it left as well.
+    history = inspect(obj).attrs[attribute].history
+    return {getattr(obj, attribute), *history.deleted} - {None}
+
+
+@event.listens_for(Session, "after_flush")
+def _mark_flushed(session, flush_context):
+    stale = {kind: set() for kind in _KINDS}
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, Product):
+            stale["products"].add(obj.id)
+        elif isinstance(obj, (ProductImage, ProductConfig)):
+            stale["products"].update(_with_previous(obj, "product_id"))
+        elif isinstance(obj, ProductGroup):
+            stale["groups"].add(obj.id)
+        elif isinstance(obj, Category):
+            stale["categories"].add(obj.id)
+        elif isinstance(obj, Variation):
+            stale["variations"].add(obj.id)
+        elif isinstance(obj, VariationOption):
+            stale["options"].add(obj.id)
+    if any(stale.values()):
+        mark_listing_stale(session, **stale)
+
+
+def products_using_options(session, *, options=(), variations=()) -> set[int]:
+    """Products configured with any of `options` or the options of `variations`."""
+    statement = (
+        select(ProductConfig.product_id)
+        .join(VariationOption, VariationOption.id == ProductConfig.variation_option_id)
+        .where(
+            or_(
+                VariationOption.id.in_(options),
+                VariationOption.variation_id.in_(variations),
+            )
+        )
+    )
+    with session.no_autoflush:
+        return set(session.exec(statement).all())
+
+
+@event.listens_for(Session, "before_flush")
+def _mark_deleted_options(session, flush_context, instances):
+    # The flush deletes an option's ProductConfig rows along with it, so the
+    # products using it are looked up while those rows still exist.
+    options = [o.id for o in session.deleted if isinstance(o, VariationOption)]
+    variations = [v.id for v in session.deleted if isinstance(v, Variation)]
+    if options or variations:
+        mark_listing_stale(
+            session,
+            products=products_using_options(
+                session, options=options, variations=variations
+            ),
+        )
+
+
+def options_json_column(dialect: str):
+    """Correlated subquery with a product's options as a JSON array."""
+    fields = (
+        "variation_id",
+        Variation.id,
+        "variation",
+        Variation.name,
+        "option_id",
+        VariationOption.id,
+        "value",
+        VariationOption.value,
+    )
+    if dialect == "postgresql":
+        aggregate = func.json_agg(func.json_build_object(*fields))
+    else:
+        aggregate = func.json_group_array(func.json_object(*fields))
+    return (
+        select(aggregate)
+        .select_from(ProductConfig)
+        .join(VariationOption, VariationOption.id == ProductConfig.variation_option_id)
+        .join(Variation, Variation.id == VariationOption.variation_id)
+        .where(ProductConfig.product_id == Product.id)
+        .scalar_subquery()
+    )
+
+
+def _listing_select(dialect: str):
+    first_image = (
+        select(ProductImage.url)
+        .where(ProductImage.product_id == Product.id)
+        .order_by(ProductImage.id)
+        .limit(1)
+        .scalar_subquery()
+    )
+    return (
+        select(
+            Product.id,
+            Product.name,
+            Product.price,
+            Product.stock_qty,
+            Product.sku,
+            Product.product_group_id,
+            ProductGroup.name,
+            Category.id,
+            Category.name,
+            first_image,
+            options_json_column(dialect),
+        )
+        .join(ProductGroup, ProductGroup.id == Product.product_group_id)
+        .outerjoin(Category, Category.id == ProductGroup.category_id)
+    )
+
+
+_LISTING_COLUMNS = [
+    "product_id",
+    "name",
+    "price",
+    "stock_qty",
+    "sku",
+    "product_group_id",
+    "product_group_name",
+    "category_id",
+    "category_name",
+    "image_url",
+    "options",
+]
+
+
+def _affected_products(session, stale: dict[str, set]) -> set[int]:
+    product_ids = set(stale["products"])
+    lookups = (
+        (
+            "groups",
+            select(Product.id).where(Product.product_group_id.in_(stale["groups"])),
+        ),
+        (
+            "categories",
+            select(Product.id)
+            .join(ProductGroup, ProductGroup.id == Product.product_group_id)
+            .where(ProductGroup.category_id.in_(stale["categories"])),
+        ),
+        (
+            "variations",
+            select(ProductConfig.product_id)
+            .join(
+                VariationOption,
+                VariationOption.id == ProductConfig.variation_option_id,
+            )
+            .where(VariationOption.variation_id.in_(stale["variations"])),
+        ),
+        (
+            "options",
+            select(ProductConfig.product_id).where(
+                ProductConfig.variation_option_id.in_(stale["options"])
+            ),
+        ),
+    )
+    for kind, statement in lookups:
+        if stale[kind]:
+            product_ids.update(session.exec(statement).all())
+    return product_ids
+
+
+def refresh_product_listing(session, product_ids) -> set[int]:
+    """Rebuild the listing rows of `product_ids`, dropping deleted products.
+
+    Returns the product groups the rows belonged to before or after.
+    """
+    listing = _listing_select(session.bind.dialect.name)
+    product_ids = sorted(product_ids)
+    group_ids = set()
+    for start in range(0, len(product_ids), LISTING_REFRESH_BATCH):
+        batch = product_ids[start : start + LISTING_REFRESH_BATCH]
+        deleted = session.exec(
+            delete(ProductListing)
+            .where(ProductListing.product_id.in_(batch))
+            .returning(ProductListing.product_group_id)
+        )
+        group_ids.update(deleted.scalars())
+        inserted = session.exec(
+            insert(ProductListing)
+            .from_select(_LISTING_COLUMNS, listing.where(Product.id.in_(batch)))
+            .returning(ProductListing.product_group_id)
+        )
+        group_ids.update(inserted.scalars())
+    return group_ids
+
+
+def pop_refreshed_groups(session) -> set[int]:
+    """Groups whose products or own row the committed transaction changed."""
+    return session.info.pop(_GROUPS_KEY, set())
+
+
+def rebuild_product_listing(session):
+    """Rebuild every row, for a new or out-of-sync listing table."""
+    session.exec(delete(ProductListing))
+    session.exec(
+        insert(ProductListing).from_select(
+            _LISTING_COLUMNS, _listing_select(session.bind.dialect.name)
+        )
+    )
+
+
+def backfill_product_listing(session):
+    """Build the listing if it is empty while there are products."""
+    if session.exec(select(ProductListing.product_id).limit(1)).first() is not None:
+        return
+    if session.exec(select(Product.id).limit(1)).first() is None:
+        return
+    rebuild_product_listing(session)
+    session.commit()
+
+
+@event.listens_for(Session, "before_commit")
+def _refresh_stale(session):
+    # Changes still pending are only marked by the flush.
+    session.flush()
+    stale = session.info.pop(_STALE_KEY, None)
+    if stale:
+        group_ids = session.info.setdefault(_GROUPS_KEY, set())
+        group_ids.update(stale["groups"])
+        product_ids = _affected_products(session, stale)
+        if product_ids:
+            group_ids.update(refresh_product_listing(session, product_ids))
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_stale(session):
+    session.info.pop(_STALE_KEY, None)
+    session.info.pop(_GROUPS_KEY, None)
@@ -1,21 +1,46 @@
+from datetime import datetime, timezone
 from typing import Optional
 
+from sqlalchemy import DDL, JSON, BigInteger, Column, Index, event
 from sqlmodel import Field, Relationship, SQLModel
 
 from .schemas import (
     CategoryBase,
+    ChangeBase,
     ProductBase,
     ProductConfigBase,
     ProductGroupBase,
     ProductImageBase,
+    ProductListingBase,
+    StockReservationBase,
+    StockReservationLineBase,
     VariationBase,
     VariationOptionBase,
 )
 
 
-class Category(CategoryBase, table=True):
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class ChangeTracked(SQLModel):
+    """Columns maintained by products/changes.py on every write."""
+
+    # Column default and onupdate, so core INSERTs and UPDATEs set it too.
+    updated_at: datetime = Field(
+        default_factory=utcnow,
+        index=True,
+        sa_column_kwargs={"default": utcnow, "onupdate": utcnow},
+    )
+    # Sequence number of the row's latest entry in the change log.
+    version: int = Field(default=0, sa_column_kwargs={"default": 0})
+
+
+class Category(CategoryBase, ChangeTracked, table=True):
     id: int | None = Field(default=None, primary_key=True)
-    category_parent_id: int | None = Field(default=None, foreign_key="category.id")
+    category_parent_id: int | None = Field(
+        default=None, foreign_key="category.id", index=True
+    )
     parent: Optional["Category"] = Relationship(
         back_populates="subcategories",
         sa_relationship_kwargs={"remote_side": "Category.id"},
@@ -29,11 +54,26 @@ class Category(CategoryBase, table=True):
 
 
 class ProductConfig(ProductConfigBase, table=True):
+    # The primary key covers lookups by option; this covers lookups by product.
+    __table_args__ = (
+        Index(
+            "ix_productconfig_product_id_option_id", "product_id", "variation_option_id"
+        ),
+    )
+
     variation_option_id: int = Field(foreign_key="variationoption.id", primary_key=True)
     product_id: int = Field(foreign_key="product.id", primary_key=True)
 
 
-class Product(ProductBase, table=True):
+class Product(ProductBase, ChangeTracked, table=True):
+    # Composite indexes backing keyset pagination on the non-id sort keys and
+    # group listings filtered by price.
+    __table_args__ = (
+        Index("ix_product_price_id", "price", "id"),
+        Index("ix_product_name_id", "name", "id"),
+        Index("ix_product_product_group_id_price", "product_group_id", "price"),
+    )
+
     id: int | None = Field(default=None, primary_key=True)
     product_group_id: int = Field(foreign_key="productgroup.id")
     product_group: list["ProductGroup"] = Relationship(back_populates="products")
@@ -43,14 +83,14 @@ class Product(ProductBase, table=True):
     )
 
 
-class ProductGroup(ProductGroupBase, table=True):
+class ProductGroup(ProductGroupBase, ChangeTracked, table=True):
     id: int | None = Field(default=None, primary_key=True)
-    category_id: int = Field(foreign_key="category.id")
+    category_id: int = Field(foreign_key="category.id", index=True)
     products: list["Product"] = Relationship(back_populates="product_group")
     category: list["Category"] = Relationship(back_populates="product_groups")
 
 
-class Variation(VariationBase, table=True):
+class Variation(VariationBase, ChangeTracked, table=True):
     id: int | None = Field(default=None, primary_key=True)
     category_id: int = Field(foreign_key="category.id")
     category: list["Category"] = Relationship(back_populates="variations")
@@ -59,16 +99,144 @@ class Variation(VariationBase, table=True):
     )
 
 
-class VariationOption(VariationOptionBase, table=True):
+class VariationOption(VariationOptionBase, ChangeTracked, table=True):
     id: int | None = Field(default=None, primary_key=True)
-    variation_id: int = Field(foreign_key="variation.id")
+    variation_id: int = Field(foreign_key="variation.id", index=True)
     variation: list["Variation"] = Relationship(back_populates="variation_options")
     product: list["Product"] = Relationship(
         back_populates="variation_options", link_model=ProductConfig
     )
 
 
-class ProductImage(ProductImageBase, table=True):
+class ProductImage(ProductImageBase, ChangeTracked, table=True):
     id: int | None = Field(default=None, primary_key=True)
     product_id: int = Field(foreign_key="product.id")
+    # Set for uploaded images: where the original lives in app.storage.
+    storage_key: str | None = None
     product: list["Product"] = Relationship(back_populates="product_images")
+
+
+class StockReservation(StockReservationBase, table=True):
+    # Covers the sweep for expired reservations.
+    __table_args__ = (
+        Index("ix_stockreservation_status_expires_at", "status", "expires_at"),
+    )
+
+    id: int | None = Field(default=None, primary_key=True)
+    lines: list["StockReservationLine"] = Relationship(
+        back_populates="reservation", cascade_delete=True
+    )
+
+
+class StockReservationLine(StockReservationLineBase, table=True):
+    reservation_id: int = Field(foreign_key="stockreservation.id", primary_key=True)
+    product_id: int = Field(foreign_key="product.id", primary_key=True)
+    reservation: StockReservation = Relationship(back_populates="lines")
+
+
+class ProductListing(ProductListingBase, table=True):
+    """Denormalized read model of category pages, see products/listing.py."""
+
+    __table_args__ = (
+        Index("ix_productlisting_category_id_product_id", "category_id", "product_id"),
+        Index(
+            "ix_productlisting_category_id_price_product_id",
+            "category_id",
+            "price",
+            "product_id",
+        ),
+        Index(
+            "ix_productlisting_product_group_id_product_id",
+            "product_group_id",
+            "product_id",
+        ),
+    )
+
+    # No foreign key: rows of deleted products are removed by the refresh
+    # in the same transaction.
+    product_id: int = Field(primary_key=True, sa_column_kwargs={"autoincrement": False})
+    options: list[dict] | None = Field(default=None, sa_column=Column(JSON))
+
+
+class ChangeLog(ChangeBase, table=True):
+    """The latest change of every tracked row, see products/changes.py.
+
+    A row's entry is replaced on each change, so the log holds one entry per
+    row and deleted rows leave a tombstone.
+    """
+
+    __table_args__ = (
+        Index("ix_changelog_entity_entity_id", "entity", "entity_id", unique=True),
+        Index("ix_changelog_txid_seq", "txid", "seq"),
+        # Never reuse the sequence numbers of replaced entries.
+        {"sqlite_autoincrement": True},
+    )
+
+    seq: int | None = Field(default=None, primary_key=True)
+    # Id of the writing transaction on Postgres, 0 on SQLite.
+    txid: int = Field(default=0, sa_type=BigInteger, sa_column_kwargs={"default": 0})
+
+
+# Full-text search lives outside the mapped columns so the models stay
+# portable: Postgres gets a generated tsvector column plus trigram index,
+# SQLite (used by the tests) an external-content FTS5 table kept in sync by
+# triggers. See products/search.py for the queries.
+_POSTGRES_FULLTEXT_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    """
+    ALTER TABLE product ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('swedish', coalesce(name, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(name, '')), 'A') ||
+        setweight(to_tsvector('swedish', coalesce(description, '')), 'B') ||
+        setweight(to_tsvector('english', coalesce(description, '')), 'B')
+    ) STORED
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_product_search_vector "
+    "ON product USING gin (search_vector)",
+    "CREATE INDEX IF NOT EXISTS ix_product_name_trgm "
+    "ON product USING gin (name gin_trgm_ops)",
+]
+
+_SQLITE_FULLTEXT_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS product_fts USING fts5("
+    "name, description, content='product', content_rowid='id')",
+    """
+    CREATE TRIGGER IF NOT EXISTS product_fts_insert AFTER INSERT ON product BEGIN
+        INSERT INTO product_fts(rowid, name, description)
+        VALUES (new.id, new.name, new.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS product_fts_delete AFTER DELETE ON product BEGIN
+        INSERT INTO product_fts(product_fts, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS product_fts_update AFTER UPDATE ON product BEGIN
+        INSERT INTO product_fts(product_fts, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO product_fts(rowid, name, description)
+        VALUES (new.id, new.name, new.description);
+    END
+    """,
+]
+
+for _statement in _POSTGRES_FULLTEXT_DDL:
+    event.listen(
+        Product.__table__,
+        "after_create",
+        DDL(_statement).execute_if(dialect="postgresql"),
+    )
+for _statement in _SQLITE_FULLTEXT_DDL:
+    event.listen(
+        Product.__table__,
+        "after_create",
+        DDL(_statement).execute_if(dialect="sqlite"),
+    )
+event.listen(
+    Product.__table__,
+    "after_drop",
+    DDL("DROP TABLE IF EXISTS product_fts").execute_if(dialect="sqlite"),
+)
@@ -0,0 +1,52 @@
+from sqlalchemy import func
+from sqlmodel import select
+
+from .models import Product, ProductConfig
+
+PRODUCT_COLUMNS = (
+    Product.name,
+    Product.product_group_id,
+    Product.price,
+    Product.stock_qty,
+    Product.description,
+    Product.sku,
+    Product.id,
+)
+
+
+def option_ids_column(dialect: str):
+    """Correlated subquery aggregating a product's option ids in SQL.
+
+    Postgres returns an array, SQLite a comma separated string; both are
+    turned into a list by `parse_option_ids`.
+    """
+    option_id = ProductConfig.variation_option_id
+    aggregate = (
+        func.array_agg(option_id)
+        if dialect == "postgresql"
+        else func.group_concat(option_id)
+    )
+    return (
+        select(aggregate)
+        .where(ProductConfig.product_id == Product.id)
+        .scalar_subquery()
+        .label("options")
+    )
+
+
+def parse_option_ids(value) -> list[int]:
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.split(",")
+    return sorted(int(option_id) for option_id in value)
+
+
+def product_rows_statement(dialect: str):
+    return select(*PRODUCT_COLUMNS, option_ids_column(dialect))
+
+
+def product_row_to_dict(row) -> dict:
+    data = row._asdict()
+    data["options"] = parse_option_ids(data["options"])
+    return data
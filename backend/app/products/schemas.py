@@ -1,3 +1,6 @@
+from datetime import datetime
+from typing import Literal
+
 from sqlalchemy.orm.base import PASSIVE_NO_RESULT
 from sqlalchemy.orm.state import PASSIVE_NO_INITIALIZE
 from sqlmodel import Field, SQLModel
@@ -25,6 +28,10 @@ class CategoryPublic(CategoryBase):
     id: int
 
 
+class CategoryTreeNode(CategoryPublic):
+    children: list["CategoryTreeNode"] = Field(default_factory=list)
+
+
 class ProductBase(SQLModel):
     name: str
     product_group_id: int
@@ -52,6 +59,50 @@ class ProductPublic(ProductBase):
     options: list[int] = Field(default_factory=list)
 
 
+class OptionFacet(SQLModel):
+    id: int
+    value: str
+    count: int
+
+
+class VariationFacet(SQLModel):
+    variation_id: int
+    name: str
+    options: list[OptionFacet] = Field(default_factory=list)
+
+
+class ProductSearchResult(SQLModel):
+    items: list[ProductPublic]
+    total: int
+    facets: list[VariationFacet] = Field(default_factory=list)
+
+
+class BulkRowError(SQLModel):
+    line: int
+    detail: str
+
+
+class BulkImportResult(SQLModel):
+    created: int = 0
+    errors: list[BulkRowError] = Field(default_factory=list)
+
+
+class ProductBatchUpdate(ProductUpdate):
+    # Matched by id when given, otherwise by SKU.
+    id: int | None = None
+
+
+class BatchItemResult(SQLModel):
+    line: int
+    status: Literal["updated", "not_found", "invalid", "failed"]
+    detail: str | None = None
+
+
+class BatchUpdateResult(SQLModel):
+    updated: int = 0
+    results: list[BatchItemResult] = Field(default_factory=list)
+
+
 class ProductGroupBase(SQLModel):
     name: str
 
@@ -69,6 +120,36 @@ class ProductGroupPublic(ProductGroupBase):
     category_id: int
 
 
+class VariantMatrixCreate(SQLModel):
+    # Option ids to combine, keyed by variation id.
+    options: dict[int, list[int]] = Field(min_length=1)
+    price: int
+    stock_qty: int = 0
+    description: str = ""
+    # str.format templates over {group}, {options} (all values, " / "
+    # separated) and each variation name, e.g. "OXF-{Size}-{Colour}".
+    name_template: str = "{group} {options}"
+    sku_template: str | None = None
+
+
+class VariantMatrixResult(SQLModel):
+    created: list[ProductPublic] = Field(default_factory=list)
+    skipped: int = 0
+
+
+class VariantEntry(SQLModel):
+    product_id: int
+    price: int
+    stock_qty: int
+    options: list[int]
+
+
+class VariantIndex(SQLModel):
+    product_group_id: int
+    # Keyed by the product's sorted option ids joined with ",", e.g. "1,5".
+    variants: dict[str, VariantEntry]
+
+
 class VariationBase(SQLModel):
     name: str
 
@@ -134,6 +215,96 @@ class ProductImageUpdate(ProductImageBase):
     pass
 
 
+class ProductImageBatchCreate(SQLModel):
+    items: list[ProductImageCreate] = Field(min_length=1, max_length=500)
+    # HEAD every URL before accepting the batch.
+    check_urls: bool = False
+
+
 class ProductImagePublic(ProductImageBase):
     id: int
     product_id: int
+
+
+class ProductOptionPublic(SQLModel):
+    id: int
+    value: str
+    variation_id: int
+    variation_name: str
+
+
+class ProductDetail(ProductPublic):
+    variation_options: list[ProductOptionPublic] = Field(default_factory=list)
+    images: list[ProductImagePublic] = Field(default_factory=list)
+
+
+class StockItem(SQLModel):
+    product_id: int
+    quantity: int = Field(gt=0)
+
+
+class StockReserveRequest(SQLModel):
+    items: list[StockItem] = Field(min_length=1)
+    ttl_seconds: int = Field(default=900, gt=0, le=86400)
+
+
+class StockTokenRequest(SQLModel):
+    token: str
+
+
+class StockReservationBase(SQLModel):
+    token: str = Field(unique=True)
+    status: str = "reserved"
+    expires_at: datetime
+
+
+class StockReservationPublic(StockReservationBase):
+    items: list[StockItem] = Field(default_factory=list)
+
+
+class StockReservationLineBase(SQLModel):
+    quantity: int
+
+
+class ListingOption(SQLModel):
+    variation_id: int
+    variation: str
+    option_id: int
+    value: str
+
+
+class ProductListingBase(SQLModel):
+    name: str
+    price: int
+    stock_qty: int
+    sku: str | None = None
+    product_group_id: int
+    product_group_name: str
+    category_id: int | None = None
+    category_name: str | None = None
+    image_url: str | None = None
+
+
+class ProductListingPublic(ProductListingBase):
+    product_id: int
+    options: list[ListingOption] = Field(default_factory=list)
+
+
+class ChangeBase(SQLModel):
+    entity: str
+    entity_id: int
+    deleted: bool = False
+    changed_at: datetime
+
+
+class ChangePublic(ChangeBase):
+    seq: int
+    # The row as its own endpoint returns it; None for deletions.
+    data: dict | None = None
+
+
+class ChangeFeed(SQLModel):
+    changes: list[ChangePublic] = Field(default_factory=list)
+    # Pass as `since` to continue after this page.
+    next_since: str | None = None
+    has_more: bool = False
@@ -0,0 +1,177 @@
+from collections import defaultdict
+
+from sqlalchemy import column, func, literal_column, table
+from sqlmodel import col, select
+
+from .models import (
+    Category,
+    Product,
+    ProductConfig,
+    ProductGroup,
+    Variation,
+    VariationOption,
+)
+from .schemas import OptionFacet, VariationFacet
+
+
+def category_subtree(category_id: int):
+    """Select the ids of a category and all its descendants."""
+    tree = (
+        select(Category.id)
+        .where(Category.id == category_id)
+        .cte("category_subtree", recursive=True)
+    )
+    # UNION (not UNION ALL) so a parent cycle cannot recurse forever.
+    tree = tree.union(
+        select(Category.id).join(tree, Category.category_parent_id == tree.c.id)
+    )
+    return select(tree.c.id)
+
+
+def _fts5_query(q: str) -> str:
+    # Quote every term so user input cannot use FTS5 query syntax.
+    return " ".join('"' + term.replace('"', '""') + '"' for term in q.split())
+
+
+def text_search(dialect: str, q: str, prefix: bool = False):
+    """Return (condition, order by expression) matching products against `q`.
+
+    Full-text mode matches name and description with Swedish and English
+    stemming, ranked by ts_rank (bm25 on SQLite). Prefix mode is for
+    type-ahead on every backend: it matches names that start with `q` as
+    typed, case-insensitively, shortest (closest to `q`) first. Descriptions
+    and words later in the name do not match.
+    """
+    if prefix:
+        pattern = q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        # Served by the trigram index on Postgres. SQLite only folds ASCII case.
+        condition = col(Product.name).ilike(pattern + "%", escape="\\")
+        return condition, func.length(Product.name)
+
+    if dialect == "postgresql":
+        vector = literal_column("product.search_vector")
+        query = func.websearch_to_tsquery("swedish", q).op("||")(
+            func.websearch_to_tsquery("english", q)
+        )
+        return vector.op("@@")(query), func.ts_rank(vector, query).desc()
+
+    fts = table("product_fts", column("rowid"), column("product_fts"))
+    match = fts.c.product_fts.match(_fts5_query(q))
+    condition = col(Product.id).in_(select(fts.c.rowid).where(match))
+    # bm25() is lower for better matches.
+    rank = (
+        select(func.bm25(literal_column("product_fts")))
+        .where(fts.c.rowid == Product.id, match)
+        .scalar_subquery()
+    )
+    return condition, rank
+
+
+def has_any_option(option_ids):
+    return col(Product.id).in_(
+        select(ProductConfig.product_id).where(
+            col(ProductConfig.variation_option_id).in_(option_ids)
+        )
+    )
+
+
+async def options_by_variation(session, option_ids) -> dict[int, list[int]] | None:
+    """Group the requested option ids by variation, or None if any is unknown."""
+    if not option_ids:
+        return {}
+    rows = (
+        await session.exec(
+            select(VariationOption.id, VariationOption.variation_id).where(
+                col(VariationOption.id).in_(option_ids)
+            )
+        )
+    ).all()
+    if len(rows) != len(set(option_ids)):
+        return None
+    grouped = defaultdict(list)
+    for option_id, variation_id in rows:
+        grouped[variation_id].append(option_id)
+    return dict(grouped)
+
+
+def product_filters(
+    *,
+    category_id: int | None = None,
+    product_group_id: int | None = None,
+    min_price: int | None = None,
+    max_price: int | None = None,
+    in_stock: bool | None = None,
+) -> list:
+    conditions = []
+    if category_id is not None:
+        conditions.append(
+            col(Product.product_group_id).in_(
+                select(ProductGroup.id).where(
+                    col(ProductGroup.category_id).in_(category_subtree(category_id))
+                )
+            )
+        )
+    if product_group_id is not None:
+        conditions.append(Product.product_group_id == product_group_id)
+    if min_price is not None:
+        conditions.append(Product.price >= min_price)
+    if max_price is not None:
+        conditions.append(Product.price <= max_price)
+    if in_stock is True:
+        conditions.append(Product.stock_qty > 0)
+    elif in_stock is False:
+        conditions.append(Product.stock_qty <= 0)
+    return conditions
+
+
+def _facet_statement(conditions):
+    return (
+        select(
+            Variation.id,
+            Variation.name,
+            VariationOption.id,
+            VariationOption.value,
+            func.count(ProductConfig.product_id),
+        )
+        .select_from(ProductConfig)
+        .join(Product, Product.id == ProductConfig.product_id)
+        .join(VariationOption, VariationOption.id == ProductConfig.variation_option_id)
+        .join(Variation, Variation.id == VariationOption.variation_id)
+        .where(*conditions)
+        .group_by(
+            Variation.id, Variation.name, VariationOption.id, VariationOption.value
+        )
+        .order_by(Variation.id, VariationOption.id)
+    )
+
+
+async def facet_counts(session, conditions, selected: dict[int, list[int]]):
+    """Count matching products per variation option.
+
+    Options of a variation the client already filters on are counted without
+    that variation's own filter, so picking "M" still shows how many products
+    come in "L". That costs one extra aggregate query per selected variation.
+    """
+    variation_filters = {v: has_any_option(ids) for v, ids in selected.items()}
+
+    unselected = col(VariationOption.variation_id).not_in(list(selected))
+    statements = [
+        _facet_statement([*conditions, *variation_filters.values(), unselected])
+    ]
+    for variation_id in selected:
+        others = [f for v, f in variation_filters.items() if v != variation_id]
+        own = VariationOption.variation_id == variation_id
+        statements.append(_facet_statement([*conditions, *others, own]))
+
+    rows = []
+    for statement in statements:
+        rows += (await session.exec(statement)).all()
+
+    facets: dict[int, VariationFacet] = {}
+    for variation_id, variation_name, option_id, value, count in rows:
+        facet = facets.setdefault(
+            variation_id,
+            VariationFacet(variation_id=variation_id, name=variation_name),
+        )
+        facet.options.append(OptionFacet(id=option_id, value=value, count=count))
+    return sorted(facets.values(), key=lambda f: f.variation_id)
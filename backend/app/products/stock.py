@@ -0,0 +1,218 @@
+import asyncio
+import logging
+import os
+import uuid
+from datetime import timedelta
+
+from sqlalchemy import case, func, text, update
+from sqlalchemy.exc import DBAPIError
+from sqlmodel import col, select
+
+from .changes import record_changes
+from .events import publish_product_changes
+from .listing import mark_listing_stale
+from .models import Product, StockReservation, StockReservationLine, utcnow
+from .schemas import StockItem
+
+logger = logging.getLogger(__name__)
+
+# How long a reservation waits for a row lock before giving up (Postgres
+# only), so a hot product cannot pile up blocked checkouts.
+STOCK_LOCK_TIMEOUT_MS = int(os.getenv("STOCK_LOCK_TIMEOUT_MS", "2000"))
+STOCK_SWEEP_INTERVAL = float(os.getenv("STOCK_SWEEP_INTERVAL", "30"))
+
+LOCK_NOT_AVAILABLE = "55P03"
+
+
+class StockError(Exception):
+    def __init__(self, detail: str, product_ids: list[int] | None = None):
+        super().__init__(detail)
+        self.detail = detail
+        self.product_ids = product_ids or []
+
+
+class UnknownProducts(StockError):
+    pass
+
+
+class InsufficientStock(StockError):
+    pass
+
+
+class StockBusy(StockError):
+    pass
+
+
+def merge_items(items: list[StockItem]) -> dict[int, int]:
+    """Sum quantities per product, in ascending product id order."""
+    quantities: dict[int, int] = {}
+    for item in items:
+        quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
+    return dict(sorted(quantities.items()))
+
+
+def is_lock_timeout(error: DBAPIError) -> bool:
+    return getattr(error.orig, "pgcode", None) == LOCK_NOT_AVAILABLE
+
+
+async def _lock_products(session, product_ids) -> list[int]:
+    """Lock the product rows in id order so concurrent callers cannot deadlock."""
+    if session.bind.dialect.name == "postgresql":
+        await session.exec(text(f"SET LOCAL lock_timeout = {STOCK_LOCK_TIMEOUT_MS}"))
+    return (
+        await session.exec(
+            select(Product.id)
+            .where(col(Product.id).in_(product_ids))
+            .order_by(Product.id)
+            .with_for_update()
+        )
+    ).all()
+
+
+async def _take_stock(session, quantities: dict[int, int]) -> set[int]:
+    """Decrement stock in one UPDATE, only on rows that have enough.
+
+    Returns the ids of the rows it changed.
+    """
+    delta = case(quantities, value=Product.id)
+    statement = (
+        update(Product)
+        .where(col(Product.id).in_(quantities), Product.stock_qty >= delta)
+        .values(stock_qty=Product.stock_qty - delta)
+        .returning(Product.id)
+        .execution_options(synchronize_session=False)
+    )
+    taken = set((await session.exec(statement)).scalars().all())
+    mark_listing_stale(session, products=taken)
+    record_changes(session, Product, taken)
+    publish_product_changes(session, taken)
+    return taken
+
+
+async def _return_stock(session, quantities: dict[int, int]):
+    delta = case(quantities, value=Product.id)
+    await session.exec(
+        update(Product)
+        .where(col(Product.id).in_(quantities))
+        .values(stock_qty=Product.stock_qty + delta)
+        .execution_options(synchronize_session=False)
+    )
+    mark_listing_stale(session, products=quantities)
+    record_changes(session, Product, quantities)
+    publish_product_changes(session, quantities)
+
+
+async def reserve_stock(session, items: list[StockItem], ttl_seconds: int):
+    quantities = merge_items(items)
+    try:
+        locked = await _lock_products(session, list(quantities))
+        unknown = set(quantities) - set(locked)
+        if unknown:
+            raise UnknownProducts("Invalid product IDs", sorted(unknown))
+
+        taken = await _take_stock(session, quantities)
+        short = set(quantities) - taken
+        if short:
+            raise InsufficientStock("Insufficient stock", sorted(short))
+
+        reservation = StockReservation(
+            token=uuid.uuid4().hex,
+            expires_at=utcnow() + timedelta(seconds=ttl_seconds),
+            lines=[
+                StockReservationLine(product_id=product_id, quantity=quantity)
+                for product_id, quantity in quantities.items()
+            ],
+        )
+        session.add(reservation)
+        # The commit flushes and writes the change log, which can time out
+        # on locks as well.
+        await session.commit()
+    except StockError:
+        await session.rollback()
+        raise
+    except DBAPIError as e:
+        await session.rollback()
+        if is_lock_timeout(e):
+            raise StockBusy("Stock is busy, try again", list(quantities))
+        raise
+    return reservation
+
+
+async def _transition(session, condition, status: str) -> list[int]:
+    """Move matching reserved reservations to `status`, returning their ids.
+
+    The conditional UPDATE makes each transition happen exactly once, however
+    many requests or sweepers race for it.
+    """
+    return (
+        (
+            await session.exec(
+                update(StockReservation)
+                .where(StockReservation.status == "reserved", condition)
+                .values(status=status)
+                .returning(StockReservation.id)
+                .execution_options(synchronize_session=False)
+            )
+        )
+        .scalars()
+        .all()
+    )
+
+
+async def release_reservations(session, condition) -> list[int]:
+    """Release matching reservations and put their stock back."""
+    ids = await _transition(session, condition, "released")
+    if ids:
+        rows = (
+            await session.exec(
+                select(
+                    StockReservationLine.product_id,
+                    func.sum(StockReservationLine.quantity),
+                )
+                .where(col(StockReservationLine.reservation_id).in_(ids))
+                .group_by(StockReservationLine.product_id)
+                .order_by(StockReservationLine.product_id)
+            )
+        ).all()
+        quantities = dict(rows)
+        await _lock_products(session, list(quantities))
+        await _return_stock(session, quantities)
+    await session.commit()
+    return ids
+
+
+async def commit_reservation(session, token: str) -> list[int]:
+    ids = await _transition(
+        session,
+        (StockReservation.token == token) & (StockReservation.expires_at > utcnow()),
+        "committed",
+    )
+    await session.commit()
+    return ids
+
+
+async def get_reservation(session, token: str):
+    return (
+        await session.exec(
+            select(StockReservation).where(StockReservation.token == token)
+        )
+    ).first()
+
+
+async def release_expired_reservations(session) -> list[int]:
+    return await release_reservations(session, StockReservation.expires_at <= utcnow())
+
+
+async def sweep_expired_reservations(
+    get_session, interval: float = STOCK_SWEEP_INTERVAL
+):
+    """Release expired reservations every `interval` seconds until cancelled."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            async for session in get_session():
+                released = await release_expired_reservations(session)
+                if released:
+                    logger.info("Released %d expired reservations", len(released))
+        except Exception:
+            logger.exception("Releasing expired stock reservations failed")
@@ -0,0 +1,104 @@
+import asyncio
+import ipaddress
+import os
+import socket
+
+import httpx
+
+IMAGE_URL_CHECK_CONCURRENCY = int(os.getenv("IMAGE_URL_CHECK_CONCURRENCY", "10"))
+IMAGE_URL_CHECK_TIMEOUT = float(os.getenv("IMAGE_URL_CHECK_TIMEOUT", "5"))
+IMAGE_URL_CHECK_MAX_REDIRECTS = int(os.getenv("IMAGE_URL_CHECK_MAX_REDIRECTS", "5"))
+
+
+class _Refused(Exception):
+    """A URL the checker will not request."""
+
+
+async def _resolve(host: str) -> list[str]:
+    infos = await asyncio.get_running_loop().getaddrinfo(
+        host, None, type=socket.SOCK_STREAM
+    )
+    return [info[4][0] for info in infos]
+
+
+def _is_public(address: str) -> bool:
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    if ip.version == 6 and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+class UrlChecker:
+    """Check that image URLs answer a HEAD request with an image.
+
+    The URLs come from API callers, so only http(s) URLs whose host resolves
+    to public addresses are requested, at the address that was checked.
+    Redirects are followed one hop at a time under the same rules.
+    """
+
+    def __init__(
+        self,
+        client: httpx.AsyncClient | None = None,
+        concurrency: int = IMAGE_URL_CHECK_CONCURRENCY,
+        resolve=_resolve,
+    ):
+        self.client = client or httpx.AsyncClient(timeout=IMAGE_URL_CHECK_TIMEOUT)
+        self.concurrency = concurrency
+        self.resolve = resolve
+
+    async def _head(self, url: httpx.URL) -> httpx.Response:
+        if url.scheme not in ("http", "https"):
+            raise _Refused(f"Unsupported scheme: {url.scheme}")
+        host = url.raw_host.decode("ascii")
+        try:
+            addresses = [str(ipaddress.ip_address(host))]
+        except ValueError:
+            addresses = await self.resolve(host)
+        if not addresses or not all(_is_public(a) for a in addresses):
+            raise _Refused("Not a public address")
+        # Pinned to the checked address, so the host cannot resolve to
+        # another one for the request itself.
+        return await self.client.head(
+            url.copy_with(host=addresses[0].split("%", 1)[0]),
+            headers={"Host": url.netloc.decode("ascii")},
+            extensions={"sni_hostname": host},
+        )
+
+    async def _check(self, semaphore: asyncio.Semaphore, url: str) -> str | None:
+        async with semaphore:
+            try:
+                url = httpx.URL(url)
+                for _ in range(IMAGE_URL_CHECK_MAX_REDIRECTS + 1):
+                    response = await self._head(url)
+                    if not response.is_redirect:
+                        break
+                    url = url.join(response.headers["location"])
+                else:
+                    return "Too many redirects"
+            except _Refused as e:
+                return str(e)
+            except (httpx.HTTPError, httpx.InvalidURL, OSError, ValueError) as e:
+                return f"Request failed: {type(e).__name__}"
+        if response.status_code >= 400:
+            return f"HTTP {response.status_code}"
+        content_type = response.headers.get("content-type", "")
+        if content_type and not content_type.startswith("image/"):
+            return f"Not an image: {content_type}"
+        return None
+
+    async def check(self, urls: list[str]) -> dict[str, str]:
+        """Return the failing URLs with the reason, at most `concurrency` at a time."""
+        urls = list(dict.fromkeys(urls))
+        semaphore = asyncio.Semaphore(self.concurrency)
+        results = await asyncio.gather(*(self._check(semaphore, url) for url in urls))
+        return {url: error for url, error in zip(urls, results) if error}
+
+
+_checker = None
+
+
+def get_url_checker() -> UrlChecker:
+    global _checker
+    if _checker is None:
+        _checker = UrlChecker()
+    return _checker
@@ -0,0 +1,264 @@
+import itertools
+import math
+import os
+import threading
+from collections import OrderedDict, defaultdict
+
+from fastapi import HTTPException, status
+from sqlalchemy import event, insert
+from sqlalchemy.exc import DBAPIError
+from sqlmodel import Session, col, select
+
+from ..cache import cache_versions, entity_cache
+from .changes import record_changes
+from .listing import mark_listing_stale, pop_refreshed_groups
+from .models import Product, ProductConfig, ProductGroup, Variation, VariationOption
+from .rows import option_ids_column, parse_option_ids
+from .schemas import ProductPublic, VariantMatrixCreate, VariantMatrixResult
+
+# Upper bound on the combinations one request may generate.
+VARIANT_MATRIX_MAX = int(os.getenv("VARIANT_MATRIX_MAX", "10000"))
+# Groups whose variant index is kept in memory, least recently used first out.
+VARIANT_INDEX_MAX_GROUPS = int(os.getenv("VARIANT_INDEX_MAX_GROUPS", "1024"))
+
+
+def _bad_request(detail) -> HTTPException:
+    return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=detail)
+
+
+async def _selected_options(session, selection: dict[int, list[int]]):
+    """Check the selection, returning (variation, options) pairs by variation id."""
+    variations = await entity_cache.get_many(session, Variation, selection)
+    missing = sorted(set(selection) - set(variations))
+    if missing:
+        raise _bad_request(
+            {"message": "Invalid variation IDs", "variation_ids": missing}
+        )
+    if not all(selection.values()):
+        raise _bad_request("Select at least one option per variation")
+
+    options = await entity_cache.get_many(
+        session, VariationOption, [o for ids in selection.values() for o in ids]
+    )
+    invalid = sorted(
+        option_id
+        for variation_id, ids in selection.items()
+        for option_id in ids
+        if option_id not in options or options[option_id].variation_id != variation_id
+    )
+    if invalid:
+        raise _bad_request({"message": "Invalid option IDs", "option_ids": invalid})
+
+    return [
+        (variations[v], [options[o] for o in dict.fromkeys(selection[v])])
+        for v in sorted(selection)
+    ]
+
+
+async def _existing_combinations(session, group_id: int, option_ids) -> set:
+    """Option sets of the group's products, restricted to `option_ids`."""
+    rows = await session.exec(
+        select(ProductConfig.product_id, ProductConfig.variation_option_id)
+        .join(Product, Product.id == ProductConfig.product_id)
+        .where(
+            Product.product_group_id == group_id,
+            col(ProductConfig.variation_option_id).in_(option_ids),
+        )
+    )
+    by_product = defaultdict(set)
+    for product_id, option_id in rows:
+        by_product[product_id].add(option_id)
+    return {frozenset(options) for options in by_product.values()}
+
+
+def _render(template: str, group: ProductGroup, variations, combination) -> str:
+    fields = {v.name: o.value for v, o in zip(variations, combination)}
+    fields |= {
+        "group": group.name,
+        "options": " / ".join(o.value for o in combination),
+    }
+    try:
+        return template.format_map(fields)
+    except (KeyError, IndexError, ValueError) as e:
+        raise _bad_request(f"Invalid template {template!r}: {e}")
+
+
+async def generate_variants(
+    session, group: ProductGroup, request: VariantMatrixCreate
+) -> VariantMatrixResult:
+    """Create a product for every missing combination of the selected options.
+
+    One query finds the combinations that already exist, then all new
+    products and their ProductConfig rows are inserted in one transaction.
+    """
+    selected = await _selected_options(session, request.options)
+    variations = [variation for variation, _ in selected]
+    size = math.prod(len(options) for _, options in selected)
+    if size > VARIANT_MATRIX_MAX:
+        raise _bad_request(
+            f"{size} combinations exceed the limit of {VARIANT_MATRIX_MAX}"
+        )
+
+    option_ids = [o.id for _, options in selected for o in options]
+    existing = await _existing_combinations(session, group.id, option_ids)
+
+    products, combinations, skipped = [], [], 0
+    for combination in itertools.product(*(options for _, options in selected)):
+        if frozenset(o.id for o in combination) in existing:
+            skipped += 1
+            continue
+        sku = None
+        if request.sku_template is not None:
+            sku = _render(request.sku_template, group, variations, combination)
+        products.append(
+            {
+                "name": _render(request.name_template, group, variations, combination),
+                "product_group_id": group.id,
+                "price": request.price,
+                "stock_qty": request.stock_qty,
+                "description": request.description,
+                "sku": sku,
+            }
+        )
+        combinations.append(sorted(o.id for o in combination))
+
+    if not products:
+        return VariantMatrixResult(skipped=skipped)
+
+    skus = [p["sku"] for p in products if p["sku"] is not None]
+    if len(set(skus)) != len(skus):
+        raise _bad_request("The SKU template gives the same SKU to several variants")
+    if skus:
+        taken = (
+            await session.exec(select(Product.sku).where(col(Product.sku).in_(skus)))
+        ).all()
+        if taken:
+            raise _bad_request({"message": "SKU already exists", "skus": sorted(taken)})
+
+    try:
+        inserted = await session.exec(
+            insert(Product).returning(Product.id, sort_by_parameter_order=True),
+            params=products,
+        )
+        ids = inserted.scalars().all()
+        await session.exec(
+            insert(ProductConfig),
+            params=[
+                {"product_id": product_id, "variation_option_id": option_id}
+                for product_id, options in zip(ids, combinations)
+                for option_id in options
+            ],
+        )
+        mark_listing_stale(session, products=ids)
+        record_changes(session, Product, ids)
+        await session.commit()
+    except DBAPIError as e:
+        await session.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Variant insert failed: {e.orig}",
+        )
+
+    return VariantMatrixResult(
+        created=[
+            ProductPublic(**product, id=product_id, options=options)
+            for product_id, product, options in zip(ids, products, combinations)
+        ],
+        skipped=skipped,
+    )
+
+
+def variant_key(option_ids) -> str:
+    return ",".join(str(option_id) for option_id in sorted(set(option_ids)))
+
+
+async def _build_variant_index(session, group_id: int) -> dict | None:
+    if await session.get(ProductGroup, group_id) is None:
+        return None
+    rows = await session.exec(
+        select(
+            Product.id,
+            Product.price,
+            Product.stock_qty,
+            option_ids_column(session.bind.dialect.name),
+        )
+        .where(Product.product_group_id == group_id)
+        .order_by(Product.id)
+    )
+    variants = {}
+    for product_id, price, stock_qty, options in rows:
+        options = parse_option_ids(options)
+        # Two products with the same options resolve to the older one.
+        variants.setdefault(
+            variant_key(options),
+            {
+                "product_id": product_id,
+                "price": price,
+                "stock_qty": stock_qty,
+                "options": options,
+            },
+        )
+    return variants
+
+
+class VariantIndexCache:
+    """Per-group maps from option combination to product.
+
+    An index is tagged with its group's version (see cache.cache_versions),
+    which commits bump for the groups their listing refresh touched (see
+    listing). A hit costs no query at all, and writes to one group leave the
+    other groups' indexes alone. Without versions every call builds anew.
+    """
+
+    def __init__(self, versions, max_groups: int = VARIANT_INDEX_MAX_GROUPS):
+        self.versions = versions
+        self.max_groups = max_groups
+        self._indexes: OrderedDict[int, tuple[tuple, dict]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _names(group_ids) -> list[str]:
+        return [f"variant_index:{group_id}" for group_id in group_ids]
+
+    async def get(self, session, group_id: int) -> dict | None:
+        """The group's variants by variant_key, or None if it does not exist."""
+        if self.versions is None:
+            return await _build_variant_index(session, group_id)
+        # Taken before building, so a commit racing the build makes the
+        # stored index stale rather than wrongly current.
+        version = await self.versions.get_async(self._names([group_id]))
+        with self._lock:
+            cached = self._indexes.get(group_id)
+            if cached is not None and cached[0] == version:
+                self._indexes.move_to_end(group_id)
+                return cached[1]
+
+        variants = await _build_variant_index(session, group_id)
+        if variants is not None:
+            with self._lock:
+                self._indexes[group_id] = (version, variants)
+                self._indexes.move_to_end(group_id)
+                while len(self._indexes) > self.max_groups:
+                    self._indexes.popitem(last=False)
+        return variants
+
+    def invalidate(self, group_ids):
+        if self.versions is not None:
+            self.versions.bump(self._names(group_ids))
+        with self._lock:
+            for group_id in group_ids:
+                self._indexes.pop(group_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._indexes.clear()
+
+
+variant_indexes = VariantIndexCache(cache_versions)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_refreshed_groups(session):
+    group_ids = pop_refreshed_groups(session)
+    if group_ids:
+        variant_indexes.invalidate(group_ids)
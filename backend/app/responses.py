@@ -0,0 +1,22 @@
+import orjson
+from fastapi import Response
+from fastapi.responses import JSONResponse
+
+
+class ORJSONResponse(JSONResponse):
+    """JSON response encoded with orjson.
+
+    Returning it from a handler skips FastAPI's response_model validation, so
+    only use it for content that is already in its public shape.
+    """
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content)
+
+
+def orjson_response(content, response: Response) -> ORJSONResponse:
+    """Wrap `content`, keeping the headers set on the injected `response`.
+
+    FastAPI only copies those headers onto responses it builds itself.
+    """
+    return ORJSONResponse(content, headers=dict(response.headers))
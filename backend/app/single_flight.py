@@ -0,0 +1,113 @@
+"""Request coalescing for hot read endpoints.
+
+Concurrent identical GETs, meaning the same handler with the same parameters,
+share one run of the handler. The first request runs it and the ones that
+arrive while it is in flight wait for its result, instead of all running the
+same queries at the same moment. Nothing is kept once the run finishes, so
+only overlapping requests are joined; a request may get the result of a run
+that started just before it arrived, as if it had come a moment earlier.
+
+Results are shared as they are: coalesced handlers must not return objects
+that a later step mutates per request.
+"""
+
+import asyncio
+import functools
+import inspect
+import os
+
+from fastapi import Request, Response
+from fastapi.params import Depends as DependsParam
+from prometheus_client import Counter
+
+from .sql_metrics import LabelCache
+
+SINGLE_FLIGHT = os.getenv("SINGLE_FLIGHT", "true").lower() in ("1", "true", "yes")
+
+SINGLE_FLIGHT_REQUESTS = Counter(
+    "single_flight_requests",
+    "Requests to coalesced handlers, by whether they ran the handler "
+    "(executed) or got the result of an identical request in flight (coalesced).",
+    ["handler", "outcome"],
+)
+single_flight_requests = LabelCache(SINGLE_FLIGHT_REQUESTS)
+
+
+class _LeaderCancelled(Exception):
+    """The running request went away; whoever waited on it runs on its own."""
+
+
+def _freeze(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def single_flight(func):
+    """Coalesce concurrent identical calls of a GET handler.
+
+    Goes below the @router.get decorator. Dependencies and the Request and
+    Response parameters are not part of the key; headers the running call
+    set on its Response are copied to the ones that waited for it.
+    """
+    excluded, response_param = set(), None
+    for name, parameter in inspect.signature(func).parameters.items():
+        annotation = parameter.annotation
+        if isinstance(parameter.default, DependsParam):
+            excluded.add(name)
+        elif inspect.isclass(annotation) and issubclass(annotation, Request):
+            excluded.add(name)
+        elif inspect.isclass(annotation) and issubclass(annotation, Response):
+            excluded.add(name)
+            response_param = name
+    handler = f"{func.__module__.rsplit('.', 1)[-1]}.{func.__name__}"
+    flights: dict[tuple, asyncio.Future] = {}
+
+    @functools.wraps(func)
+    async def wrapper(**kwargs):
+        if not SINGLE_FLIGHT:
+            return await func(**kwargs)
+        key = tuple(
+            sorted((n, _freeze(v)) for n, v in kwargs.items() if n not in excluded)
+        )
+        try:
+            hash(key)
+        except TypeError:
+            return await func(**kwargs)
+
+        while (flight := flights.get(key)) is not None:
+            try:
+                # Shielded: one waiter going away must not cancel the flight.
+                result, headers = await asyncio.shield(flight)
+            except _LeaderCancelled:
+                continue
+            except Exception:
+                single_flight_requests(handler, "coalesced").inc()
+                raise
+            single_flight_requests(handler, "coalesced").inc()
+            if response_param is not None:
+                kwargs[response_param].headers.update(headers)
+            return result
+
+        flight = flights[key] = asyncio.get_running_loop().create_future()
+        single_flight_requests(handler, "executed").inc()
+        try:
+            result = await func(**kwargs)
+        except asyncio.CancelledError:
+            flight.set_exception(_LeaderCancelled())
+            raise
+        except Exception as e:
+            flight.set_exception(e)
+            raise
+        finally:
+            del flights[key]
+            if flight.done():
+                # Marks an exception as retrieved when nobody was waiting.
+                flight.exception()
+        headers = {}
+        if response_param is not None:
+            headers = dict(kwargs[response_param].headers)
+        flight.set_result((result, headers))
+        return result
+
+    return wrapper
@@ -0,0 +1,186 @@
+"""Count SQL statements and database time per request.
+
+Engine events record every statement into the stats of the request being
+served, found through a context variable (the threadpool used by the sync
+session copies the request's context). The middleware reports the totals
+in a Server-Timing header and as Prometheus metrics per route, and logs
+requests that run the same statement over and over, the usual sign of a
+lazy load in a loop.
+"""
+
+import logging
+import os
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from prometheus_client import Counter as PrometheusCounter
+from prometheus_client import Histogram
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+# A request running one statement this many times is flagged as a likely N+1.
+SQL_REPEAT_THRESHOLD = int(os.getenv("SQL_REPEAT_THRESHOLD", "5"))
+
+
+class LabelCache:
+    """Memoise metric.labels(), which is slow enough to matter per request."""
+
+    def __init__(self, metric):
+        self.metric = metric
+        self._children = {}
+
+    def __call__(self, *labels):
+        child = self._children.get(labels)
+        if child is None:
+            child = self._children[labels] = self.metric.labels(*labels)
+        return child
+
+
+DB_QUERIES = Histogram(
+    "http_request_db_queries",
+    "SQL statements run per request.",
+    ["method", "route"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89),
+)
+DB_SECONDS = Histogram(
+    "http_request_db_seconds",
+    "Time spent executing SQL per request.",
+    ["method", "route"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+DB_REPEATED = PrometheusCounter(
+    "http_request_db_repeated_queries",
+    "Requests that repeated one statement at least SQL_REPEAT_THRESHOLD times.",
+    ["method", "route"],
+)
+db_queries = LabelCache(DB_QUERIES)
+db_seconds = LabelCache(DB_SECONDS)
+db_repeated = LabelCache(DB_REPEATED)
+
+
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements: Counter[str] = Counter()
+
+    def record(self, statement: str, seconds: float):
+        self.count += 1
+        self.seconds += seconds
+        self.statements[statement] += 1
+
+    def repeated(self, threshold: int = SQL_REPEAT_THRESHOLD) -> dict[str, int]:
+        return {s: n for s, n in self.statements.items() if n >= threshold}
+
+
+_current: ContextVar[QueryStats | None] = ContextVar("query_stats", default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, many):
+    if context is not None:
+        context._query_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, many):
+    stats = _current.get()
+    if stats is not None:
+        started = getattr(context, "_query_started", None)
+        elapsed = time.perf_counter() - started if started is not None else 0.0
+        stats.record(statement, elapsed)
+
+
+def instrument_engine(engine):
+    """Attach the statement hooks to a sync engine (or an async one's)."""
+    engine = getattr(engine, "sync_engine", engine)
+    if not event.contains(engine, "after_cursor_execute", _after_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    return engine
+
+
+def route_template(scope) -> str:
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+class QueryStatsMiddleware:
+    """Collect QueryStats for each HTTP request and report them."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = QueryStats()
+        token = _current.set(stats)
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                timing = (
+                    f'db;dur={stats.seconds * 1000:.2f};desc="{stats.count} queries"'
+                )
+                message["headers"] = [
+                    *message.get("headers", []),
+                    (b"server-timing", timing.encode()),
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
+            self._report(scope, stats)
+
+    @staticmethod
+    def _report(scope, stats: QueryStats):
+        method, route = scope["method"], route_template(scope)
+        db_queries(method, route).observe(stats.count)
+        db_seconds(method, route).observe(stats.seconds)
+
+        repeated = stats.repeated()
+        if repeated:
+            db_repeated(method, route).inc()
+            statement, times = max(repeated.items(), key=lambda item: item[1])
+            logger.warning(
+                "%s %s ran a statement %d times (likely N+1): %.200s",
+                method,
+                route,
+                times,
+                " ".join(statement.split()),
+            )
+
+
+@contextmanager
+def capture_queries(engine):
+    """Record every statement `engine` runs inside the block.
+
+    For tests; unlike the middleware this sees statements from any thread.
+    """
+    stats = QueryStats()
+    engine = getattr(engine, "sync_engine", engine)
+
+    def record(conn, cursor, statement, *args):
+        stats.record(statement, 0.0)
+
+    event.listen(engine, "after_cursor_execute", record)
+    try:
+        yield stats
+    finally:
+        event.remove(engine, "after_cursor_execute", record)
+
+
+@contextmanager
+def assert_max_queries(engine, maximum: int):
+    with capture_queries(engine) as stats:
+        yield stats
+    if stats.count > maximum:
+        statements = "\n".join(stats.statements)
+        raise AssertionError(
+            f"expected at most {maximum} queries, ran {stats.count}:\n{statements}"
+        )
@@ -0,0 +1,189 @@
+import os
+import uuid
+from pathlib import Path
+from typing import AsyncIterator
+
+from starlette.concurrency import run_in_threadpool
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local")
+STORAGE_DIR = os.getenv("STORAGE_DIR", "media/uploads")
+STORAGE_S3_BUCKET = os.getenv("STORAGE_S3_BUCKET", "webbfarstun")
+# Point this at MinIO or another S3-compatible stand-in for local runs.
+STORAGE_S3_ENDPOINT_URL = os.getenv("STORAGE_S3_ENDPOINT_URL")
+# Local copies of S3 objects, read by the image resizer.
+STORAGE_S3_CACHE_DIR = os.getenv("STORAGE_S3_CACHE_DIR", "media/originals")
+
+
+def _write_temp(path: Path) -> Path:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+
+
+class LocalStorage:
+    """Objects as files below `root`."""
+
+    def __init__(self, root: str | Path = STORAGE_DIR):
+        self.root = Path(root)
+
+    def _path(self, key: str) -> Path:
+        path = (self.root / key).resolve()
+        if not path.is_relative_to(self.root.resolve()):
+            raise ValueError(f"Invalid storage key: {key}")
+        return path
+
+    async def save(self, key: str, chunks: AsyncIterator[bytes]) -> int:
+        """Write the chunks to `key` as they arrive; returns the size."""
+        path = self._path(key)
+        temp = _write_temp(path)
+        size = 0
+        f = await run_in_threadpool(open, temp, "wb")
+        try:
+            async for chunk in chunks:
+                await run_in_threadpool(f.write, chunk)
+                size += len(chunk)
+            await run_in_threadpool(f.close)
+            await run_in_threadpool(os.replace, temp, path)
+        except BaseException:
+            f.close()
+            temp.unlink(missing_ok=True)
+            raise
+        return size
+
+    async def local_path(self, key: str) -> Path:
+        path = self._path(key)
+        if not path.exists():
+            raise FileNotFoundError(key)
+        return path
+
+    async def delete(self, key: str):
+        await run_in_threadpool(self._path(key).unlink, missing_ok=True)
+
+
+class S3Storage:
+    """Objects in an S3-compatible bucket, through any boto3 S3 client.
+
+    Uploads are sent as multipart uploads of PART_SIZE, so at most one part
+    is held in memory however large the file is.
+    """
+
+    PART_SIZE = 8 * 1024 * 1024
+
+    def __init__(self, client, bucket: str, cache_dir: str | Path):
+        self.client = client
+        self.bucket = bucket
+        self.cache = LocalStorage(cache_dir)
+
+    async def _upload_parts(self, key: str, first: bytes, chunks) -> list[dict]:
+        upload = await run_in_threadpool(
+            self.client.create_multipart_upload, Bucket=self.bucket, Key=key
+        )
+        upload_id, parts = upload["UploadId"], []
+
+        async def send(body: bytes):
+            part = await run_in_threadpool(
+                self.client.upload_part,
+                Bucket=self.bucket,
+                Key=key,
+                UploadId=upload_id,
+                PartNumber=len(parts) + 1,
+                Body=body,
+            )
+            parts.append({"PartNumber": len(parts) + 1, "ETag": part["ETag"]})
+
+        try:
+            buffer = bytearray(first)
+            async for chunk in chunks:
+                buffer += chunk
+                if len(buffer) >= self.PART_SIZE:
+                    await send(bytes(buffer))
+                    buffer.clear()
+            if buffer or not parts:
+                await send(bytes(buffer))
+            await run_in_threadpool(
+                self.client.complete_multipart_upload,
+                Bucket=self.bucket,
+                Key=key,
+                UploadId=upload_id,
+                MultipartUpload={"Parts": parts},
+            )
+        except BaseException:
+            await run_in_threadpool(
+                self.client.abort_multipart_upload,
+                Bucket=self.bucket,
+                Key=key,
+                UploadId=upload_id,
+            )
+            raise
+        return parts
+
+    async def save(self, key: str, chunks: AsyncIterator[bytes]) -> int:
+        # Files smaller than one part go up in a single PUT.
+        buffer = bytearray()
+        size = 0
+        async for chunk in chunks:
+            buffer += chunk
+            size += len(chunk)
+            if len(buffer) >= self.PART_SIZE:
+                break
+        else:
+            await run_in_threadpool(
+                self.client.put_object, Bucket=self.bucket, Key=key, Body=bytes(buffer)
+            )
+            return size
+
+        counted = _counting(chunks)
+        await self._upload_parts(key, bytes(buffer), counted)
+        return size + counted.size
+
+    async def local_path(self, key: str) -> Path:
+        path = self.cache._path(key)
+        if not path.exists():
+            temp = _write_temp(path)
+            try:
+                await run_in_threadpool(
+                    self.client.download_file, self.bucket, key, str(temp)
+                )
+                await run_in_threadpool(os.replace, temp, path)
+            finally:
+                temp.unlink(missing_ok=True)
+        return path
+
+    async def delete(self, key: str):
+        await run_in_threadpool(self.client.delete_object, Bucket=self.bucket, Key=key)
+        await self.cache.delete(key)
+
+
+class _counting:
+    """Pass chunks through, counting their bytes."""
+
+    def __init__(self, chunks: AsyncIterator[bytes]):
+        self.chunks = chunks
+        self.size = 0
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> bytes:
+        chunk = await anext(self.chunks)
+        self.size += len(chunk)
+        return chunk
+
+
+def _create_storage():
+    if STORAGE_BACKEND == "s3":
+        import boto3
+
+        client = boto3.client("s3", endpoint_url=STORAGE_S3_ENDPOINT_URL)
+        return S3Storage(client, STORAGE_S3_BUCKET, STORAGE_S3_CACHE_DIR)
+    return LocalStorage(STORAGE_DIR)
+
+
+_storage = None
+
+
+def get_storage():
+    """Dependency returning the configured storage backend."""
+    global _storage
+    if _storage is None:
+        _storage = _create_storage()
+    return _storage
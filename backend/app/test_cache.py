@@ -0,0 +1,148 @@
+import asyncio
+from types import SimpleNamespace
+
+from fakeredis import FakeAsyncRedis, FakeRedis, FakeServer
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from sqlmodel import Session
+
+from .cache import (
+    EntityCache,
+    MemoryBackend,
+    MemoryVersions,
+    RedisBackend,
+    RedisVersions,
+    cache_versions,
+)
+from .db import SyncSessionAdapter
+from .products.models import Category
+
+
+def redis_versions(server: FakeServer) -> RedisVersions:
+    return RedisVersions(FakeRedis(server=server), FakeAsyncRedis(server=server))
+
+
+def test_memory_backend_evicts_least_recently_used():
+    async def scenario():
+        backend = MemoryBackend(max_entries=2, ttl=60)
+        await backend.set_many({"a": "1", "b": "2"})
+        await backend.get_many(["a"])
+        await backend.set_many({"c": "3"})
+        return await backend.get_many(["a", "b", "c"])
+
+    assert asyncio.run(scenario()) == {"a": "1", "c": "3"}
+
+
+def test_memory_backend_expires_entries():
+    async def scenario():
+        backend = MemoryBackend(ttl=0)
+        await backend.set_many({"a": "1"})
+        return await backend.get_many(["a"])
+
+    assert asyncio.run(scenario()) == {}
+
+
+def test_entity_cache_reads_through_once(session: Session):
+    session.add_all([Category(name="Phones"), Category(name="Tablets")])
+    session.commit()
+    statements = []
+
+    def count(*args):
+        statements.append(args[2])
+
+    async def scenario(cache):
+        adapter = SyncSessionAdapter(session)
+        first = await cache.get_many(adapter, Category, [1, 2, 3])
+        second = await cache.get_many(adapter, Category, [2, 1])
+        return first, second
+
+    event.listen(session.get_bind(), "before_cursor_execute", count)
+    try:
+        for backend in (MemoryBackend(), RedisBackend(FakeAsyncRedis())):
+            statements.clear()
+            first, second = asyncio.run(
+                scenario(EntityCache(backend, MemoryVersions()))
+            )
+            assert sorted(first) == [1, 2]
+            assert second[2].name == "Tablets"
+            assert len(statements) == 1
+    finally:
+        event.remove(session.get_bind(), "before_cursor_execute", count)
+
+
+def test_entity_cache_drops_rows_read_before_a_concurrent_write(session: Session):
+    category = Category(name="Phones")
+    session.add(category)
+    session.commit()
+    category_id = category.id
+    cache = EntityCache(MemoryBackend(), cache_versions)
+
+    class WriteDuringRead(SyncSessionAdapter):
+        async def exec(self, statement, **kwargs):
+            rows = (await super().exec(statement, **kwargs)).all()
+            # Another request updates the row, commits and invalidates it
+            # before this read stores what it got.
+            with Session(session.get_bind()) as writer:
+                writer.get(Category, category_id).name = "Mobiles"
+                writer.commit()
+            await cache.invalidate(Category, category_id)
+            return SimpleNamespace(all=lambda: rows)
+
+    async def scenario():
+        racing = await cache.get(WriteDuringRead(session), Category, category_id)
+        session.expire_all()
+        return racing, await cache.get(
+            SyncSessionAdapter(session), Category, category_id
+        )
+
+    racing, current = asyncio.run(scenario())
+    assert racing.name == "Phones"
+    assert current.name == "Mobiles"
+
+
+def test_patch_invalidates_cached_category(client: TestClient):
+    category_id = client.post("/categories/", json={"name": "Phones"}).json()["id"]
+    assert client.get(f"/categories/{category_id}").json()["name"] == "Phones"
+
+    client.patch(
+        f"/categories/{category_id}",
+        json={
+            "name": "Mobiles",
+            "description": None,
+            "category_parent_id": None,
+            "is_container": False,
+        },
+    )
+
+    assert client.get(f"/categories/{category_id}").json()["name"] == "Mobiles"
+
+
+def test_delete_invalidates_cached_subcategories(client: TestClient):
+    parent = client.post("/categories/", json={"name": "Clothes"}).json()["id"]
+    child = client.post(
+        "/categories/", json={"name": "Tops", "category_parent_id": parent}
+    ).json()["id"]
+    assert client.get(f"/categories/{child}").status_code == 200
+
+    client.delete(f"/categories/{parent}")
+
+    assert client.get(f"/categories/{child}").status_code == 404
+
+
+def test_redis_versions_are_shared_and_restart_under_a_new_epoch():
+    server = FakeServer()
+    worker_a = redis_versions(server)
+    worker_b = redis_versions(server)
+
+    worker_a.bump(["table:product", "table:product"])
+    epoch, versions = worker_b.get(["table:product", "table:category"])
+    assert versions == {"table:product": 2, "table:category": 0}
+    assert worker_a.get(["table:product"]) == (epoch, {"table:product": 2})
+    assert asyncio.run(worker_a.get_async(["table:product"])) == (
+        epoch,
+        {"table:product": 2},
+    )
+
+    worker_b.clear()
+    worker_a.bump(["table:product", "table:product"])
+    assert worker_b.get(["table:product"])[0] != epoch
@@ -0,0 +1,41 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlmodel import create_engine
+
+from . import db
+from .db import InstrumentedQueuePool, pool_status
+
+
+def test_instrumented_pool_records_checkouts_and_timeouts():
+    engine = create_engine(
+        "sqlite://",
+        poolclass=InstrumentedQueuePool,
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=0.01,
+    )
+
+    with engine.connect() as connection:
+        connection.execute(text("select 1"))
+        assert pool_status(engine.pool)["checked_out"] == 1
+        with pytest.raises(PoolTimeoutError):
+            engine.connect()
+
+    status = pool_status(engine.pool)
+    assert status["checked_out"] == 0
+    assert status["checkouts"] == 2
+    assert status["timeouts"] == 1
+    assert status["wait_seconds_max"] >= 0.01
+
+
+def test_get_pool_reports_created_engines(client: TestClient, monkeypatch):
+    engine = create_engine("sqlite://", poolclass=InstrumentedQueuePool)
+    monkeypatch.setattr(db, "_engine", engine)
+
+    response = client.get("/internal/pool")
+
+    assert response.status_code == 200
+    assert response.json()["sync"]["size"] == 5
+    assert "async" not in response.json()
@@ -0,0 +1,70 @@
+from fakeredis import FakeServer
+from fastapi.testclient import TestClient
+
+from . import http_cache
+from .test_cache import redis_versions
+
+
+def test_conditional_get_returns_304_until_table_changes(client: TestClient):
+    client.post("/categories/", json={"name": "Phones"})
+
+    first = client.get("/categories/")
+    etag = first.headers["ETag"]
+    assert first.headers["Cache-Control"].startswith("public")
+
+    cached = client.get("/categories/", headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.content == b""
+
+    client.post("/categories/", json={"name": "Tablets"})
+    changed = client.get("/categories/", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert len(changed.json()) == 2
+    assert changed.headers["ETag"] != etag
+
+
+def test_conditional_get_skips_database(client: TestClient, max_queries):
+    etag = client.get("/categories/").headers["ETag"]
+
+    with max_queries(0):
+        response = client.get("/categories/", headers={"If-None-Match": etag})
+
+    assert response.status_code == 304
+
+
+def test_etag_depends_on_url(client: TestClient):
+    all_tags = client.get("/categories/").headers["ETag"]
+    page_tag = client.get("/categories/", params={"limit": 1}).headers["ETag"]
+    assert all_tags != page_tag
+
+
+def test_writes_are_not_conditional(client: TestClient):
+    response = client.post(
+        "/categories/", json={"name": "Phones"}, headers={"If-None-Match": "*"}
+    )
+    assert response.status_code == 201
+    assert "ETag" not in response.headers
+
+
+def test_etags_follow_writes_of_other_workers(client: TestClient, monkeypatch):
+    server = FakeServer()
+    monkeypatch.setattr(http_cache, "table_versions", redis_versions(server))
+    other_worker = redis_versions(server)
+
+    etag = client.get("/categories/").headers["ETag"]
+    assert (
+        client.get("/categories/", headers={"If-None-Match": etag}).status_code == 304
+    )
+
+    other_worker.bump(["table:category"])
+    response = client.get("/categories/", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+
+
+def test_no_etags_without_shared_versions(client: TestClient, monkeypatch):
+    monkeypatch.setattr(http_cache, "table_versions", None)
+
+    response = client.get("/categories/", headers={"If-None-Match": "*"})
+
+    assert response.status_code == 200
+    assert "ETag" not in response.headers
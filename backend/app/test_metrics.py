@@ -0,0 +1,93 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+from sqlmodel import create_engine
+
+from . import db
+from .db import InstrumentedQueuePool
+
+
+def sample(name: str, **labels) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_requests_are_labelled_by_route_template(client: TestClient):
+    route = "/categories/{category_id}"
+    ok_before = sample(
+        "http_request_duration_seconds_count", method="GET", route=route, status="200"
+    )
+    missing_before = sample(
+        "http_request_duration_seconds_count", method="GET", route=route, status="404"
+    )
+    size_before = sample("http_response_size_bytes_sum", method="GET", route=route)
+
+    category_id = client.post("/categories/", json={"name": "Phones"}).json()["id"]
+    body = client.get(f"/categories/{category_id}").content
+    client.get("/categories/12345")
+
+    assert sample(
+        "http_request_duration_seconds_count", method="GET", route=route, status="200"
+    ) == (ok_before + 1)
+    assert sample(
+        "http_request_duration_seconds_count", method="GET", route=route, status="404"
+    ) == (missing_before + 1)
+    assert sample(
+        "http_response_size_bytes_sum", method="GET", route=route
+    ) > size_before + len(body)
+    assert sample("http_requests_in_progress", method="GET") == 0
+
+
+def test_metrics_include_pool_and_process_stats(client: TestClient, monkeypatch):
+    engine = create_engine("sqlite://", poolclass=InstrumentedQueuePool)
+    monkeypatch.setattr(db, "_engine", engine)
+    with engine.connect():
+        pass
+
+    text = client.get("/metrics").text
+
+    assert f'db_pool_checkouts_total{{engine="sync",pid="{os.getpid()}"}} 1.0' in text
+    assert 'db_pool_size{engine="sync"' in text
+    assert "process_resident_memory_bytes" in text
+    assert 'http_request_duration_seconds_bucket{le="0.005",method="GET"' in text
+
+
+WORKER = """
+from fastapi.testclient import TestClient
+from app.main import app
+
+client = TestClient(app)
+for path in {paths!r}:
+    client.get(path)
+print(client.get("/metrics").text)
+"""
+
+
+def test_metrics_aggregate_worker_processes(tmp_path: Path):
+    env = os.environ | {"PROMETHEUS_MULTIPROC_DIR": str(tmp_path)}
+    backend = Path(__file__).resolve().parent.parent
+
+    def worker(*paths):
+        return subprocess.run(
+            [sys.executable, "-c", WORKER.format(paths=list(paths))],
+            cwd=backend,
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+
+    worker("/", "/goodbye")
+    text = worker("/")
+
+    assert (
+        'http_request_duration_seconds_count{method="GET",route="/",status="200"} 2.0'
+        in text
+    )
+    assert (
+        'http_request_duration_seconds_count{method="GET",route="/goodbye",status="200"} 1.0'
+        in text
+    )
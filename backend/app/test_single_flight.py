@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+from fastapi import Depends, HTTPException, Response
+from prometheus_client import REGISTRY
+
+from .single_flight import single_flight
+
+
+def coalesced(handler: str) -> float:
+    labels = {"handler": handler, "outcome": "coalesced"}
+    return REGISTRY.get_sample_value("single_flight_requests_total", labels) or 0
+
+
+def get_session():
+    pass
+
+
+def test_concurrent_identical_calls_share_one_run():
+    calls = []
+
+    @single_flight
+    async def get_item(
+        *, item_id: int, response: Response, session=Depends(get_session)
+    ):
+        calls.append(item_id)
+        await release.wait()
+        if item_id == 404:
+            raise HTTPException(status_code=404)
+        response.headers["X-Next-Cursor"] = f"after-{item_id}"
+        return {"id": item_id}
+
+    async def run():
+        responses = [Response() for _ in range(6)]
+        tasks = [
+            asyncio.ensure_future(get_item(item_id=1 if i < 5 else 2, response=r))
+            for i, r in enumerate(responses)
+        ]
+        missing = [
+            asyncio.ensure_future(get_item(item_id=404, response=Response()))
+            for _ in range(2)
+        ]
+        await asyncio.sleep(0)
+        release.set()
+        results = await asyncio.gather(*tasks)
+        errors = await asyncio.gather(*missing, return_exceptions=True)
+        return results, responses, errors
+
+    release = asyncio.Event()
+    before = coalesced("test_single_flight.get_item")
+    results, responses, errors = asyncio.run(run())
+
+    assert sorted(calls) == [1, 2, 404]
+    assert results == [{"id": 1}] * 5 + [{"id": 2}]
+    assert results[0] is results[4]
+    assert [r.headers["x-next-cursor"] for r in responses[:5]] == ["after-1"] * 5
+    assert all(isinstance(e, HTTPException) and e.status_code == 404 for e in errors)
+    assert coalesced("test_single_flight.get_item") == before + 5
+
+
+def test_waiters_run_on_their_own_when_the_first_call_is_cancelled():
+    calls = 0
+
+    @single_flight
+    async def get_item(*, item_id: int):
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return item_id
+
+    async def run():
+        first = asyncio.ensure_future(get_item(item_id=1))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(get_item(item_id=1))
+        await asyncio.sleep(0)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(run()) == 1
+    assert calls == 2
@@ -0,0 +1,60 @@
+import logging
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+from sqlalchemy import text
+
+from .conftest import engine_test
+from .sql_metrics import QueryStatsMiddleware
+
+
+def test_server_timing_reports_queries(client: TestClient, max_queries):
+    category_id = client.post("/categories/", json={"name": "Phones"}).json()["id"]
+    client.post(
+        "/categories/", json={"name": "Pixel", "category_parent_id": category_id}
+    )
+
+    with max_queries(2):
+        response = client.get(f"/categories/{category_id}/subcategories")
+
+    assert response.status_code == 200
+    assert response.headers["Server-Timing"].startswith("db;dur=")
+    assert response.headers["Server-Timing"].endswith('desc="2 queries"')
+
+
+def test_queries_are_counted_per_route_template(client: TestClient):
+    labels = {"method": "GET", "route": "/categories/{category_id}"}
+    before = REGISTRY.get_sample_value("http_request_db_queries_count", labels) or 0
+
+    category_id = client.post("/categories/", json={"name": "Phones"}).json()["id"]
+    client.get(f"/categories/{category_id}")
+    client.get("/categories/12345")
+
+    after = REGISTRY.get_sample_value("http_request_db_queries_count", labels)
+    assert after == before + 2
+    assert "http_request_db_seconds_bucket" in client.get("/metrics").text
+
+
+def test_repeated_statements_are_flagged(caplog):
+    app = FastAPI()
+    app.add_middleware(QueryStatsMiddleware)
+
+    @app.get("/loop")
+    def loop():
+        with engine_test.connect() as conn:
+            for i in range(5):
+                conn.execute(text("SELECT :i"), {"i": i})
+
+    labels = {"method": "GET", "route": "/loop"}
+    before = (
+        REGISTRY.get_sample_value("http_request_db_repeated_queries_total", labels) or 0
+    )
+    with caplog.at_level(logging.WARNING, logger="app.sql_metrics"):
+        response = TestClient(app).get("/loop")
+
+    assert response.headers["Server-Timing"].endswith('desc="5 queries"')
+    assert REGISTRY.get_sample_value(
+        "http_request_db_repeated_queries_total", labels
+    ) == (before + 1)
+    assert "likely N+1" in caplog.text
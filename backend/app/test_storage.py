@@ -0,0 +1,66 @@
+import asyncio
+
+import boto3
+import pytest
+from moto import mock_aws
+
+from .storage import LocalStorage, S3Storage
+
+
+async def chunked(data: bytes, size: int = 64 * 1024):
+    for start in range(0, len(data), size):
+        yield data[start : start + size]
+
+
+def test_local_storage_round_trip(tmp_path):
+    storage = LocalStorage(tmp_path)
+    data = bytes(range(256)) * 1000
+
+    async def scenario():
+        assert await storage.save("a/b/c.bin", chunked(data)) == len(data)
+        path = await storage.local_path("a/b/c.bin")
+        assert path.read_bytes() == data
+        await storage.delete("a/b/c.bin")
+        assert not path.exists()
+        with pytest.raises(ValueError):
+            await storage.save("../outside", chunked(data))
+
+    asyncio.run(scenario())
+
+
+def test_local_storage_discards_failed_uploads(tmp_path):
+    storage = LocalStorage(tmp_path)
+
+    async def failing():
+        yield b"partial"
+        raise RuntimeError("client went away")
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(storage.save("a.bin", failing()))
+    assert not [p for p in tmp_path.rglob("*") if p.is_file()]
+
+
+@mock_aws
+def test_s3_storage_streams_multipart_uploads(tmp_path, monkeypatch):
+    client = boto3.client("s3", region_name="us-east-1")
+    client.create_bucket(Bucket="images")
+    storage = S3Storage(client, "images", tmp_path)
+    monkeypatch.setattr(S3Storage, "PART_SIZE", 5 * 2**20)
+    large = b"x" * (11 * 2**20)
+    small = b"small image"
+
+    async def scenario():
+        assert await storage.save("large.bin", chunked(large)) == len(large)
+        assert await storage.save("small.bin", chunked(small)) == len(small)
+        path = await storage.local_path("small.bin")
+        assert path.read_bytes() == small
+        await storage.delete("small.bin")
+        assert not path.exists()
+
+    asyncio.run(scenario())
+
+    head = client.head_object(Bucket="images", Key="large.bin")
+    assert head["ContentLength"] == len(large)
+    assert head["ETag"].endswith('-3"')
+    listed = client.list_objects_v2(Bucket="images")["Contents"]
+    assert [o["Key"] for o in listed] == ["large.bin"]
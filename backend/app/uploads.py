@@ -0,0 +1,96 @@
+from typing import AsyncIterator
+
+from fastapi import HTTPException, Request, status
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+
+class MultipartFile:
+    """Stream one file field of a multipart/form-data request.
+
+    The body is parsed as it arrives and the field's bytes are handed on
+    chunk by chunk, so an upload is never held in memory or spooled to a
+    temporary file. Other fields are skipped.
+    """
+
+    def __init__(self, request: Request, field: str, max_bytes: int):
+        content_type, options = parse_options_header(
+            request.headers.get("content-type", "")
+        )
+        if content_type != b"multipart/form-data" or b"boundary" not in options:
+            raise HTTPException(
+                status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                detail="Expected multipart/form-data",
+            )
+        self.request = request
+        self.field = field.encode()
+        self.max_bytes = max_bytes
+        self.boundary = options[b"boundary"]
+        self.filename: str | None = None
+        self.content_type: str | None = None
+
+    async def chunks(self) -> AsyncIterator[bytes]:
+        headers: dict[bytes, bytes] = {}
+        header = [b"", b""]
+        current = {"wanted": False, "seen": False}
+        pending: list[bytes] = []
+
+        def on_part_begin():
+            headers.clear()
+            current["wanted"] = False
+
+        def on_header_field(data, start, end):
+            header[0] += data[start:end]
+
+        def on_header_value(data, start, end):
+            header[1] += data[start:end]
+
+        def on_header_end():
+            headers[header[0].lower()] = header[1]
+            header[0] = header[1] = b""
+
+        def on_headers_finished():
+            _, options = parse_options_header(headers.get(b"content-disposition", b""))
+            if options.get(b"name") == self.field and not current["seen"]:
+                current["wanted"] = current["seen"] = True
+                self.filename = options.get(b"filename", b"").decode() or None
+                self.content_type = headers.get(b"content-type", b"").decode() or None
+
+        def on_part_data(data, start, end):
+            if current["wanted"]:
+                pending.append(data[start:end])
+
+        def on_part_end():
+            current["wanted"] = False
+
+        parser = MultipartParser(
+            self.boundary,
+            {
+                "on_part_begin": on_part_begin,
+                "on_header_field": on_header_field,
+                "on_header_value": on_header_value,
+                "on_header_end": on_header_end,
+                "on_headers_finished": on_headers_finished,
+                "on_part_data": on_part_data,
+                "on_part_end": on_part_end,
+            },
+        )
+
+        size = 0
+        async for body in self.request.stream():
+            parser.write(body)
+            for chunk in pending:
+                size += len(chunk)
+                if size > self.max_bytes:
+                    raise HTTPException(
+                        status_code=status.HTTP_413_CONTENT_TOO_LARGE,
+                        detail=f"File is larger than {self.max_bytes} bytes",
+                    )
+                yield chunk
+            pending.clear()
+        parser.finalize()
+
+        if not current["seen"]:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Missing file field '{self.field.decode()}'",
+            )
@@ -0,0 +1,190 @@
+"""Seed a synthetic catalog of configurable size for the benchmarks.
+
+Rows are inserted with explicit ids in batches, so the shape of the catalog
+is known up front and seeding 100k products takes seconds, not minutes.
+"""
+
+from dataclasses import asdict, dataclass
+
+from sqlalchemy import insert, text
+from sqlmodel import Session, SQLModel
+
+from app.products.changes import backfill_change_log
+from app.products.listing import rebuild_product_listing
+from app.products.models import (
+    Category,
+    Product,
+    ProductConfig,
+    ProductGroup,
+    ProductImage,
+    Variation,
+    VariationOption,
+)
+
+BATCH_SIZE = 1000
+
+
+@dataclass
+class CatalogShape:
+    category_depth: int = 3
+    category_fanout: int = 4
+    groups: int = 50
+    products: int = 2000
+    variations: int = 3
+    options: int = 5
+    images: int = 2
+    stock_qty: int = 1_000_000
+
+
+@dataclass
+class Catalog:
+    """Ids of the seeded rows, for building request URLs."""
+
+    category_ids: list[int]
+    leaf_category_ids: list[int]
+    group_ids: list[int]
+    variation_ids: list[int]
+    option_ids: list[int]
+    product_ids: list[int]
+    image_ids: list[int]
+    shape: CatalogShape
+
+    def summary(self) -> dict:
+        return {
+            "categories": len(self.category_ids),
+            "groups": len(self.group_ids),
+            "variations": len(self.variation_ids),
+            "options": len(self.option_ids),
+            "products": len(self.product_ids),
+            "images": len(self.image_ids),
+            "shape": asdict(self.shape),
+        }
+
+
+def _insert(session: Session, model, rows: list[dict]):
+    for start in range(0, len(rows), BATCH_SIZE):
+        session.execute(insert(model), rows[start : start + BATCH_SIZE])
+
+
+def _category_rows(depth: int, fanout: int) -> tuple[list[dict], list[int]]:
+    rows, level = [], [None]
+    for d in range(depth):
+        next_level = []
+        for parent_id in level:
+            for _ in range(fanout):
+                category_id = len(rows) + 1
+                rows.append(
+                    {
+                        "id": category_id,
+                        "name": f"Category {category_id}",
+                        "description": f"Level {d} category",
+                        "category_parent_id": parent_id,
+                        "is_container": d < depth - 1,
+                    }
+                )
+                next_level.append(category_id)
+        level = next_level
+    return rows, level
+
+
+def _reset_sequences(session: Session):
+    """Move Postgres id sequences past the explicitly inserted ids."""
+    for model in (
+        Category,
+        ProductGroup,
+        Variation,
+        VariationOption,
+        Product,
+        ProductImage,
+    ):
+        table = model.__tablename__
+        session.execute(
+            text(
+                f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                f"coalesce(max(id), 0) + 1, false) FROM {table}"
+            )
+        )
+
+
+def seed_catalog(engine, shape: CatalogShape) -> Catalog:
+    """Recreate all tables on `engine` and fill them. Destroys existing data."""
+    SQLModel.metadata.drop_all(engine)
+    SQLModel.metadata.create_all(engine)
+
+    categories, leaves = _category_rows(shape.category_depth, shape.category_fanout)
+    groups = [
+        {
+            "id": i + 1,
+            "name": f"Group {i + 1}",
+            "category_id": leaves[i % len(leaves)],
+        }
+        for i in range(shape.groups)
+    ]
+    variations = [
+        {"id": i + 1, "name": f"Variation {i + 1}", "category_id": 1}
+        for i in range(shape.variations)
+    ]
+    options = [
+        {
+            "id": v * shape.options + o + 1,
+            "value": f"Option {v + 1}.{o + 1}",
+            "variation_id": v + 1,
+        }
+        for v in range(shape.variations)
+        for o in range(shape.options)
+    ]
+    products = [
+        {
+            "id": i + 1,
+            "name": f"Product {i + 1}",
+            "product_group_id": groups[i % len(groups)]["id"],
+            "price": (i * 37) % 1000 + 1,
+            "stock_qty": shape.stock_qty,
+            "description": f"Synthetic benchmark product number {i + 1}.",
+            "sku": f"BENCH-{i + 1}",
+        }
+        for i in range(shape.products)
+    ]
+    # Every product gets one option of each variation.
+    configs = [
+        {
+            "product_id": i + 1,
+            "variation_option_id": v * shape.options + (i + v) % shape.options + 1,
+        }
+        for i in range(shape.products)
+        for v in range(shape.variations)
+    ]
+    images = [
+        {
+            "id": i * shape.images + n + 1,
+            "url": f"https://img.example.com/{i + 1}/{n}.jpg",
+            "product_id": i + 1,
+        }
+        for i in range(shape.products)
+        for n in range(shape.images)
+    ]
+
+    with Session(engine) as session:
+        _insert(session, Category, categories)
+        _insert(session, ProductGroup, groups)
+        _insert(session, Variation, variations)
+        _insert(session, VariationOption, options)
+        _insert(session, Product, products)
+        _insert(session, ProductConfig, configs)
+        _insert(session, ProductImage, images)
+        if engine.dialect.name == "postgresql":
+            _reset_sequences(session)
+        rebuild_product_listing(session)
+        session.commit()
+        backfill_change_log(session)
+
+    return Catalog(
+        category_ids=[row["id"] for row in categories],
+        leaf_category_ids=leaves,
+        group_ids=[row["id"] for row in groups],
+        variation_ids=[row["id"] for row in variations],
+        option_ids=[row["id"] for row in options],
+        product_ids=[row["id"] for row in products],
+        image_ids=[row["id"] for row in images],
+        shape=shape,
+    )
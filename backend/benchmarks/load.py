@@ -0,0 +1,377 @@
+"""Drive every router with concurrent clients and report latency.
+
+The app runs in-process behind httpx's ASGI transport, against a freshly
+seeded database: a temporary SQLite file by default, or any SQLAlchemy URL
+given with --database-url (a scratch Postgres database, say; its tables are
+dropped and recreated). Each scenario is one endpoint hit --requests times
+by --concurrency clients; the results are written as JSON so two runs can
+be compared with --baseline.
+
+Run from backend/:
+
+    python -m benchmarks.load --products 2000 --concurrency 16 --output run.json
+    python -m benchmarks.load --baseline run.json --scenario products
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Callable
+
+import httpx
+from sqlalchemy import event
+from sqlmodel import Session, create_engine
+
+from app.cache import entity_cache
+from app.db import SyncSessionAdapter, get_session
+from app.main import app
+from app.products.category_tree import invalidate_category_tree
+
+from .catalog import Catalog, CatalogShape, seed_catalog
+
+
+@dataclass
+class Scenario:
+    name: str
+    method: str
+    # Builds (url, json body) for one request.
+    request: Callable[[Catalog, random.Random], tuple[str, dict | None]]
+    write: bool = False
+
+
+def _get(path: str):
+    return lambda catalog, rng: (path, None)
+
+
+SCENARIOS = [
+    Scenario("products.list", "GET", _get("/products/?limit=100")),
+    Scenario(
+        "products.list_by_price",
+        "GET",
+        _get("/products/?limit=100&sort=price"),
+    ),
+    Scenario(
+        "products.get",
+        "GET",
+        lambda c, rng: (f"/products/{rng.choice(c.product_ids)}", None),
+    ),
+    Scenario(
+        "products.search_facets",
+        "GET",
+        lambda c, rng: (
+            f"/products/search?category_id={rng.choice(c.category_ids)}"
+            f"&options={rng.choice(c.option_ids)}&limit=24",
+            None,
+        ),
+    ),
+    Scenario(
+        "products.search_text",
+        "GET",
+        lambda c, rng: (
+            f"/products/search?q=product+{rng.choice(c.product_ids)}&limit=24",
+            None,
+        ),
+    ),
+    Scenario(
+        "products.typeahead",
+        "GET",
+        _get("/products/search?q=Prod&prefix=true&limit=10"),
+    ),
+    Scenario(
+        "catalog.listing",
+        "GET",
+        lambda c, rng: (
+            f"/catalog/listing?category_id={rng.choice(c.leaf_category_ids)}"
+            "&sort=price&limit=24",
+            None,
+        ),
+    ),
+    Scenario("changes.feed", "GET", _get("/changes/?limit=500")),
+    Scenario("categories.list", "GET", _get("/categories/")),
+    Scenario("categories.tree", "GET", _get("/categories/tree")),
+    Scenario(
+        "categories.get",
+        "GET",
+        lambda c, rng: (f"/categories/{rng.choice(c.category_ids)}", None),
+    ),
+    Scenario(
+        "categories.subcategories",
+        "GET",
+        lambda c, rng: (
+            f"/categories/{rng.choice(c.category_ids)}/subcategories",
+            None,
+        ),
+    ),
+    Scenario("product_groups.list", "GET", _get("/product-groups/?limit=100")),
+    Scenario(
+        "product_groups.get",
+        "GET",
+        lambda c, rng: (f"/product-groups/{rng.choice(c.group_ids)}", None),
+    ),
+    Scenario(
+        "product_groups.variants",
+        "GET",
+        lambda c, rng: (f"/product-groups/{rng.choice(c.group_ids)}/variants", None),
+    ),
+    Scenario("variations.list", "GET", _get("/variations/?limit=100")),
+    Scenario(
+        "variations.get",
+        "GET",
+        lambda c, rng: (f"/variations/{rng.choice(c.variation_ids)}", None),
+    ),
+    Scenario("variation_options.list", "GET", _get("/variation-options/?limit=100")),
+    Scenario(
+        "variation_options.get",
+        "GET",
+        lambda c, rng: (f"/variation-options/{rng.choice(c.option_ids)}", None),
+    ),
+    Scenario("product_images.list", "GET", _get("/product-images/?limit=100")),
+    Scenario(
+        "product_images.get",
+        "GET",
+        lambda c, rng: (f"/product-images/{rng.choice(c.image_ids)}", None),
+    ),
+    Scenario(
+        "products.update",
+        "PATCH",
+        lambda c, rng: (
+            f"/products/{rng.choice(c.product_ids)}",
+            {"price": rng.randint(1, 1000)},
+        ),
+        write=True,
+    ),
+    Scenario(
+        "stock.reserve",
+        "POST",
+        lambda c, rng: (
+            "/stock/reserve",
+            {
+                "items": [
+                    {"product_id": product_id, "quantity": 1}
+                    for product_id in rng.sample(c.product_ids, 3)
+                ]
+            },
+        ),
+        write=True,
+    ),
+]
+
+
+class StatementCounter:
+    """Count SQL statements sent through an engine, from any thread."""
+
+    def __init__(self, engine):
+        self.count = 0
+        self._lock = threading.Lock()
+        event.listen(engine, "after_cursor_execute", self._record)
+
+    def _record(self, *args):
+        with self._lock:
+            self.count += 1
+
+
+def percentile(sorted_values: list[float], p: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    rank = max(math.ceil(p / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+async def run_scenario(
+    client: httpx.AsyncClient,
+    scenario: Scenario,
+    catalog: Catalog,
+    counter: StatementCounter,
+    *,
+    requests: int,
+    concurrency: int,
+    warmup: int,
+    seed: int,
+) -> dict:
+    rng = random.Random(seed)
+
+    async def send():
+        url, body = scenario.request(catalog, rng)
+        start = time.perf_counter()
+        response = await client.request(scenario.method, url, json=body)
+        return time.perf_counter() - start, response.status_code
+
+    for _ in range(warmup):
+        await send()
+
+    timings, statuses = [], {}
+    remaining = requests
+
+    async def worker():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            elapsed, status_code = await send()
+            timings.append(elapsed * 1000)
+            statuses[status_code] = statuses.get(status_code, 0) + 1
+
+    statements_before = counter.count
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - start
+    statements = counter.count - statements_before
+
+    timings.sort()
+    return {
+        "method": scenario.method,
+        "requests": len(timings),
+        "errors": sum(n for code, n in statuses.items() if code >= 400),
+        "statuses": {str(code): n for code, n in sorted(statuses.items())},
+        "rps": len(timings) / wall,
+        "mean_ms": statistics.fmean(timings),
+        "p50_ms": percentile(timings, 50),
+        "p95_ms": percentile(timings, 95),
+        "p99_ms": percentile(timings, 99),
+        "max_ms": timings[-1],
+        "statements_per_request": statements / len(timings),
+    }
+
+
+def compare(results: dict, baseline: dict) -> dict:
+    """Ratios of this run over the baseline, per scenario (>1 means slower)."""
+    changes = {}
+    for name, current in results["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if not previous:
+            continue
+        changes[name] = {
+            "p50": current["p50_ms"] / previous["p50_ms"],
+            "p95": current["p95_ms"] / previous["p95_ms"],
+            "p99": current["p99_ms"] / previous["p99_ms"],
+            "rps": previous["rps"] / current["rps"],
+            "statements_per_request": current["statements_per_request"]
+            - previous["statements_per_request"],
+        }
+    return changes
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args, engine, catalog: Catalog, scenarios: list[Scenario]) -> dict:
+    async def session_override():
+        with Session(engine, expire_on_commit=False) as session:
+            yield SyncSessionAdapter(session)
+
+    app.dependency_overrides[get_session] = session_override
+    invalidate_category_tree()
+    await entity_cache.backend.clear()
+
+    counter = StatementCounter(engine)
+    transport = httpx.ASGITransport(app=app)
+    results = {}
+    try:
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://bench"
+        ) as client:
+            for i, scenario in enumerate(scenarios):
+                results[scenario.name] = await run_scenario(
+                    client,
+                    scenario,
+                    catalog,
+                    counter,
+                    requests=args.requests,
+                    concurrency=args.concurrency,
+                    warmup=args.warmup,
+                    seed=args.seed + i,
+                )
+    finally:
+        app.dependency_overrides.pop(get_session, None)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--database-url", help="defaults to a temporary SQLite file")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        help="only run scenarios whose name contains this (repeatable)",
+    )
+    parser.add_argument("--no-writes", action="store_true")
+    parser.add_argument("--output", help="write the JSON results here")
+    parser.add_argument("--baseline", help="JSON results of an earlier run")
+    for field, default in vars(CatalogShape()).items():
+        parser.add_argument(
+            "--" + field.replace("_", "-"), type=int, default=default, dest=field
+        )
+    args = parser.parse_args()
+
+    scenarios = [
+        s
+        for s in SCENARIOS
+        if (not args.scenario or any(f in s.name for f in args.scenario))
+        and not (args.no_writes and s.write)
+    ]
+    shape = CatalogShape(**{f: getattr(args, f) for f in vars(CatalogShape())})
+
+    with tempfile.TemporaryDirectory() as tmp:
+        url = args.database_url or f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        connect_args = {"check_same_thread": False} if url.startswith("sqlite") else {}
+        engine = create_engine(url, connect_args=connect_args)
+
+        seed_start = time.perf_counter()
+        catalog = seed_catalog(engine, shape)
+        seed_seconds = time.perf_counter() - seed_start
+
+        scenario_results = asyncio.run(run(args, engine, catalog, scenarios))
+        engine.dispose()
+
+    results = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "dialect": engine.dialect.name,
+            "seed_seconds": seed_seconds,
+        },
+        "params": {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "warmup": args.warmup,
+            "seed": args.seed,
+        },
+        "catalog": catalog.summary(),
+        "scenarios": scenario_results,
+    }
+    if args.baseline:
+        with open(args.baseline) as f:
+            results["baseline"] = compare(results, json.load(f))
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
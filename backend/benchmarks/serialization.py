@@ -0,0 +1,136 @@
+"""Compare the two ways of serving a page of GET /products/.
+
+"orm" is the previous path: ORM objects with selectinload'ed options, a
+ProductPublic per row and pydantic serialization of the list. "rows" is the
+current path: plain rows with options aggregated in SQL, encoded by orjson.
+
+Run from backend/:
+
+    python -m benchmarks.serialization --products 100 --options 4
+"""
+
+import argparse
+import json
+import statistics
+import time
+
+import orjson
+from pydantic import TypeAdapter
+from sqlalchemy.orm import selectinload
+from sqlalchemy.pool import StaticPool
+from sqlmodel import Session, SQLModel, create_engine, select
+
+from app.products.models import (
+    Category,
+    Product,
+    ProductGroup,
+    Variation,
+    VariationOption,
+)
+from app.products.rows import product_row_to_dict, product_rows_statement
+from app.products.schemas import ProductPublic
+
+
+def seed(engine, products: int, options: int):
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        category = Category(name="Bench")
+        session.add(category)
+        session.commit()
+        group = ProductGroup(name="Bench", category_id=category.id)
+        variation = Variation(name="Bench", category_id=category.id)
+        session.add_all([group, variation])
+        session.commit()
+        option_rows = [
+            VariationOption(value=str(i), variation_id=variation.id)
+            for i in range(options)
+        ]
+        session.add_all(option_rows)
+        session.commit()
+        session.add_all(
+            Product(
+                name=f"Product {i}",
+                product_group_id=group.id,
+                price=i,
+                stock_qty=i,
+                description="Benchmark product " * 4,
+                sku=f"BENCH-{i}",
+                variation_options=option_rows,
+            )
+            for i in range(products)
+        )
+        session.commit()
+
+
+def orm_page(session: Session, limit: int) -> bytes:
+    products = session.exec(
+        select(Product)
+        .order_by(Product.id)
+        .limit(limit)
+        .options(selectinload(Product.variation_options))
+    ).all()
+    page = [
+        ProductPublic(**p.model_dump(), options=[o.id for o in p.variation_options])
+        for p in products
+    ]
+    return TypeAdapter(list[ProductPublic]).dump_json(page)
+
+
+def rows_page(session: Session, limit: int) -> bytes:
+    statement = product_rows_statement("sqlite").order_by(Product.id).limit(limit)
+    rows = session.exec(statement).all()
+    return orjson.dumps([product_row_to_dict(row) for row in rows])
+
+
+def measure(engine, page, limit: int, repeat: int) -> dict:
+    timings = []
+    for _ in range(repeat):
+        # A fresh session per page, like a request, so the identity map of
+        # the ORM path starts empty every time.
+        with Session(engine) as session:
+            start = time.perf_counter()
+            page(session, limit)
+            timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        "mean_ms": statistics.fmean(timings),
+        "p50_ms": timings[len(timings) // 2],
+        "p95_ms": timings[int(len(timings) * 0.95) - 1],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--products", type=int, default=100)
+    parser.add_argument("--options", type=int, default=4)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    seed(engine, args.products, args.options)
+
+    with Session(engine) as session:
+        assert orjson.loads(orm_page(session, args.limit)) == orjson.loads(
+            rows_page(session, args.limit)
+        )
+
+    orm = measure(engine, orm_page, args.limit, args.repeat)
+    rows = measure(engine, rows_page, args.limit, args.repeat)
+    print(
+        json.dumps(
+            {
+                "params": vars(args),
+                "orm": orm,
+                "rows": rows,
+                "speedup": orm["mean_ms"] / rows["mean_ms"],
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()